@@ -1,6 +1,5 @@
 import pandas as pd
 import os
-import joblib
 import numpy as np
 import xgboost as xgb
 from pathlib import Path
@@ -9,391 +8,531 @@ from sklearn.model_selection import (train_test_split, GridSearchCV)
 from sklearn.metrics import (classification_report, mean_squared_error, r2_score,)
 from sklearn.utils import resample
 from sklearn.preprocessing import StandardScaler
-from sklearn.ensemble import (GradientBoostingRegressor)
 from sklearn.pipeline import Pipeline
 from xgboost import (XGBClassifier, XGBRegressor)
 from sklearn.impute import SimpleImputer
 from datetime import datetime
+import armazenamento
+import dimensoes
+import normalizacao_datas
+import particoes_oper
+import cubo_kpi
+import publicacao
+import camada_geo
+import geometrias_mapa
+import matriz_atributos
+import agendador_treino
+import busca_hiperparametros
+import regressores
+import codificacao_categorica
+from controle_incremental import inicio_janela_treino
 
 # Carregar .env e arquivo OPER
 load_dotenv('credenciais_arquivos.env')
 DIRETORIO_SAIDA = Path(os.getenv("DIRETORIO_SAIDA"))
+# TRIMESTRES_TREINO=N treina os modelos só com as OS dos N últimos trimestres (0 = histórico todo). As previsões,
+# o ML_dataframe_OPER.csv e o cubo continuam cobrindo o histórico inteiro
+TRIMESTRES_TREINO = int(os.getenv("TRIMESTRES_TREINO", "0"))
+
+# Busca de hiperparâmetros do deslocamento: "grid" (padrão, GridSearchCV completo, como antes) ou "halving"
+# (eliminação sucessiva com parada antecipada, dentro de ORCAMENTO_BUSCA_SEGUNDOS/ORCAMENTO_BUSCA_AJUSTES).
+# O halving muda o modelo (tree_method hist, subamostras, parada antecipada) e fica opcional até o benchmark justificar
+BUSCA_DESLOCAMENTO = os.getenv("BUSCA_DESLOCAMENTO", "grid")
+ARQUIVO_BUSCA_DESLOCAMENTO = "busca_deslocamento.json"
+
+# Limite de TEMPO_RESPOSTA (minutos) de cada STATUS usado no filtro de outliers do preparar_dados
+LIMITES_TEMPO_RESPOSTA = {"EMERGENCIAL": 1440, "COMERCIAL": 7200}
+
+def carregar_particoes():
+    # Mesma ordem do in4 (emergencial e depois comercial); partições cujo TEMPO_RESPOSTA mínimo já passa do
+    # limite do STATUS nem são lidas (o preparar_dados descartaria essas linhas de qualquer forma)
+    partes = [particoes_oper.carregar(status=[status], filtros=[("TEMPO_RESPOSTA", "<=", limite)])
+              for status, limite in LIMITES_TEMPO_RESPOSTA.items()]
+    partes = [parte for parte in partes if parte is not None]
+    return pd.concat(partes, ignore_index=True) if partes else None
 
 def carregar_OPER():
-    arquivo = DIRETORIO_SAIDA / "dataframe_OPER.csv"
-    if arquivo.exists():
-        df = pd.read_csv(arquivo, sep=";", encoding_errors='ignore')
-        colunas_data = ['DATA SOLICITACAO', 'DATA INICIO DESLOCAMENTO', 
-                       'DATA FIM DESLOCAMENTO', 'DATA INICIO EXECUCAO', 
+    # Dimensões de texto como Categorical; os rótulos só voltam a ser texto no CSV final
+    if particoes_oper.PARTICIONAR_OPER and particoes_oper.existe():
+        df = carregar_particoes()
+    else:
+        df = armazenamento.carregar_intermediario("dataframe_OPER", manter_categorias=True)
+    if df is not None:
+        df = dimensoes.carregar_registro().categorizar(df)
+        colunas_data = ['DATA SOLICITACAO', 'DATA INICIO DESLOCAMENTO',
+                       'DATA FIM DESLOCAMENTO', 'DATA INICIO EXECUCAO',
                        'DATA FIM EXECUCAO']
-        for col in colunas_data: 
-            df[col] = pd.to_datetime(df[col], errors='coerce')
+        df = normalizacao_datas.normalizar_datas(df, colunas_data, "dataframe_OPER")
         return df
     return None
 
-print("Carregando e preparando os dados...")
-df_original = carregar_OPER()
+def preparar_dados(df_original):
+    # Os filtros abaixo já devolvem DataFrames novos: o df_original não é alterado e não precisa de cópia
+    df = df_original
+
+    # Filtrar outliers para ID_STATUS 1002 (excluindo tempo de resposta acima de 24h) e ID_STATUS 1001 (acima de 5 dias)
+    print("\nAnalisando outliers com tempo de resposta por ID_STATUS...")
+
+    # Para ID_STATUS 1002 (EMERGENCIAL), excluindo tempo de resposta acima de 24h (1440 minutos)
+    df_1002 = df[(df['ID STATUS'] == 1002) & (df['TEMPO_RESPOSTA'] <= LIMITES_TEMPO_RESPOSTA["EMERGENCIAL"])]
+
+    # Para ID_STATUS 1001 (COMERCIAL), excluindo tempo de resposta acima de 5 dias (7200 minutos)
+    df_1001 = df[(df['ID STATUS'] == 1001) & (df['TEMPO_RESPOSTA'] <= LIMITES_TEMPO_RESPOSTA["COMERCIAL"])]
+
+    # Concatenando os dois dataframes de volta para obter o conjunto de dados completo, sem os outliers.
+    df = pd.concat([df_1002, df_1001])
+
+    print(f"\nTotal de registros após remoção dos outliers: {df.shape[0]}")
+
+    # Para verificar os filtros e os outliers
+    outliers_1002 = df_1002[df_1002['TEMPO_RESPOSTA'] > 1440]
+    outliers_1001 = df_1001[df_1001['TEMPO_RESPOSTA'] > 7200]
+
+    print(f"\nOutliers para ID_STATUS 1002 (acima de 24h): {outliers_1002.shape[0]}")
+    print(f"\nOutliers para ID_STATUS 1001 (acima de 5 dias): {outliers_1001.shape[0]}")
+
+    # Cria DURACAO_SERVICO, TEMPO_DESLOCAMENTO e TEMPO_EXECUCAO
+    df['DURACAO_SERVICO'] = (df['DATA FIM EXECUCAO'] - df['DATA INICIO DESLOCAMENTO']).dt.total_seconds() / 60
+    df['TEMPO_EXECUCAO'] = (df['DATA FIM EXECUCAO'] - df['DATA INICIO EXECUCAO']).dt.total_seconds() / 60
+    df['TEMPO_DESLOCAMENTO'] = (df['DATA FIM DESLOCAMENTO'] - df['DATA INICIO DESLOCAMENTO']).dt.total_seconds() / 60
+    df = df[df['TEMPO_DESLOCAMENTO'] <= 120]
+
+    df['DIA_SEMANA_FIM_DESLOCAMENTO'] = df['DATA FIM DESLOCAMENTO'].dt.dayofweek  # Dia da semana (0=segunda, 6=domingo)
+    df['MES_FIM_DESLOCAMENTO'] = df['DATA FIM DESLOCAMENTO'].dt.month  # Mês (1=Janeiro, 12=Dezembro)
+
+    df['DIA_SEMANA_IN_DESLOCAMENTO'] = df['DATA INICIO DESLOCAMENTO'].dt.dayofweek  # Dia da semana (0=segunda, 6=domingo)
+    df['MES_IN_DESLOCAMENTO'] = df['DATA INICIO DESLOCAMENTO'].dt.month  # Mês (1=Janeiro, 12=Dezembro)
+    df = df[df['TEMPO_DESLOCAMENTO'] <= 120]
+
+    df['DATA_PREVISTA'] = df['DATA SOLICITACAO'] + pd.DateOffset(months=3)
+    df['DIA_SEMANA'] = df['DATA SOLICITACAO'].dt.dayofweek  # Dia da semana (0=segunda, 6=domingo)
+    df['MES'] = df['DATA SOLICITACAO'].dt.month  # Mês (1=Janeiro, 12=Dezembro)
+    df['TRIMESTRE_SOLICITACAO'] = df['DATA SOLICITACAO'].dt.to_period('Q')
+    # Adiciona uma coluna com a data do próximo trimestre
+    df['TRIMESTRE_PREVISTO'] = df['DATA SOLICITACAO'] + pd.DateOffset(months=3)
+    df['TRIMESTRE_PREVISTO'] = df['TRIMESTRE_PREVISTO'].dt.to_period('Q')
+    trimestre_limite = (pd.Timestamp.today() + pd.DateOffset(months=3)).to_period('Q')
+    # Linhas do "df_futuro" como máscara sobre o df (os modelos leem as linhas pela matriz de atributos)
+    futuro = (df['TRIMESTRE_PREVISTO'] <= trimestre_limite).to_numpy()
+    df['TRIMESTRE_PREVISTO'] = df['TRIMESTRE_PREVISTO'].astype('int64')
+
+    # Obter o mês atual
+    mes_atual = datetime.now().month
+
+    # Verificar o próximo mês
+    if mes_atual == 4:  # Abril
+        proximo_mes = 5  # Maio
+    elif mes_atual == 5:  # Maio
+        proximo_mes = 6  # Junho
+    elif mes_atual == 6:  # Junho
+        proximo_mes = 7  # Julho
+    else:
+        proximo_mes = None  # Caso seja após julho ou outro mês que você não quer prever
+
+    print(proximo_mes)
+    return df, futuro
+
+def linhas_modelos(df, futuro):
+    # Linhas de cada modelo (posições no df, na ordem de uso); None = todas
+    status = df['ID STATUS'].to_numpy()
+
+    print("\nBalanceando Comercial e Emergencial separadamente...")
+    efetividade = np.concatenate([balancear_efetividade_por_tipo(df, np.flatnonzero(futuro & (status == 1001)), "COMERCIAL"),
+                                  balancear_efetividade_por_tipo(df, np.flatnonzero(futuro & (status == 1002)), "EMERGENCIAL")])
+
+    resposta = np.flatnonzero(futuro & df[['TEMPO_RESPOSTA'] + matriz_atributos.COLUNAS_BASE].notna().all(axis=1).to_numpy())
+
+    # Remover outliers extremos de deslocamento (média e desvio do df inteiro, como antes)
+    media = df['TEMPO_DESLOCAMENTO'].mean()
+    desvio = df['TEMPO_DESLOCAMENTO'].std()
+    deslocamento = np.flatnonzero((df['TEMPO_DESLOCAMENTO'] < media + 2 * desvio).to_numpy())
+
+    return {"duracao": None, "efetividade": efetividade, "resposta": resposta, "tempo_ideal": None,
+            "deslocamento": deslocamento}
+
+def janela_treino(df):
+    # Posições das linhas dentro da janela de TRIMESTRES_TREINO (None = todas). Aplicada aqui, sobre o df
+    # preparado, vale igual com o dataframe_OPER vindo do in4 em memória ou lido do disco
+    inicio = inicio_janela_treino()
+    if inicio is None:
+        return None
+    janela = np.flatnonzero((df['DATA SOLICITACAO'] >= pd.Timestamp(inicio)).to_numpy())
+    print(f"\nJanela de treino: OS a partir de {inicio} ({len(janela)} de {len(df)} linhas)")
+    return janela
+
+def montar_matriz(df, futuro):
+    return matriz_atributos.construir(df, linhas_modelos(df, futuro), janela=janela_treino(df))
+
+def _linhas(X, linhas):
+    # Seleção de linhas de DataFrame ou matriz esparsa (None = todas)
+    if linhas is None:
+        return X
+    return X.iloc[linhas] if isinstance(X, pd.DataFrame) else X[linhas]
 
-# Criar cópia base pra modelos e análises
-df = df_original.copy()
-
-# Filtrar outliers para ID_STATUS 1002 (excluindo tempo de resposta acima de 24h) e ID_STATUS 1001 (acima de 5 dias)
-print("\nAnalisando outliers com tempo de resposta por ID_STATUS...")
-
-# Para ID_STATUS 1002 (EMERGENCIAL), excluindo tempo de resposta acima de 24h (1440 minutos)
-df_1002 = df[(df['ID STATUS'] == 1002) & (df['TEMPO_RESPOSTA'] <= 1440)]
-
-# Para ID_STATUS 1001 (COMERCIAL), excluindo tempo de resposta acima de 5 dias (7200 minutos)
-df_1001 = df[(df['ID STATUS'] == 1001) & (df['TEMPO_RESPOSTA'] <= 7200)]
-
-# Concatenando os dois dataframes de volta para obter o conjunto de dados completo, sem os outliers.
-df = pd.concat([df_1002, df_1001])
-
-print(f"\nTotal de registros após remoção dos outliers: {df.shape[0]}")
-
-# Para verificar os filtros e os outliers
-outliers_1002 = df_1002[df_1002['TEMPO_RESPOSTA'] > 1440]
-outliers_1001 = df_1001[df_1001['TEMPO_RESPOSTA'] > 7200]
-
-print(f"\nOutliers para ID_STATUS 1002 (acima de 24h): {outliers_1002.shape[0]}")
-print(f"\nOutliers para ID_STATUS 1001 (acima de 5 dias): {outliers_1001.shape[0]}")
-
-# Cria DURACAO_SERVICO, TEMPO_DESLOCAMENTO e TEMPO_EXECUCAO
-df['DURACAO_SERVICO'] = (df['DATA FIM EXECUCAO'] - df['DATA INICIO DESLOCAMENTO']).dt.total_seconds() / 60
-df['TEMPO_EXECUCAO'] = (df['DATA FIM EXECUCAO'] - df['DATA INICIO EXECUCAO']).dt.total_seconds() / 60
-df['TEMPO_DESLOCAMENTO'] = (df['DATA FIM DESLOCAMENTO'] - df['DATA INICIO DESLOCAMENTO']).dt.total_seconds() / 60
-df = df[df['TEMPO_DESLOCAMENTO'] <= 120]
-
-df['DIA_SEMANA_FIM_DESLOCAMENTO'] = df['DATA FIM DESLOCAMENTO'].dt.dayofweek  # Dia da semana (0=segunda, 6=domingo)
-df['MES_FIM_DESLOCAMENTO'] = df['DATA FIM DESLOCAMENTO'].dt.month  # Mês (1=Janeiro, 12=Dezembro)
+# ======================================================================
+# 1. MODELO DE PREVISÃO DE DURAÇÃO DO SERVIÇO
+# ======================================================================
+def treinar_duracao(matriz, nucleos=1):
+    print("\n=== MODELO DE DURAÇÃO DO SERVIÇO ===")
+    # Todas as linhas: X é uma visão das colunas da matriz, sem cópia (o treino usa só a janela de TRIMESTRES_TREINO)
+    X_duracao, y_duracao = matriz.dados("duracao")
 
-df['DIA_SEMANA_IN_DESLOCAMENTO'] = df['DATA INICIO DESLOCAMENTO'].dt.dayofweek  # Dia da semana (0=segunda, 6=domingo)
-df['MES_IN_DESLOCAMENTO'] = df['DATA INICIO DESLOCAMENTO'].dt.month  # Mês (1=Janeiro, 12=Dezembro)
-df = df[df['TEMPO_DESLOCAMENTO'] <= 120]
+    # Divisão dos dados
+    X_train_duracao, X_test_duracao, y_train_duracao, y_test_duracao = train_test_split(
+        *matriz.dados("duracao", treino=True), test_size=0.2, random_state=42)
 
-df['DATA_PREVISTA'] = df['DATA SOLICITACAO'] + pd.DateOffset(months=3)
-df['DIA_SEMANA'] = df['DATA SOLICITACAO'].dt.dayofweek  # Dia da semana (0=segunda, 6=domingo)
-df['MES'] = df['DATA SOLICITACAO'].dt.month  # Mês (1=Janeiro, 12=Dezembro)
-df['TRIMESTRE_SOLICITACAO'] = df['DATA SOLICITACAO'].dt.to_period('Q')
-# Adiciona uma coluna com a data do próximo trimestre
-df['TRIMESTRE_PREVISTO'] = df['DATA SOLICITACAO'] + pd.DateOffset(months=3)
-df['TRIMESTRE_PREVISTO'] = df['TRIMESTRE_PREVISTO'].dt.to_period('Q')
-trimestre_limite = (pd.Timestamp.today() + pd.DateOffset(months=3)).to_period('Q')
-df_futuro = df[df['TRIMESTRE_PREVISTO'] <= trimestre_limite]
-df['TRIMESTRE_PREVISTO'] = df['TRIMESTRE_PREVISTO'].astype('int64')
+    # Pipeline do regressor escolhido em REGRESSOR_ML (histgb trata os NaN sozinho; gbr imputa e padroniza)
+    pipeline_duracao = regressores.pipeline()
 
-# Obter o mês atual
-mes_atual = datetime.now().month
+    # Treinar o modelo
+    pipeline_duracao.fit(X_train_duracao, y_train_duracao)
 
-# Verificar o próximo mês
-if mes_atual == 4:  # Abril
-    proximo_mes = 5  # Maio
-elif mes_atual == 5:  # Maio
-    proximo_mes = 6  # Junho
-elif mes_atual == 6:  # Junho
-    proximo_mes = 7  # Julho
-else:
-    proximo_mes = None  # Caso seja após julho ou outro mês que você não quer prever
+    # Avaliação do modelo
+    y_pred_duracao = pipeline_duracao.predict(X_test_duracao)
+    print("\nAvaliação do modelo de DURACAO_SERVICO:")
+    mse = mean_squared_error(y_test_duracao, y_pred_duracao)
+    rmse = np.sqrt(mse)
+    print("RMSE:", rmse)
+    print("R²:", r2_score(y_test_duracao, y_pred_duracao))
 
-print(proximo_mes)
+    # Salvar modelo
+    agendador_treino.salvar_modelo(pipeline_duracao, DIRETORIO_SAIDA / 'modelo_tempo_servico.pkl')
 
-# ======================================================================
-# 1. MODELO DE PREVISÃO DE DURAÇÃO DO SERVIÇO
-# ======================================================================
-print("\n=== MODELO DE DURAÇÃO DO SERVIÇO ===")
-X_duracao = df[['TRIMESTRE_PREVISTO', 'ID MUNICIPIO', 'ID STATUS', 'ID TIPO OS', 'ID SUB OS',
-                'QTD OS POR PREFIXO(MES)', 'QTD OS POR PREFIXO(DIA)',
-                'EFETIVIDADE POR CIDADE (MES)', 'EFETIVIDADE POR CIDADE (DIA)']]
-y_duracao = df['DURACAO_SERVICO']
-
-# Divisão dos dados
-X_train_duracao, X_test_duracao, y_train_duracao, y_test_duracao = train_test_split(
-    X_duracao, y_duracao, test_size=0.2, random_state=42)
-
-# Pipeline de pré-processamento e modelo
-pipeline_duracao = Pipeline([
-    ('imputer', SimpleImputer(strategy='mean')),  # Imputação dos valores NaN
-    ('scaler', StandardScaler()),                # Normalização dos dados
-    ('regressor', GradientBoostingRegressor(random_state=42))  # Modelo de regressão
-])
-
-# Treinar o modelo
-pipeline_duracao.fit(X_train_duracao, y_train_duracao)
-df['DURACAO_SERVICO_PRED'] = pipeline_duracao.predict(X_duracao)
-
-# Avaliação do modelo
-y_pred_duracao = pipeline_duracao.predict(X_test_duracao)
-print("\nAvaliação do modelo de DURACAO_SERVICO:")
-mse = mean_squared_error(y_test_duracao, y_pred_duracao)
-rmse = np.sqrt(mse)
-print("RMSE:", rmse)
-print("R²:", r2_score(y_test_duracao, y_pred_duracao))
-
-# Prever para todo o dataframe
-df['DURACAO_SERVICO_PRED'] = pipeline_duracao.predict(X_duracao)
-
-# Salvar modelo
-joblib.dump(pipeline_duracao, DIRETORIO_SAIDA / 'modelo_tempo_servico.pkl')
+    # Prever para todo o dataframe
+    return {'DURACAO_SERVICO_PRED': pipeline_duracao.predict(X_duracao)}
 
 # ======================================================================
 # 2. Treinando o modelo XGBoost para classificação de EFETIVIDADE
 # ======================================================================
-print("\n=== MODELO DE CLASSIFICAÇÃO DE EFETIVIDADE ===")
 
-# Balanceamento dos dados
-def balancear_efetividade_por_tipo(df_tipo, nome_tipo):
+# Balanceamento dos dados (sobre as posições das linhas; o resample sorteia as mesmas linhas que sorteava no DataFrame)
+def balancear_efetividade_por_tipo(df, posicoes, nome_tipo):
     print(f"\n{nome_tipo} - Distribuição antes do balanceamento: ")
-    print(df_tipo['ID EFETIVIDADE'].value_counts())
+    print(df['ID EFETIVIDADE'].iloc[posicoes].value_counts())
 
-    df_tipo = df_tipo.dropna(subset=['DURACAO_SERVICO', 'TEMPO_DESLOCAMENTO'])
+    posicoes = posicoes[df[['DURACAO_SERVICO', 'TEMPO_DESLOCAMENTO']].iloc[posicoes].notna().all(axis=1).to_numpy()]
+    efetividade = df['ID EFETIVIDADE'].to_numpy()[posicoes]
 
-    classe_0 = df_tipo[df_tipo['ID EFETIVIDADE'] == 0]
-    classe_1 = df_tipo[df_tipo['ID EFETIVIDADE'] == 1]
+    classe_0 = posicoes[efetividade == 0]
+    classe_1 = posicoes[efetividade == 1]
 
     if len(classe_0) == 0 or len(classe_1) == 0:
         print(f"{nome_tipo} não pode ser balanceado (classe ausente).")
-        return df_tipo
+        return posicoes
 
     n = min(len(classe_0), len(classe_1))
     classe_0_red = resample(classe_0, replace=False, n_samples=n, random_state=42)
     classe_1_red = resample(classe_1, replace=False, n_samples=n, random_state=42)
 
-    return pd.concat([classe_0_red, classe_1_red])
-
-# Trabalhar só com o df_futuro
-df_comercial = df_futuro[df_futuro['ID STATUS'] == 1001]
-df_emergencial = df_futuro[df_futuro['ID STATUS'] == 1002]
-
-print("\nBalanceando Comercial e Emergencial separadamente...")
-df_comercial_balanceado = balancear_efetividade_por_tipo(df_comercial, "COMERCIAL")
-df_emergencial_balanceado = balancear_efetividade_por_tipo(df_emergencial, "EMERGENCIAL")
+    return np.concatenate([classe_0_red, classe_1_red])
 
-df_balanceado = pd.concat([df_comercial_balanceado, df_emergencial_balanceado])
+def treinar_efetividade(matriz, nucleos=1):
+    print("\n=== MODELO DE CLASSIFICAÇÃO DE EFETIVIDADE ===")
 
-print("\nDistribuição de classes após o balanceamento: ")
-print(df_balanceado['ID EFETIVIDADE'].value_counts())
+    # Linhas do df_futuro já balanceadas por STATUS na montagem da matriz
+    X_efetividade, y_efetividade = matriz.dados("efetividade", treino=True)
 
-X_efetividade = df_balanceado[['ID MUNICIPIO', 'ID STATUS', 'ID TIPO OS', 'ID SUB OS',
-                               'QTD OS POR PREFIXO(MES)', 'QTD OS POR PREFIXO(DIA)',
-                               'EFETIVIDADE POR CIDADE (MES)', 'EFETIVIDADE POR CIDADE (DIA)']]
-y_efetividade = df_balanceado['ID EFETIVIDADE']
+    print("\nDistribuição de classes após o balanceamento: ")
+    print(pd.Series(y_efetividade, name='ID EFETIVIDADE').value_counts())
 
-X_train_efetividade, X_test_efetividade, y_train_efetividade, y_test_efetividade = train_test_split(
-    X_efetividade, y_efetividade, test_size=0.2, random_state=42)
+    X_train_efetividade, X_test_efetividade, y_train_efetividade, y_test_efetividade = train_test_split(
+        X_efetividade, y_efetividade, test_size=0.2, random_state=42)
 
-modelo_xgb = XGBClassifier(random_state=42)
-modelo_xgb.fit(X_train_efetividade, y_train_efetividade)
+    modelo_xgb = XGBClassifier(random_state=42, n_jobs=nucleos)
+    modelo_xgb.fit(X_train_efetividade, y_train_efetividade)
 
-y_pred_efetividade = modelo_xgb.predict(X_test_efetividade)
-print("\nAvaliação do modelo de EFETIVIDADE:")
-print(classification_report(y_test_efetividade, y_pred_efetividade))
+    y_pred_efetividade = modelo_xgb.predict(X_test_efetividade)
+    print("\nAvaliação do modelo de EFETIVIDADE:")
+    print(classification_report(y_test_efetividade, y_pred_efetividade))
 
-joblib.dump(modelo_xgb, DIRETORIO_SAIDA / 'modelo_efetividade_xgb.pkl')
+    agendador_treino.salvar_modelo(modelo_xgb, DIRETORIO_SAIDA / 'modelo_efetividade_xgb.pkl')
+    return {}
 
 # ======================================================================
 # 3. MODELO DE PREVISÃO DE TEMPO DE RESPOSTA
 # ======================================================================
-print("\n=== MODELO DE TEMPO DE RESPOSTA ===")
+def treinar_resposta(matriz, nucleos=1):
+    print("\n=== MODELO DE TEMPO DE RESPOSTA ===")
 
-df_modelo = df_futuro.dropna(subset=[
-    'TEMPO_RESPOSTA', 'ID MUNICIPIO', 'ID STATUS', 'ID TIPO OS', 'ID SUB OS',
-    'QTD OS POR PREFIXO(MES)', 'QTD OS POR PREFIXO(DIA)',
-    'EFETIVIDADE POR CIDADE (MES)', 'EFETIVIDADE POR CIDADE (DIA)'
-])
+    # Linhas do df_futuro sem nulos no alvo e nos atributos
+    X_resposta, y_resposta = matriz.dados("resposta", treino=True)
 
-X_resposta = df_modelo[[ 'ID MUNICIPIO', 'ID STATUS', 'ID TIPO OS', 'ID SUB OS',
-                         'QTD OS POR PREFIXO(MES)', 'QTD OS POR PREFIXO(DIA)',
-                         'EFETIVIDADE POR CIDADE (MES)', 'EFETIVIDADE POR CIDADE (DIA)' ]]
-y_resposta = df_modelo['TEMPO_RESPOSTA']
+    X_train_resp, X_test_resp, y_train_resp, y_test_resp = train_test_split(
+        X_resposta, y_resposta, test_size=0.2, random_state=42)
 
-X_train_resp, X_test_resp, y_train_resp, y_test_resp = train_test_split(
-    X_resposta, y_resposta, test_size=0.2, random_state=42)
+    pipeline_resposta = regressores.pipeline(imputar=False)
 
-pipeline_resposta = Pipeline([
-    ('scaler', StandardScaler()),
-    ('regressor', GradientBoostingRegressor(random_state=42))
-])
+    pipeline_resposta.fit(X_train_resp, y_train_resp)
 
-pipeline_resposta.fit(X_train_resp, y_train_resp)
+    y_pred_resp = pipeline_resposta.predict(X_test_resp)
+    print("\nAvaliação do modelo de TEMPO_RESPOSTA:")
+    mse = mean_squared_error(y_test_resp, y_pred_resp)
+    rmse = np.sqrt(mse)
+    print("RMSE:", rmse)
+    print("R²:", r2_score(y_test_resp, y_pred_resp))
 
-y_pred_resp = pipeline_resposta.predict(X_test_resp)
-print("\nAvaliação do modelo de TEMPO_RESPOSTA:")
-mse = mean_squared_error(y_test_resp, y_pred_resp)
-rmse = np.sqrt(mse)
-print("RMSE:", rmse)
-print("R²:", r2_score(y_test_resp, y_pred_resp))
+    agendador_treino.salvar_modelo(pipeline_resposta, DIRETORIO_SAIDA / 'modelo_tempo_resposta.pkl')
 
-# Prever para TODO df, mas só os do futuro receberão resultado realista
-df['TEMPO_RESPOSTA_PRED'] = pipeline_resposta.predict(df[[ 'ID MUNICIPIO', 'ID STATUS', 'ID TIPO OS', 'ID SUB OS',
-                                                           'QTD OS POR PREFIXO(MES)', 'QTD OS POR PREFIXO(DIA)',
-                                                           'EFETIVIDADE POR CIDADE (MES)', 'EFETIVIDADE POR CIDADE (DIA)' ]].fillna(0))
-
-joblib.dump(pipeline_resposta, DIRETORIO_SAIDA / 'modelo_tempo_resposta.pkl')
+    # Prever para TODO df, mas só os do futuro receberão resultado realista
+    return {'TEMPO_RESPOSTA_PRED': pipeline_resposta.predict(matriz.atributos("resposta").fillna(0))}
 
 # ======================================================================
 # 4. MODELO DE TEMPO IDEAL
 # ======================================================================
-print("\n=== MODELO DE TEMPO IDEAL ===")
-
-# 2. Criando um exemplo de coluna 'CLUSTER'.
-df['CLUSTER'] = df['MUNICIPIO'].astype('category').cat.codes  # Apenas um exemplo de cluster com base no 'MUNICIPIO'
-
-# 3. Criando a variável "MÊS FUTURO" para prever o tempo ideal para os próximos 3 meses
-df['MES_FUTURO'] = df['MES'] + 3  # Prevendo para os próximos 3 meses, ajustando a variável de mês para o futuro
-
-# 4. Preparando os dados para o treinamento
-X = df[['TIPO OS', 'MUNICIPIO', 'PREFIXO', 'DIA_SEMANA', 'MES', 'CLUSTER']]  # Features
-y = df['DURACAO_SERVICO']  # Target (tempo ideal)
-
-# Convertendo variáveis categóricas para numéricas (se necessário)
-X = pd.get_dummies(X, drop_first=True)  # Usando dummies para variáveis categóricas
-
-# Divisão de treino e teste
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-
-# 5. Inicializando e treinando o modelo XGBoost
-modelo_xgb = xgb.XGBRegressor(objective='reg:squarederror', eval_metric='rmse')
-modelo_xgb.fit(X_train, y_train)
-
-# 6. Prevendo os resultados no conjunto de teste
-y_pred = modelo_xgb.predict(X_test)
-
-# 7. Calculando o erro quadrático médio (MSE)
-mse_xgb = mean_squared_error(y_test, y_pred)
-print(f"Erro quadrático médio (MSE) do modelo XGBoost: {mse_xgb}")
-df['TEMPO_IDEAL'] = modelo_xgb.predict(X)
-
-df_futuro = df.copy()
-df_futuro['MES'] = df_futuro['MES'] + 3  # ou algum ajuste pra bater com a lógica de negócio
-
-# Garantir que o modelo tá usando os dados com o MES do futuro
-X_futuro = df_futuro[['TIPO OS', 'MUNICIPIO', 'PREFIXO', 'DIA_SEMANA', 'MES', 'CLUSTER']]
-X_futuro = pd.get_dummies(X_futuro, drop_first=True)
-
-# Reindex pra garantir que as colunas estão no mesmo formato
-X_futuro = X_futuro.reindex(columns=X.columns, fill_value=0)
-
-# Previsão pros meses futuros
-df_futuro['TEMPO_IDEAL_PRED'] = modelo_xgb.predict(X_futuro)
-df['TEMPO_IDEAL_PRED'] = df_futuro['TEMPO_IDEAL_PRED']
-
-# 8. Salvando o modelo
-joblib.dump(modelo_xgb, "modelo_tempo_ideal_xgb.pkl")
+def atributos_tempo_ideal(matriz, meses_a_frente=0):
+    # TIPO OS, MUNICIPIO e PREFIXO como Categorical (vocabulário da matriz), DIA_SEMANA, MES e CLUSTER
+    X = matriz.categoricas()
+    X['DIA_SEMANA'] = matriz.coluna('DIA_SEMANA')
+    X['MES'] = matriz.coluna('MES') + meses_a_frente
+    X['CLUSTER'] = matriz.coluna('MUNICIPIO')
+    return X
+
+def treinar_tempo_ideal(matriz, nucleos=1):
+    print("\n=== MODELO DE TEMPO IDEAL ===")
+
+    # 2 e 3. CLUSTER (código do município) e MES_FUTURO (MES + 3) entram no df em aplicar_previsoes
+
+    # 4. Preparando os dados para o treinamento (variáveis categóricas codificadas conforme CODIFICACAO_TEMPO_IDEAL)
+    modo = codificacao_categorica.CODIFICACAO_TEMPO_IDEAL
+    atributos = atributos_tempo_ideal(matriz)
+    vocabulario = codificacao_categorica.vocabulario(atributos, matriz_atributos.COLUNAS_CATEGORICAS)
+    X = codificacao_categorica.codificar(atributos, vocabulario, modo)
+    colunas = X.columns if modo == "dummies" else atributos.columns
+    y = matriz.alvo("tempo_ideal")  # Target (tempo ideal)
+
+    # Divisão de treino e teste (só linhas da janela de TRIMESTRES_TREINO)
+    linhas_treino = matriz.linhas_treino("tempo_ideal")
+    X_train, X_test, y_train, y_test = train_test_split(_linhas(X, linhas_treino), _linhas(y, linhas_treino),
+                                                        test_size=0.2, random_state=42)
+
+    # 5. Inicializando e treinando o modelo XGBoost
+    # hist só na nativa/esparsa (exigido pelo enable_categorical); no modo dummies o XGBoost fica como antes
+    parametros = {} if modo == "dummies" else {"tree_method": "hist", "enable_categorical": modo == "nativa"}
+    modelo_xgb = xgb.XGBRegressor(objective='reg:squarederror', eval_metric='rmse', n_jobs=nucleos, **parametros)
+    modelo_xgb.fit(X_train, y_train)
+
+    # 6. Prevendo os resultados no conjunto de teste
+    y_pred = modelo_xgb.predict(X_test)
+
+    # 7. Calculando o erro quadrático médio (MSE)
+    mse_xgb = mean_squared_error(y_test, y_pred)
+    print(f"Erro quadrático médio (MSE) do modelo XGBoost: {mse_xgb}")
+    previsoes = {'TEMPO_IDEAL': modelo_xgb.predict(X)}
+
+    # 8. Salvando o modelo e, ao lado dele, o vocabulário das categorias (modelo_tempo_ideal_xgb_vocabulario.json)
+    caminho_modelo = DIRETORIO_SAIDA / "modelo_tempo_ideal_xgb.pkl"
+    codificacao_categorica.salvar_vocabulario(vocabulario, modo, colunas, caminho_modelo)
+    agendador_treino.salvar_modelo(modelo_xgb, caminho_modelo)
+
+    # Garantir que o modelo tá usando os dados com o MES do futuro (+3, ou algum ajuste pra bater com a lógica de negócio)
+    # Linhas mapeadas direto no vocabulário salvo com o modelo (no modo dummies, reindex pras mesmas colunas)
+    salvo = codificacao_categorica.carregar_vocabulario(caminho_modelo)
+    X_futuro = codificacao_categorica.codificar(atributos_tempo_ideal(matriz, meses_a_frente=3), salvo["categorias"],
+                                                salvo["codificacao"], salvo["colunas"])
+
+    # Previsão pros meses futuros
+    previsoes['TEMPO_IDEAL_PRED'] = modelo_xgb.predict(X_futuro)
+    return previsoes
 
 # ======================================================================
 # 5. MODELO DE PREVISÃO DE TEMPO DE DESLOCAMENTO
 # ======================================================================
+def treinar_deslocamento(matriz, nucleos=1):
+    print("\n=== MODELO DE TEMPO DE DESLOCAMENTO ===")
+
+    # Sem os outliers extremos de deslocamento (linhas selecionadas na montagem da matriz)
+    X_deslocamento, y_deslocamento = matriz.dados("deslocamento")
+
+    # Divisão dos dados (só linhas da janela de TRIMESTRES_TREINO)
+    X_train_deslocamento, X_test_deslocamento, y_train_deslocamento, y_test_deslocamento = train_test_split(
+        *matriz.dados("deslocamento", treino=True), test_size=0.2, random_state=42)
+
+    # Pipeline
+    pipeline_deslocamento = Pipeline([
+        ('imputer', SimpleImputer(strategy='mean')),
+        ('scaler', StandardScaler()),
+        ('regressor', XGBRegressor(random_state=42, n_jobs=nucleos))
+    ])
+
+    # Treinar o modelo inicial
+    pipeline_deslocamento.fit(X_train_deslocamento, y_train_deslocamento)
+
+    # Avaliação inicial
+    y_pred_deslocamento = pipeline_deslocamento.predict(X_test_deslocamento)
+    print("\nAvaliação inicial do modelo:")
+    print("RMSE:", np.sqrt(mean_squared_error(y_test_deslocamento, y_pred_deslocamento)))
+    print("R²:", r2_score(y_test_deslocamento, y_pred_deslocamento))
+
+    # Busca de hiperparâmetros, com a trilha (e os melhores parâmetros para a próxima execução) em busca_deslocamento.json
+    caminho_busca = DIRETORIO_SAIDA / ARQUIVO_BUSCA_DESLOCAMENTO
+    if BUSCA_DESLOCAMENTO == "halving":
+        anteriores = (busca_hiperparametros.carregar_trilha(caminho_busca) or {}).get("melhores_parametros")
+        best_pipeline, resultado = buscar_halving_deslocamento(X_train_deslocamento, y_train_deslocamento, nucleos, anteriores)
+    else:
+        best_pipeline, resultado = buscar_grid_deslocamento(pipeline_deslocamento, X_train_deslocamento, y_train_deslocamento, nucleos)
+    busca_hiperparametros.salvar_trilha(resultado, caminho_busca)
+    print(f"Busca ({resultado['modo']}): {resultado['ajustes']} ajustes em {resultado['tempo_s']}s | "
+          f"melhores parâmetros: {resultado['melhores_parametros']}")
+
+    # Avaliação final
+    y_pred_best = best_pipeline.predict(X_test_deslocamento)
+    rmse_best = np.sqrt(mean_squared_error(y_test_deslocamento, y_pred_best))
+    print(f"Melhor Modelo XGBoost - RMSE: {rmse_best:.2f} | R²: {r2_score(y_test_deslocamento, y_pred_best):.2f}")
+
+    # Salvar modelo
+    agendador_treino.salvar_modelo(best_pipeline, DIRETORIO_SAIDA / 'modelo_tempo_deslocamento.pkl')
+
+    # Prever para todo o dataframe (já sem os outliers)
+    return {'TEMPO_DESLOCAMENTO_PRED': best_pipeline.predict(X_deslocamento)}
+
+def buscar_grid_deslocamento(pipeline_deslocamento, X_train, y_train, nucleos):
+    # Grid Search para otimização
+    param_grid = {
+        'regressor__n_estimators': [100, 300],
+        'regressor__learning_rate': [0.01, 0.1],
+        'regressor__max_depth': [3, 6],
+        'regressor__subsample': [0.8, 1.0],
+    }
+
+    # Os núcleos do modelo vão para os ajustes em paralelo do grid, cada XGBoost com uma thread
+    # (n_jobs=-1 aqui somado às threads do XGBoost disputava todos os núcleos da máquina)
+    pipeline_deslocamento.set_params(regressor__n_jobs=1)
+    grid_search = GridSearchCV(
+        estimator=pipeline_deslocamento,
+        param_grid=param_grid,
+        cv=3,
+        n_jobs=nucleos,
+        verbose=0  # sem log poluindo o terminal
+    )
+    inicio = datetime.now()
+    grid_search.fit(X_train, y_train)
+
+    # Melhor modelo encontrado
+    resultados = grid_search.cv_results_
+    trilha = [{"parametros": {nome.replace('regressor__', ''): valor for nome, valor in parametros.items()},
+               "r2_validacao_cruzada": float(r2), "tempo_ajuste_s": round(float(tempo), 3)}
+              for parametros, r2, tempo in zip(resultados['params'], resultados['mean_test_score'], resultados['mean_fit_time'])]
+    return grid_search.best_estimator_, {
+        "modo": "grid", "gerado_em": datetime.now().isoformat(timespec="seconds"),
+        "ajustes": len(trilha) * 3 + 1, "tempo_s": round((datetime.now() - inicio).total_seconds(), 3),
+        "melhores_parametros": {nome.replace('regressor__', ''): valor for nome, valor in grid_search.best_params_.items()},
+        "trilha": trilha}
+
+# Mesma grade do GridSearchCV, sem n_estimators: a quantidade de árvores sai da parada antecipada
+GRADE_DESLOCAMENTO = {'learning_rate': [0.01, 0.1], 'max_depth': [3, 6], 'subsample': [0.8, 1.0]}
+
+def buscar_halving_deslocamento(X_train, y_train, nucleos, anteriores=None):
+    # Imputação e padronização ajustadas uma vez e reaproveitadas por todos os candidatos
+    preprocessamento = Pipeline([
+        ('imputer', SimpleImputer(strategy='mean')),
+        ('scaler', StandardScaler()),
+    ]).fit(X_train)
+    X_transformado = preprocessamento.transform(X_train)
+    resultado = busca_hiperparametros.buscar(X_transformado, y_train, GRADE_DESLOCAMENTO, nucleos, anteriores)
+
+    # Melhor candidato reajustado com todas as linhas de treino e a quantidade de árvores da busca
+    regressor = XGBRegressor(**resultado['melhores_parametros'], tree_method='hist', random_state=42, n_jobs=nucleos)
+    regressor.fit(X_transformado, y_train)
+    best_pipeline = Pipeline([
+        ('imputer', preprocessamento.named_steps['imputer']),
+        ('scaler', preprocessamento.named_steps['scaler']),
+        ('regressor', regressor)
+    ])
+    return best_pipeline, resultado
 
-print("\n=== MODELO DE TEMPO DE DESLOCAMENTO ===")
-
-# Garantir tipo datetime
-df['DATA SOLICITACAO'] = pd.to_datetime(df['DATA SOLICITACAO'], errors='coerce')
-
-# Features temporais
-df['DIA_SEMANA'] = df['DATA SOLICITACAO'].dt.dayofweek
-df['MES_SOLICITACAO'] = df['DATA SOLICITACAO'].dt.month
-
-# Remover outliers extremos de deslocamento
-media = df['TEMPO_DESLOCAMENTO'].mean()
-desvio = df['TEMPO_DESLOCAMENTO'].std()
-df = df[df['TEMPO_DESLOCAMENTO'] < media + 2 * desvio]
-
-# Variáveis explicativas
-X_deslocamento = df[['DIA_SEMANA_FIM_DESLOCAMENTO','MES_FIM_DESLOCAMENTO', 'DIA_SEMANA_IN_DESLOCAMENTO', 'MES_IN_DESLOCAMENTO', 'DIA_SEMANA',
-                     'MES', 'ID MUNICIPIO', 'ID STATUS', 'ID TIPO OS', 'ID SUB OS', 'QTD OS POR PREFIXO(MES)', 'QTD OS POR PREFIXO(DIA)',
-                     'EFETIVIDADE POR CIDADE (MES)', 'EFETIVIDADE POR CIDADE (DIA)', 'ID PREFIXO', 'TEMPO_RESPOSTA', 'MES_SOLICITACAO']]
-
-y_deslocamento = df['TEMPO_DESLOCAMENTO']
-
-# Divisão dos dados
-X_train_deslocamento, X_test_deslocamento, y_train_deslocamento, y_test_deslocamento = train_test_split(
-    X_deslocamento, y_deslocamento, test_size=0.2, random_state=42)
-
-# Pipeline
-pipeline_deslocamento = Pipeline([
-    ('imputer', SimpleImputer(strategy='mean')),
-    ('scaler', StandardScaler()),
-    ('regressor', XGBRegressor(random_state=42))
-])
-
-# Treinar o modelo inicial
-pipeline_deslocamento.fit(X_train_deslocamento, y_train_deslocamento)
-
-# Avaliação inicial
-y_pred_deslocamento = pipeline_deslocamento.predict(X_test_deslocamento)
-print("\nAvaliação inicial do modelo:")
-print("RMSE:", np.sqrt(mean_squared_error(y_test_deslocamento, y_pred_deslocamento)))
-print("R²:", r2_score(y_test_deslocamento, y_pred_deslocamento))
-
-# Grid Search para otimização
-param_grid = {
-    'regressor__n_estimators': [100, 300],
-    'regressor__learning_rate': [0.01, 0.1],
-    'regressor__max_depth': [3, 6],
-    'regressor__subsample': [0.8, 1.0],
-}
-
-grid_search = GridSearchCV(
-    estimator=pipeline_deslocamento,
-    param_grid=param_grid,
-    cv=3,
-    n_jobs=-1,
-    verbose=0  # sem log poluindo o terminal
-)
-grid_search.fit(X_train_deslocamento, y_train_deslocamento)
-
-# Melhor modelo encontrado
-best_pipeline = grid_search.best_estimator_
-
-# Avaliação final
-y_pred_best = best_pipeline.predict(X_test_deslocamento)
-rmse_best = np.sqrt(mean_squared_error(y_test_deslocamento, y_pred_best))
-print(f"Melhor Modelo XGBoost - RMSE: {rmse_best:.2f} | R²: {r2_score(y_test_deslocamento, y_pred_best):.2f}")
-
-# Salvar modelo
-joblib.dump(best_pipeline, 'modelo_tempo_deslocamento.pkl')
-
-# Prever para todo o dataframe
-df['TEMPO_DESLOCAMENTO_PRED'] = best_pipeline.predict(X_deslocamento)
-
-# Preview
-print("\nPrimeiras previsões:")
-print(df[['PREFIXO', 'TEMPO_DESLOCAMENTO', 'TEMPO_DESLOCAMENTO_PRED']].head())
+# ======================================================================
+# AGENDAMENTO DOS TREINOS
+# ======================================================================
+TREINOS = {"duracao": treinar_duracao, "efetividade": treinar_efetividade, "resposta": treinar_resposta,
+           "tempo_ideal": treinar_tempo_ideal, "deslocamento": treinar_deslocamento}
+# Quanto cada treino aproveita de núcleos extras: duração e resposta dependem do regressor (o gbr tem uma
+# thread só), o deslocamento (busca de hiperparâmetros) é o mais pesado
+PESOS_NUCLEOS = {"duracao": regressores.PESOS_REGRESSOR[regressores.REGRESSOR_ML], "efetividade": 1,
+                 "resposta": regressores.PESOS_REGRESSOR[regressores.REGRESSOR_ML], "tempo_ideal": 1, "deslocamento": 2}
+
+def treinar_modelos(matriz):
+    # Os cinco modelos são independentes entre si: cada um roda num processo e devolve só as previsões
+    return agendador_treino.executar_treinos(TREINOS, PESOS_NUCLEOS, diretorio=matriz.pasta.parent)
+
+def aplicar_previsoes(df, matriz, previsoes):
+    # Colunas no df na mesma ordem de antes (a ordem das colunas do ML_dataframe_OPER.csv não muda)
+    df['DURACAO_SERVICO_PRED'] = previsoes['duracao']['DURACAO_SERVICO_PRED']
+    df['TEMPO_RESPOSTA_PRED'] = previsoes['resposta']['TEMPO_RESPOSTA_PRED']
+    df['CLUSTER'] = matriz.coluna('MUNICIPIO')  # Apenas um exemplo de cluster com base no 'MUNICIPIO' (código do município)
+    df['MES_FUTURO'] = df['MES'] + 3  # Prevendo para os próximos 3 meses, ajustando a variável de mês para o futuro
+    df['TEMPO_IDEAL'] = previsoes['tempo_ideal']['TEMPO_IDEAL']
+    df['TEMPO_IDEAL_PRED'] = previsoes['tempo_ideal']['TEMPO_IDEAL_PRED']
+    # Feature temporal do deslocamento (mês da DATA SOLICITACAO), mantida no arquivo final
+    df['MES_SOLICITACAO'] = df['DATA SOLICITACAO'].dt.month
+
+    # O filtro de outliers de deslocamento também vale para o arquivo final
+    df = df.iloc[matriz.linhas("deslocamento")]
+    df['TEMPO_DESLOCAMENTO_PRED'] = previsoes['deslocamento']['TEMPO_DESLOCAMENTO_PRED']
+
+    # Preview
+    print("\nPrimeiras previsões:")
+    print(df[['PREFIXO', 'TEMPO_DESLOCAMENTO', 'TEMPO_DESLOCAMENTO_PRED']].head())
+    return df
 
 # ======================================================================
 # FINALIZAÇÃO
 # ======================================================================
-
-# Previsões agregadas
-df['PREVISAO_DURACAO_PREFIXO'] = df.groupby('PREFIXO')['DURACAO_SERVICO_PRED'].transform('median')
-df['PREVISAO_DURACAO_CIDADE'] = df.groupby('MUNICIPIO')['DURACAO_SERVICO_PRED'].transform('median')
-
-# Garantir tipos corretos
-colunas_para_int = ['ID STATUS', 'ID EFETIVIDADE', 'PREVISAO_DURACAO_PREFIXO',
-                   'PREVISAO_DURACAO_CIDADE', 'DURACAO_SERVICO', 
-                   'TEMPO_DESLOCAMENTO', 'CLUSTER']
-
-for col in colunas_para_int:
-    if df[col].isnull().any():
-        df[col] = df[col].fillna(-1)
-    df[col] = df[col].round().astype(int)
-
-# Remove colunas do df
-df.drop(columns='TEMPO_IDEAL', inplace=True)
-df.drop(columns='DIA_SEMANA', inplace=True)
-df.drop(columns='TRIMESTRE_SOLICITACAO', inplace=True)
-df.drop(columns='TRIMESTRE_PREVISTO', inplace=True)
-df.drop(columns='DATA_PREVISTA', inplace=True)
-df.drop(columns='MES', inplace=True)
-df.drop(columns='CLUSTER', inplace=True)
-
-df.to_csv(DIRETORIO_SAIDA / "ML_dataframe_OPER.csv", sep=";", 
-          index=False, float_format='%.2f', encoding='utf-8-sig')
-
-print("\nProcesso concluído com sucesso!")
-print("\nResumo dos modelos treinados:")
-print("- Modelo de Duração do Serviço (GradientBoostingRegressor)")
-print("- Modelo de Classificação de Efetividade (XGBoost)")
-print("- MODELO DE PREVISÃO DE TEMPO DE DESLOCAMENTO (GradientBoostingRegressor)")
-print("- Modelo de Tempo de Resposta (GradientBoostingRegressor)")
-print("- Modelo de Tempo Ideal (GradientBoostingRegressor)")
\ No newline at end of file
+def finalizar(df):
+    # Previsões agregadas
+    df['PREVISAO_DURACAO_PREFIXO'] = df.groupby('PREFIXO', observed=True)['DURACAO_SERVICO_PRED'].transform('median')
+    df['PREVISAO_DURACAO_CIDADE'] = df.groupby('MUNICIPIO', observed=True)['DURACAO_SERVICO_PRED'].transform('median')
+
+    # Garantir tipos corretos
+    colunas_para_int = ['ID STATUS', 'ID EFETIVIDADE', 'PREVISAO_DURACAO_PREFIXO',
+                       'PREVISAO_DURACAO_CIDADE', 'DURACAO_SERVICO',
+                       'TEMPO_DESLOCAMENTO', 'CLUSTER']
+
+    for col in colunas_para_int:
+        if df[col].isnull().any():
+            df[col] = df[col].fillna(-1)
+        df[col] = df[col].round().astype(int)
+
+    # Remove colunas do df
+    df.drop(columns='TEMPO_IDEAL', inplace=True)
+    df.drop(columns='DIA_SEMANA', inplace=True)
+    df.drop(columns='TRIMESTRE_SOLICITACAO', inplace=True)
+    df.drop(columns='TRIMESTRE_PREVISTO', inplace=True)
+    df.drop(columns='DATA_PREVISTA', inplace=True)
+    df.drop(columns='MES', inplace=True)
+    df.drop(columns='CLUSTER', inplace=True)
+
+    df.to_csv(DIRETORIO_SAIDA / "ML_dataframe_OPER.csv", sep=";",
+              index=False, float_format='%.2f', encoding='utf-8-sig')
+
+    print("\nProcesso concluído com sucesso!")
+    print("\nResumo dos modelos treinados:")
+    nome_regressor = "HistGradientBoostingRegressor" if regressores.REGRESSOR_ML == "histgb" else "GradientBoostingRegressor"
+    print(f"- Modelo de Duração do Serviço ({nome_regressor})")
+    print("- Modelo de Classificação de Efetividade (XGBoost)")
+    print("- MODELO DE PREVISÃO DE TEMPO DE DESLOCAMENTO (GradientBoostingRegressor)")
+    print(f"- Modelo de Tempo de Resposta ({nome_regressor})")
+    print("- Modelo de Tempo Ideal (GradientBoostingRegressor)")
+    return df
+
+def executar(dataframe_OPER=None):
+    print("Carregando e preparando os dados...")
+    df_original = carregar_OPER() if dataframe_OPER is None else dataframe_OPER
+
+    df, futuro = preparar_dados(df_original)
+    # Atributos e alvos de todos os modelos montados uma vez (matriz_atributos/, lida por mmap)
+    matriz = montar_matriz(df, futuro)
+    previsoes = treinar_modelos(matriz)
+    df = aplicar_previsoes(df, matriz, previsoes)
+    df = finalizar(df)
+    # Valores de MUNICIPIO que o mapa não consegue desenhar (sem polígono no geojs-GOIAS.json)
+    camada_geo.relatar_sem_correspondencia(df["MUNICIPIO"])
+    # Geometrias simplificadas do mapa (só refeitas quando o GeoJSON muda)
+    geometrias_mapa.gerar_geometrias()
+    # Cubo de KPIs (cidade x prefixo x status x mês x dia) lido pelo dashboard no lugar do CSV linha a linha
+    cubo_kpi.construir(df)
+    # Por último: a API de leitura só recarrega depois que todas as saídas desta execução estão gravadas
+    publicacao.publicar()
+    return df
+
+if __name__ == "__main__":
+    executar()
@@ -0,0 +1,77 @@
+import os
+import time
+import joblib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+import matriz_atributos
+
+load_dotenv('credenciais_arquivos.env')
+
+# Treino dos modelos independentes do ML1 em processos separados, com um orçamento global de núcleos dividido
+# entre os processos (quantos modelos ao mesmo tempo) e as threads de cada modelo (n_jobs do XGBoost/joblib).
+# Cada processo abre a matriz de atributos por mmap: nenhum DataFrame é copiado para os processos.
+NUCLEOS_ML = int(os.getenv("NUCLEOS_ML", "0")) or os.cpu_count() or 1
+TREINO_PARALELO = os.getenv("TREINO_PARALELO", "1") == "1"
+
+def distribuir_nucleos(pesos, orcamento=NUCLEOS_ML):
+    # Peso 0 = modelo de uma thread só (recebe 1 núcleo); o restante é dividido pelos pesos,
+    # e a sobra do arredondamento vai para o de maior peso
+    if orcamento < len(pesos):
+        return {nome: 1 for nome in pesos}
+    nucleos = {nome: 1 for nome in pesos}
+    variaveis = {nome: peso for nome, peso in pesos.items() if peso > 0}
+    if not variaveis:
+        return nucleos
+    restante = orcamento - (len(pesos) - len(variaveis))
+    total = sum(variaveis.values())
+    for nome, peso in variaveis.items():
+        nucleos[nome] = max(1, restante * peso // total)
+    maior = max(variaveis, key=variaveis.get)
+    nucleos[maior] += max(0, restante - sum(nucleos[nome] for nome in variaveis))
+    return nucleos
+
+def salvar_modelo(modelo, caminho):
+    # Grava num temporário e troca: quem lê o .pkl nunca vê um arquivo pela metade
+    temporario = caminho.with_name(caminho.name + ".tmp")
+    joblib.dump(modelo, temporario)
+    os.replace(temporario, caminho)
+    return caminho
+
+def _executar(funcao, nome, nucleos, diretorio):
+    # Roda dentro do processo do pool: limita as threads de BLAS/OpenMP ao que coube a este modelo
+    inicio = time.perf_counter()
+    try:
+        from threadpoolctl import threadpool_limits
+        limite = threadpool_limits(nucleos)
+    except ImportError:
+        limite = None
+    try:
+        previsoes = funcao(matriz_atributos.MatrizAtributos(diretorio), nucleos)
+    finally:
+        if limite is not None:
+            limite.restore_original_limits()
+    return previsoes, time.perf_counter() - inicio
+
+def executar_treinos(treinos, pesos, diretorio=None, orcamento=NUCLEOS_ML, paralelo=TREINO_PARALELO):
+    # treinos: {nome: função(matriz, nucleos) -> {coluna: previsões}}. Devolve {nome: previsões}
+    if not paralelo:
+        resultados = {}
+        for nome, funcao in treinos.items():
+            resultados[nome], tempo = _executar(funcao, nome, orcamento, diretorio)
+            print(f"Treino {nome}: {tempo:.1f}s ({orcamento} núcleos)")
+        return resultados
+
+    nucleos = distribuir_nucleos(pesos, orcamento)
+    processos = min(len(treinos), orcamento)
+    print(f"Treinando {len(treinos)} modelos em {processos} processos (núcleos: {nucleos})")
+    # spawn: processos novos, sem herdar threads do OpenMP/XGBoost do processo pai
+    with ProcessPoolExecutor(max_workers=processos, mp_context=multiprocessing.get_context("spawn")) as pool:
+        # Os mais pesados primeiro, para o mais lento começar logo
+        ordem = sorted(treinos, key=lambda nome: -pesos.get(nome, 0))
+        futuros = {nome: pool.submit(_executar, treinos[nome], nome, nucleos[nome], diretorio) for nome in ordem}
+        resultados = {}
+        for nome in treinos:
+            resultados[nome], tempo = futuros[nome].result()
+            print(f"Treino {nome}: {tempo:.1f}s ({nucleos[nome]} núcleos)")
+    return resultados
@@ -0,0 +1,125 @@
+import os
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv('credenciais_arquivos.env')
+
+# Colunas de cada arquivo usadas nos contadores
+ESQUEMAS = {
+    "comercial": {"os": "SS_NUMERO", "prefixo": "PREFIXO", "municipio": "MUNICIPIO",
+                  "efetividade": "EFETIVIDADE_VISITA", "data": "INICIO_DESLOCAMENTO"},
+    "emergencial": {"os": "OS", "prefixo": "PREFIXO", "municipio": "MUNICIPIO",
+                    "efetividade": "EFETIVIDADE", "data": "INICIO_DESLOCAMENTO"}
+}
+
+NAO_EFETIVA = "NÃO EFETIVA"
+HORAS_TURNO = 8  # Três turnos por dia: 0h-8h, 8h-16h e 16h-24h
+
+def _periodo_mes(datas):
+    return datas.astype("datetime64[M]").astype(np.int64)
+
+def _periodo_dia(datas):
+    return datas.astype("datetime64[D]").astype(np.int64)
+
+def _periodo_semana(datas):
+    # 01/01/1970 foi uma quinta-feira: +3 faz a semana começar na segunda
+    return (datas.astype("datetime64[D]").astype(np.int64) + 3) // 7
+
+def _periodo_turno(datas):
+    return datas.astype("datetime64[h]").astype(np.int64) // HORAS_TURNO
+
+GRANULARIDADES = {
+    "MES": _periodo_mes,
+    "DIA": _periodo_dia,
+    "SEMANA": _periodo_semana,
+    "TURNO": _periodo_turno
+}
+
+# MES e DIA são as colunas originais; CONTADORES_EXTRAS (ex.: "SEMANA,TURNO") acrescenta outras
+GRANULARIDADES_PADRAO = ["MES", "DIA"]
+GRANULARIDADES_EXTRAS = [g.strip().upper() for g in os.getenv("CONTADORES_EXTRAS", "").split(",")
+                         if g.strip().upper() in GRANULARIDADES and g.strip().upper() not in GRANULARIDADES_PADRAO]
+
+def coluna_prefixo(granularidade):
+    return f"QTD OS POR PREFIXO({granularidade})"
+
+def coluna_cidade(granularidade):
+    return f"EFETIVIDADE POR CIDADE ({granularidade})"
+
+def colunas_extras():
+    return [coluna for g in GRANULARIDADES_EXTRAS for coluna in (coluna_prefixo(g), coluna_cidade(g))]
+
+def _codigos(serie):
+    # Categorical já tem os códigos prontos; texto/número é fatorado uma única vez (nulos = -1)
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        return serie.cat.codes.to_numpy(dtype=np.int64), len(serie.cat.categories)
+    codigos, valores = pd.factorize(serie)
+    return codigos.astype(np.int64), len(valores)
+
+def _codigos_periodo(datas, granularidade):
+    validas = ~np.isnat(datas)
+    periodos = np.full(len(datas), -1, dtype=np.int64)
+    if validas.any():
+        brutos = GRANULARIDADES[granularidade](datas[validas])
+        periodos[validas] = brutos - brutos.min()
+    return periodos, int(periodos.max()) + 1 if validas.any() else 0
+
+def _distintos_por_chave(chave, os_codigo, n_os, mascara, n_chaves):
+    # Quantidade de OS distintas por chave: pares (chave, OS) únicos em um único hash de inteiros
+    # e contagem com bincount, sem montar grupos do pandas
+    pares = pd.unique(chave[mascara] * n_os + os_codigo[mascara])
+    return np.bincount(pares // n_os, minlength=n_chaves)
+
+def calcular_contadores(df, esquema, granularidades=None, distintos=None):
+    # Calcula QTD OS POR PREFIXO(<g>) e EFETIVIDADE POR CIDADE (<g>) para cada granularidade
+    # a partir de uma única fatoração de OS, PREFIXO, MUNICIPIO e das datas.
+    # Mesma semântica dos groupbys originais: chave com PREFIXO ou período nulo fica sem contagem (NaN)
+    # e a efetividade é 0 onde a cidade não teve OS não efetiva no período.
+    # "distintos" troca a contagem de OS distintas por chave (ex.: motor_sql.distintos_por_chave).
+    colunas = ESQUEMAS[esquema]
+    distintos = distintos or _distintos_por_chave
+    granularidades = granularidades or GRANULARIDADES_PADRAO + GRANULARIDADES_EXTRAS
+
+    os_codigo, n_os = _codigos(df[colunas["os"]])
+    prefixo, n_prefixos = _codigos(df[colunas["prefixo"]])
+    municipio, n_municipios = _codigos(df[colunas["municipio"]])
+    nao_efetiva = (df[colunas["efetividade"]] == NAO_EFETIVA).to_numpy(dtype=bool)
+    datas = pd.to_datetime(df[colunas["data"]], errors='coerce').to_numpy(dtype="datetime64[ns]")
+    n_os = max(n_os, 1)
+    os_valida = os_codigo >= 0
+
+    for granularidade in granularidades:
+        periodo, n_periodos = _codigos_periodo(datas, granularidade)
+
+        valida = (prefixo >= 0) & (periodo >= 0)
+        chave = np.where(valida, prefixo * n_periodos + periodo, 0)
+        contagem = distintos(chave, os_codigo, n_os, valida & os_valida, max(n_prefixos * n_periodos, 1))
+        if valida.all():
+            df[coluna_prefixo(granularidade)] = contagem[chave]
+        else:
+            df[coluna_prefixo(granularidade)] = np.where(valida, contagem[chave], np.nan)
+
+        valida = (municipio >= 0) & (periodo >= 0)
+        chave = np.where(valida, municipio * n_periodos + periodo, 0)
+        contagem = distintos(chave, os_codigo, n_os, valida & os_valida & nao_efetiva,
+                             max(n_municipios * n_periodos, 1))
+        df[coluna_cidade(granularidade)] = np.where(valida, contagem[chave], 0).astype(int)
+    return df
+
+def chaves_baldes(df, esquema, granularidade):
+    # Identificador inteiro de cada balde (PREFIXO, período) e (MUNICIPIO, período) da linha, -1 quando
+    # a chave é nula. Os códigos vêm das colunas categóricas, então só são comparáveis entre DataFrames
+    # com as mesmas categorias (usado pelo ETL incremental para achar os baldes afetados).
+    colunas = ESQUEMAS[esquema]
+    datas = pd.to_datetime(df[colunas["data"]], errors='coerce').to_numpy(dtype="datetime64[ns]")
+    validas = ~np.isnat(datas)
+    periodo = np.zeros(len(df), dtype=np.int64)
+    if validas.any():
+        periodo[validas] = GRANULARIDADES[granularidade](datas[validas])
+    chaves = {}
+    for tipo in ("prefixo", "municipio"):
+        codigos, _ = _codigos(df[colunas[tipo]])
+        valida = validas & (codigos >= 0)
+        chaves[tipo] = np.where(valida, (codigos << 32) | (periodo & 0xFFFFFFFF), -1)
+    return chaves
@@ -0,0 +1,234 @@
+import os
+import json
+import math
+import time
+import hashlib
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from dotenv import load_dotenv
+import armazenamento
+import cubo_kpi
+import publicacao
+import geometrias_mapa
+
+# API local (somente leitura) sobre as saídas do pipeline: os dados são carregados uma vez na memória,
+# as respostas ficam num cache LRU por rota e filtros (com ETag) e tudo é recarregado quando o pipeline
+# publica uma nova execução (publicacao.json)
+load_dotenv('credenciais_arquivos.env')
+API_HOST = os.getenv("API_HOST", "127.0.0.1")
+API_PORTA = int(os.getenv("API_PORTA", "8050"))
+TAMANHO_CACHE_API = int(os.getenv("TAMANHO_CACHE_API", "512"))
+INTERVALO_RECARGA_API = float(os.getenv("INTERVALO_RECARGA_API", "5"))
+
+ARQUIVO_PREVISOES = "ML_dataframe_OPER.csv"
+COLUNAS_PREVISOES = ["OS", "STATUS", "PREFIXO", "MUNICIPIO", "DATA SOLICITACAO", "DURACAO_SERVICO_PRED", "TEMPO_RESPOSTA_PRED",
+                     "TEMPO_IDEAL_PRED", "TEMPO_DESLOCAMENTO_PRED", "PREVISAO_DURACAO_PREFIXO", "PREVISAO_DURACAO_CIDADE"]
+FILTROS_KPI = ["municipio", "prefixo", "status", "mes", "dia"]
+
+def _valor(valor):
+    # Tipos do numpy/pandas para JSON (NaN vira null)
+    if isinstance(valor, (np.integer,)):
+        return int(valor)
+    if isinstance(valor, (float, np.floating)):
+        return None if math.isnan(valor) else float(valor)
+    if isinstance(valor, pd.Timestamp):
+        return valor.isoformat()
+    if valor is pd.NaT:
+        return None
+    return valor
+
+def _registros(df):
+    return [{coluna: _valor(valor) for coluna, valor in linha.items()} for linha in df.to_dict(orient="records")]
+
+class DadosPublicados:
+    # Uma execução publicada inteira na memória; nunca é alterada depois de montada
+
+    def __init__(self, diretorio):
+        self.publicacao = publicacao.ler_publicacao(diretorio) or {"id": "sem_publicacao"}
+        self.versao = self.publicacao["id"]
+        self.cubo = cubo_kpi.CuboKPI(diretorio) if cubo_kpi.caminho_cubo(diretorio).exists() else None
+        self.previsoes = self._carregar_previsoes(diretorio / ARQUIVO_PREVISOES)
+
+    @staticmethod
+    def _carregar_previsoes(caminho):
+        if not caminho.exists():
+            return None
+        cabecalho = pd.read_csv(caminho, sep=";", nrows=0, encoding="utf-8-sig").columns
+        df = pd.read_csv(caminho, sep=";", encoding="utf-8-sig", usecols=[c for c in COLUNAS_PREVISOES if c in cabecalho])
+        df["OS"] = df["OS"].astype(str)
+        # Índice ordenado pela OS: a previsão de uma OS é uma busca no índice
+        return df.set_index("OS", drop=False).sort_index()
+
+class CacheRespostas:
+    # LRU de respostas já serializadas (corpo + ETag), por versão publicada, rota e filtros
+
+    def __init__(self, tamanho):
+        self.tamanho = tamanho
+        self._itens = OrderedDict()
+        self._trava = threading.Lock()
+
+    def obter(self, chave, gerar):
+        with self._trava:
+            if chave in self._itens:
+                self._itens.move_to_end(chave)
+                return self._itens[chave]
+        resultado = gerar()
+        # Camadas do mapa já chegam serializadas (e em cache no disco)
+        corpo = resultado if isinstance(resultado, bytes) else json.dumps(resultado, ensure_ascii=False, allow_nan=False).encode("utf-8")
+        item = (corpo, '"' + hashlib.sha1(corpo).hexdigest() + '"')
+        with self._trava:
+            self._itens[chave] = item
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.tamanho:
+                self._itens.popitem(last=False)
+        return item
+
+    def limpar(self):
+        with self._trava:
+            self._itens.clear()
+
+class ServicoLeitura:
+    def __init__(self, diretorio=None, tamanho_cache=TAMANHO_CACHE_API):
+        self.diretorio = armazenamento.DIRETORIO_SAIDA if diretorio is None else diretorio
+        self.cache = CacheRespostas(tamanho_cache)
+        self._trava_recarga = threading.Lock()
+        self._marca = None
+        self.dados = None
+        self.recarregar_se_publicado()
+
+    def _marca_publicacao(self):
+        caminho = publicacao.caminho_publicacao(self.diretorio)
+        return caminho.stat().st_mtime_ns if caminho.exists() else None
+
+    def recarregar_se_publicado(self):
+        # Monta a nova execução por fora e troca a referência de uma vez: requisições em andamento
+        # terminam com os dados antigos e as novas já usam os novos
+        marca = self._marca_publicacao()
+        if self.dados is not None and marca == self._marca:
+            return False
+        with self._trava_recarga:
+            if self.dados is not None and marca == self._marca:
+                return False
+            self.dados = DadosPublicados(self.diretorio)
+            self._marca = marca
+            self.cache.limpar()
+        print(f"Dados carregados (publicação {self.dados.versao})")
+        return True
+
+    def vigiar(self, intervalo=INTERVALO_RECARGA_API):
+        def laco():
+            while True:
+                time.sleep(intervalo)
+                try:
+                    self.recarregar_se_publicado()
+                except Exception as e:
+                    print(f"Falha ao recarregar a publicação: {e}")
+        threading.Thread(target=laco, daemon=True).start()
+
+    def responder(self, rota, parametros):
+        dados = self.dados
+        chave = (dados.versao, rota, tuple(sorted(parametros.items())))
+        return self.cache.obter(chave, lambda: self._gerar(dados, rota, parametros))
+
+    def _gerar(self, dados, rota, parametros):
+        filtros = {nome: parametros.get(nome) for nome in FILTROS_KPI}
+        if rota == "/saude":
+            return {"versao": dados.versao, "publicacao": dados.publicacao,
+                    "cubo": dados.cubo is not None, "previsoes": dados.previsoes is not None}
+        if rota == "/kpi":
+            self._exigir(dados.cubo, "cubo de KPIs")
+            return {"versao": dados.versao, "kpi": {k: _valor(v) for k, v in (dados.cubo.consultar(**filtros) or {}).items()}}
+        if rota == "/kpi/fatia":
+            self._exigir(dados.cubo, "cubo de KPIs")
+            por = parametros.get("por", "MES").upper()
+            return {"versao": dados.versao, "por": por, "linhas": _registros(dados.cubo.fatia(por, **filtros))}
+        if rota == "/mapa":
+            # Um registro por município (dados do mapa coroplético), com os demais filtros aplicados
+            self._exigir(dados.cubo, "cubo de KPIs")
+            filtros["municipio"] = None
+            return {"versao": dados.versao, "municipios": _registros(dados.cubo.fatia("MUNICIPIO", **filtros))}
+        if rota == "/mapa/camada":
+            # TopoJSON simplificado com a métrica de cada município (camada coroplética pronta)
+            self._exigir(dados.cubo, "cubo de KPIs")
+            return geometrias_mapa.camada_coropletica(dados.cubo, dados.versao, parametros.get("metrica", "QTD_OS"),
+                                                      mes=filtros["mes"], status=filtros["status"],
+                                                      nivel=parametros.get("nivel", geometrias_mapa.NIVEL_PADRAO))
+        if rota.startswith("/previsoes/"):
+            self._exigir(dados.previsoes, ARQUIVO_PREVISOES)
+            os_numero = rota[len("/previsoes/"):]
+            linhas = dados.previsoes.loc[[os_numero]] if os_numero in dados.previsoes.index else dados.previsoes.iloc[0:0]
+            if parametros.get("status"):
+                linhas = linhas[linhas["STATUS"].astype(str) == parametros["status"]]
+            return {"versao": dados.versao, "os": os_numero, "previsoes": _registros(linhas)}
+        raise LookupError(rota)
+
+    @staticmethod
+    def _exigir(valor, nome):
+        if valor is None:
+            raise FileNotFoundError(f"{nome} não encontrado na publicação atual")
+
+def criar_manipulador(servico):
+    class Manipulador(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            parametros = {nome: valores[-1] for nome, valores in parse_qs(url.query).items()}
+            try:
+                corpo, etag = servico.responder(url.path.rstrip("/") or "/", parametros)
+            except LookupError:
+                return self._enviar(404, {"erro": f"rota desconhecida: {url.path}"})
+            except FileNotFoundError as e:
+                return self._enviar(503, {"erro": str(e)})
+            except ValueError as e:
+                return self._enviar(400, {"erro": str(e)})
+            if etag in [valor.strip() for valor in self.headers.get("If-None-Match", "").split(",")]:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(corpo)))
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def _enviar(self, codigo, conteudo):
+            corpo = json.dumps(conteudo, ensure_ascii=False).encode("utf-8")
+            self.send_response(codigo)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def log_message(self, formato, *argumentos):
+            pass
+
+    return Manipulador
+
+def ler_argumentos(argv=None):
+    parser = argparse.ArgumentParser(description="API local de leitura das saídas do pipeline")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--porta", type=int, default=API_PORTA)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    argumentos = ler_argumentos(argv)
+    servico = ServicoLeitura()
+    servico.vigiar()
+    servidor = ThreadingHTTPServer((argumentos.host, argumentos.porta), criar_manipulador(servico))
+    print(f"API de leitura em http://{argumentos.host}:{argumentos.porta} (/saude, /kpi, /kpi/fatia, /mapa, /mapa/camada, /previsoes/<OS>)")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import os
+import pandas as pd
+from pathlib import Path
+from dotenv import load_dotenv
+import normalizacao_datas
+
+# 1. Configuração do formato dos arquivos intermediários (FORMATO_INTERMEDIARIO = "csv" ou "parquet")
+load_dotenv('credenciais_arquivos.env')
+DIRETORIO_SAIDA = Path(os.getenv("DIRETORIO_SAIDA", "."))
+FORMATO_INTERMEDIARIO = os.getenv("FORMATO_INTERMEDIARIO", "csv")
+
+EXTENSOES = {"csv": ".csv", "parquet": ".parquet"}
+
+# Relatórios de execução (métricas por etapa, chaves sem ID, municípios sem polígono) dentro do DIRETORIO_SAIDA
+DIRETORIO_RELATORIOS = "relatorios_execucao"
+
+# 2. Esquema fixo das colunas dos intermediários (in1 -> in2/in3 -> in4 -> ML1).
+# Colunas fora do esquema são gravadas com o tipo inferido pelo pandas.
+COLUNAS_DATA = ['DATA_SOLICITACAO', 'DATA_ABERTURA', 'INICIO_DESLOCAMENTO', 'FIM_DESLOCAMENTO', 'INICIO_EXECUCAO', 'FIM_EXECUCAO',
+                'DATA SOLICITACAO', 'DATA INICIO DESLOCAMENTO', 'DATA FIM DESLOCAMENTO', 'DATA INICIO EXECUCAO', 'DATA FIM EXECUCAO']
+
+COLUNAS_INTEIRO = ['SS_NUMERO', 'OS', 'ID PREFIXO', 'ID MUNICIPIO', 'ID EFETIVIDADE', 'ID TIPO SERVICO COMERCIAL',
+                   'ID SUBTIPO SERVICO COMERCIAL', 'ID MOTIVO RECLAMACAO EMERGENCIA', 'ID CAUSA', 'ID PLACA', 'ID TIPO EQUIPE',
+                   'ID PERFIL', 'ID TIPO', 'ID TIPO OS', 'ID SUB OS', 'ID STATUS', 'QTD OS POR PREFIXO(MES)', 'QTD OS POR PREFIXO(DIA)',
+                   'EFETIVIDADE POR CIDADE (MES)', 'EFETIVIDADE POR CIDADE (DIA)', 'TEMPO_RESPOSTA',
+                   'QTD OS POR PREFIXO(SEMANA)', 'QTD OS POR PREFIXO(TURNO)', 'EFETIVIDADE POR CIDADE (SEMANA)',
+                   'EFETIVIDADE POR CIDADE (TURNO)']
+
+COLUNAS_CATEGORIA = ['PREFIXO', 'MUNICIPIO', 'TIPO_SERVICO', 'SUBTIPO_SERVICO', 'EFETIVIDADE_VISITA', 'EFETIVIDADE', 'CAUSA',
+                     'MOTIVO_RECLAMACAO', 'TIPO OS', 'SUB OS', 'STATUS', 'TIPO SERVICO COMERCIAL', 'SUBTIPO SERVICO COMERCIAL',
+                     'MOTIVO RECLAMACAO EMERGENCIA', 'PLACA', 'TIPO EQUIPE', 'PERFIL', 'TIPO']
+
+ESQUEMA = {
+    **{coluna: "data" for coluna in COLUNAS_DATA},
+    **{coluna: "inteiro" for coluna in COLUNAS_INTEIRO},
+    **{coluna: "categoria" for coluna in COLUNAS_CATEGORIA}
+}
+
+def caminho_intermediario(nome, diretorio=None, formato=None):
+    diretorio = DIRETORIO_SAIDA if diretorio is None else Path(diretorio)
+    return diretorio / f"{nome}{EXTENSOES[formato or FORMATO_INTERMEDIARIO]}"
+
+def existe_intermediario(nome, diretorio=None, formato=None):
+    return caminho_intermediario(nome, diretorio, formato).exists()
+
+def inteiros_anulaveis(df):
+    # IDs/contadores em Int64 (nulos preservados): o tipo não depende de haver nulo no arquivo ou no bloco
+    for coluna in df.columns:
+        if ESQUEMA.get(coluna) == "inteiro":
+            convertido = pd.to_numeric(df[coluna], errors='coerce')
+            # Códigos não numéricos (ex.: "SS-123") mantêm o tipo original em vez de virar nulo
+            if convertido.isna().sum() == df[coluna].isna().sum():
+                df[coluna] = convertido.round().astype("Int64")
+    return df
+
+def aplicar_esquema(df):
+    # Datas em datetime64, IDs/contadores em Int64 (nulos preservados) e dimensões como category
+    df = df.copy()
+    df = normalizacao_datas.normalizar_datas(df, [c for c in df.columns if ESQUEMA.get(c) == "data"])
+    df = inteiros_anulaveis(df)
+    for coluna in df.columns:
+        if ESQUEMA.get(coluna) == "categoria" and not isinstance(df[coluna].dtype, pd.CategoricalDtype):
+            df[coluna] = df[coluna].where(df[coluna].isna(), df[coluna].astype(str)).astype("category")
+    return df
+
+def esquema_arrow(df):
+    import pyarrow as pa
+    inferido = pa.Schema.from_pandas(df, preserve_index=False)
+    campos = []
+    for campo in inferido:
+        tipo = ESQUEMA.get(campo.name)
+        dtype = df[campo.name].dtype
+        if tipo == "data":
+            campo = pa.field(campo.name, pa.timestamp("ns"))
+        elif tipo == "inteiro" and str(dtype) == "Int64":
+            campo = pa.field(campo.name, pa.int64())
+        elif tipo == "categoria" and isinstance(dtype, pd.CategoricalDtype):
+            campo = pa.field(campo.name, pa.dictionary(pa.int32(), pa.string()))
+        campos.append(campo)
+    return pa.schema(campos)
+
+def restaurar_tipos(df, manter_categorias=False):
+    # Inteiros sem nulos voltam como int64 (com nulos, float64, como na leitura do CSV)
+    for coluna in df.columns:
+        tipo = ESQUEMA.get(coluna)
+        if tipo == "inteiro" and str(df[coluna].dtype) == "Int64":
+            df[coluna] = df[coluna].astype("int64") if not df[coluna].isna().any() else df[coluna].astype("float64")
+        elif tipo == "categoria" and not manter_categorias and isinstance(df[coluna].dtype, pd.CategoricalDtype):
+            df[coluna] = df[coluna].astype(object)
+    return df
+
+def _caminho_temporario(caminho):
+    return caminho.with_name(caminho.name + ".tmp")
+
+def salvar_intermediario(df, nome, diretorio=None, formato=None):
+    formato = formato or FORMATO_INTERMEDIARIO
+    caminho = caminho_intermediario(nome, diretorio, formato)
+    temporario = _caminho_temporario(caminho)
+    try:
+        if formato == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            df = aplicar_esquema(df)
+            tabela = pa.Table.from_pandas(df, schema=esquema_arrow(df), preserve_index=False)
+            pq.write_table(tabela, temporario)
+        else:
+            df.to_csv(temporario, index=False, sep=";", encoding="utf-8-sig")
+    except Exception:
+        temporario.unlink(missing_ok=True)
+        raise
+    os.replace(temporario, caminho)
+    return caminho
+
+def carregar_intermediario(nome, colunas=None, diretorio=None, formato=None, manter_categorias=False):
+    formato = formato or FORMATO_INTERMEDIARIO
+    caminho = caminho_intermediario(nome, diretorio, formato)
+    if not caminho.exists():
+        return None
+    if formato == "parquet":
+        # Leitura projetada: só as colunas pedidas saem do disco, já com os tipos gravados
+        df = pd.read_parquet(caminho, columns=colunas)
+        return restaurar_tipos(df, manter_categorias)
+
+    df = pd.read_csv(caminho, sep=";", encoding_errors='ignore', usecols=colunas)
+    return normalizacao_datas.normalizar_datas(df, [c for c in df.columns if ESQUEMA.get(c) == "data"], nome)
+
+def ler_intermediario_em_blocos(nome, tamanho_bloco, colunas=None, diretorio=None, formato=None, manter_categorias=False):
+    # Mesmo resultado do carregar_intermediario, entregue em blocos de no máximo "tamanho_bloco" linhas
+    # (CSV com chunksize, Parquet por lotes de row groups): a memória não cresce com o arquivo
+    formato = formato or FORMATO_INTERMEDIARIO
+    caminho = caminho_intermediario(nome, diretorio, formato)
+    if not caminho.exists():
+        return
+    if formato == "parquet":
+        import pyarrow.parquet as pq
+        arquivo = pq.ParquetFile(caminho)
+        for lote in arquivo.iter_batches(batch_size=tamanho_bloco, columns=colunas):
+            yield restaurar_tipos(lote.to_pandas(), manter_categorias)
+        return
+
+    for df in pd.read_csv(caminho, sep=";", encoding_errors='ignore', usecols=colunas, chunksize=tamanho_bloco):
+        yield normalizacao_datas.normalizar_datas(df, [c for c in df.columns if ESQUEMA.get(c) == "data"], nome)
+
+class GravadorIntermediario:
+    # Grava um intermediário bloco a bloco (CSV anexado ou row groups de um único Parquet).
+    # O esquema Parquet é fixado no primeiro bloco e os seguintes são convertidos para ele.
+    # Os blocos vão para "<arquivo>.tmp", que só substitui o intermediário no fechar (os.replace): uma falha
+    # no meio descarta o temporário e mantém o arquivo anterior, em vez de deixar um arquivo truncado
+    # que a próxima execução tomaria como válido.
+
+    def __init__(self, nome, diretorio=None, formato=None):
+        self.formato = formato or FORMATO_INTERMEDIARIO
+        self.caminho = caminho_intermediario(nome, diretorio, self.formato)
+        self.linhas = 0
+        self._temporario = _caminho_temporario(self.caminho)
+        self._iniciado = False
+        self._escritor = None
+        self._esquema = None
+
+    def __enter__(self):
+        return self
+
+    def escrever(self, df):
+        if self.formato == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            df = aplicar_esquema(df)
+            if self._escritor is None:
+                self._esquema = esquema_arrow(df)
+                self._escritor = pq.ParquetWriter(self._temporario, self._esquema)
+            self._escritor.write_table(pa.Table.from_pandas(df, schema=self._esquema, preserve_index=False))
+        else:
+            primeiro = not self._iniciado
+            df.to_csv(self._temporario, index=False, sep=";", encoding="utf-8-sig" if primeiro else "utf-8",
+                      mode="w" if primeiro else "a", header=primeiro)
+        self._iniciado = True
+        self.linhas += len(df)
+
+    def fechar(self, colunas_vazio=None):
+        # Sem nenhum bloco escrito, grava um arquivo vazio só com o cabeçalho
+        if not self._iniciado and colunas_vazio is not None:
+            self.escrever(pd.DataFrame(columns=colunas_vazio))
+        if self._escritor is not None:
+            self._escritor.close()
+            self._escritor = None
+        if self._iniciado:
+            os.replace(self._temporario, self.caminho)
+            self._iniciado = False
+
+    def descartar(self):
+        if self._escritor is not None:
+            self._escritor.close()
+            self._escritor = None
+        if self._iniciado:
+            self._temporario.unlink(missing_ok=True)
+            self._iniciado = False
+
+    def __exit__(self, tipo, valor, traceback):
+        if tipo is None:
+            self.fechar()
+        else:
+            self.descartar()
+        return False
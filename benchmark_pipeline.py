@@ -0,0 +1,148 @@
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+import subprocess
+from pathlib import Path
+from datetime import datetime
+import metricas_execucao
+
+DIRETORIO_BENCHMARK = os.getenv("DIRETORIO_BENCHMARK", "benchmark")
+TAMANHOS_PADRAO = [10_000, 100_000, 1_000_000, 10_000_000]
+ARQUIVO_RESULTADO = "resultado_benchmark.json"
+
+def medir(resultados, nome, funcao, *argumentos):
+    # Memória e CPU da etapa pelo metricas_execucao: pico amostrado só durante a etapa (o ru_maxrss é o pico
+    # da vida inteira do processo) e CPU de todas as threads e dos processos filhos (pool de treino)
+    amostrador = metricas_execucao.AmostradorRSS()
+    amostrador.start()
+    inicio, cpu = time.perf_counter(), metricas_execucao.cpu_s()
+    registro = {"etapa": nome}
+    try:
+        retorno = funcao(*argumentos)
+        registro["status"] = "sucesso"
+    except Exception as e:
+        retorno = None
+        registro["status"] = "erro"
+        registro["erro"] = str(e)[:500]
+        registro["traceback"] = traceback.format_exc()
+    registro["tempo_parede_s"] = round(time.perf_counter() - inicio, 3)
+    registro["tempo_cpu_s"] = round(metricas_execucao.cpu_s() - cpu, 3)
+    registro["rss_inicial_mb"] = amostrador.inicial
+    registro["pico_rss_mb"] = amostrador.parar()
+    resultados.append(registro)
+    print(f"  {nome}: {registro['tempo_parede_s']}s ({registro['status']})")
+    if registro["status"] == "erro":
+        print(registro["traceback"])
+    return retorno
+
+def medir_etapas(diretorio):
+    # Roda dentro de um processo próprio com DIRETORIO_SAIDA apontando para os dados sintéticos,
+    # pois os scripts leem o diretório de saída na importação
+    import in2_ETL_oper_comercial as in2
+    import in3_ETL_oper_emergencial as in3
+    import in4_DF_oper as in4
+    import ML1_TreinoTeste as ML1
+
+    resultados = []
+    medir(resultados, "in2", in2.realizar_juncao)
+    medir(resultados, "in3", in3.realizar_juncao)
+    medir(resultados, "in4", in4.unificar)
+
+    df_original = medir(resultados, "ML1_carregar", ML1.carregar_OPER)
+    preparados = medir(resultados, "ML1_preparar_dados", ML1.preparar_dados, df_original) if df_original is not None else None
+    if preparados is not None:
+        df, futuro = preparados
+        matriz = medir(resultados, "ML1_matriz_atributos", ML1.montar_matriz, df, futuro)
+        # Cada modelo sozinho com todos os núcleos e depois os cinco juntos pelo agendador
+        previsoes = {nome: medir(resultados, f"ML1_{nome}", funcao, matriz, ML1.agendador_treino.NUCLEOS_ML)
+                     for nome, funcao in ML1.TREINOS.items()} if matriz is not None else {}
+        medir(resultados, "ML1_treino_paralelo", ML1.treinar_modelos, matriz)
+        if matriz is not None:
+            comparar_regressores(resultados, ML1, matriz)
+        df_filtrado = None
+        if previsoes and all(valor is not None for valor in previsoes.values()):
+            df_filtrado = medir(resultados, "ML1_aplicar_previsoes", ML1.aplicar_previsoes, df, matriz, previsoes)
+        if df_filtrado is not None:
+            medir(resultados, "ML1_finalizar", ML1.finalizar, df_filtrado)
+
+    with open(Path(diretorio) / ARQUIVO_RESULTADO, "w", encoding="utf-8") as f:
+        json.dump(resultados, f, ensure_ascii=False, indent=2)
+
+def comparar_regressores(resultados, ML1, matriz):
+    # Duração e resposta com cada regressor de regressores.py, na mesma divisão treino/teste dos modelos,
+    # cada um medido como uma etapa (ML1_<modelo>_<regressor>) com o RMSE e o R² no registro
+    for modelo in ("duracao", "resposta"):
+        print(f"  Regressores - {modelo}:")
+        X, y = matriz.dados(modelo)
+        divisao = ML1.train_test_split(X, y, test_size=0.2, random_state=42)
+        for regressor in ML1.regressores.REGRESSORES:
+            comparacao = medir(resultados, f"ML1_{modelo}_{regressor}", ML1.regressores.comparar,
+                               *divisao, modelo == "duracao", (regressor,))
+            if comparacao is not None:
+                comparacao[0].pop("regressor")
+                resultados[-1].update(comparacao[0])
+
+def executar_tamanho(linhas, diretorio_base, semente):
+    from gerador_dados_sinteticos import gerar_dados
+
+    diretorio = Path(diretorio_base) / f"linhas_{linhas}"
+    print(f"\n=== {linhas} linhas ===")
+    inicio = time.perf_counter()
+    gerar_dados(linhas, diretorio, semente=semente)
+    tempo_geracao = round(time.perf_counter() - inicio, 3)
+
+    ambiente = dict(os.environ, DIRETORIO_SAIDA=str(diretorio.resolve()))
+    comando = [sys.executable, str(Path(__file__).resolve()), "--medir", str(diretorio.resolve())]
+    retorno = subprocess.run(comando, env=ambiente, cwd=Path(__file__).resolve().parent)
+
+    caminho = diretorio / ARQUIVO_RESULTADO
+    etapas = json.loads(caminho.read_text(encoding="utf-8")) if caminho.exists() else []
+    return {"linhas": linhas, "tempo_geracao_s": tempo_geracao, "codigo_saida": retorno.returncode, "etapas": etapas}
+
+def imprimir_resumo(execucoes):
+    nomes = []
+    for execucao in execucoes:
+        for registro in execucao["etapas"]:
+            if registro["etapa"] not in nomes:
+                nomes.append(registro["etapa"])
+    print("\n" + "etapa".ljust(20) + "".join(f"{execucao['linhas']:>14}" for execucao in execucoes))
+    for nome in nomes:
+        linha = nome.ljust(20)
+        for execucao in execucoes:
+            registro = next((r for r in execucao["etapas"] if r["etapa"] == nome), None)
+            if registro is None:
+                linha += f"{'-':>14}"
+            else:
+                linha += f"{registro['tempo_parede_s']:>13}s" if registro["status"] == "sucesso" else f"{'erro':>14}"
+        print(linha)
+
+def ler_argumentos(argv=None):
+    parser = argparse.ArgumentParser(description="Mede in2, in3, in4 e cada modelo do ML1 com dados sintéticos")
+    parser.add_argument("--tamanhos", default=",".join(str(t) for t in TAMANHOS_PADRAO),
+                        help="Quantidades de linhas separadas por vírgula")
+    parser.add_argument("--destino", default=DIRETORIO_BENCHMARK)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--medir", metavar="DIRETORIO", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    argumentos = ler_argumentos(argv)
+    if argumentos.medir:
+        medir_etapas(argumentos.medir)
+        return
+
+    tamanhos = [int(t) for t in argumentos.tamanhos.split(",") if t.strip()]
+    execucoes = [executar_tamanho(linhas, argumentos.destino, argumentos.semente) for linhas in tamanhos]
+    imprimir_resumo(execucoes)
+
+    caminho = Path(argumentos.destino) / f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json"
+    with open(caminho, "w", encoding="utf-8") as f:
+        json.dump({"data": datetime.now().isoformat(timespec="seconds"), "execucoes": execucoes},
+                  f, ensure_ascii=False, indent=2)
+    print(f"\nResultados salvos em {caminho}")
+
+if __name__ == "__main__":
+    main()
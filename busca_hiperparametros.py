@@ -0,0 +1,103 @@
+import os
+import json
+import math
+import time
+import numpy as np
+from datetime import datetime
+from itertools import product
+from dotenv import load_dotenv
+from sklearn.model_selection import train_test_split
+from xgboost import XGBRegressor
+
+load_dotenv('credenciais_arquivos.env')
+
+# Busca de hiperparâmetros do XGBoost por eliminação sucessiva (successive halving): todos os candidatos
+# começam com uma fração das linhas, só o melhor terço passa para a rodada seguinte com três vezes mais
+# linhas, e cada ajuste para sozinho (early stopping) quando o RMSE da validação deixa de cair.
+# O orçamento (segundos e/ou quantidade de ajustes) encerra a busca com o melhor candidato até ali.
+ORCAMENTO_BUSCA_SEGUNDOS = float(os.getenv("ORCAMENTO_BUSCA_SEGUNDOS", "0"))  # 0 = sem limite
+ORCAMENTO_BUSCA_AJUSTES = int(os.getenv("ORCAMENTO_BUSCA_AJUSTES", "0"))  # 0 = sem limite
+FATOR_ELIMINACAO = 3
+LINHAS_MINIMAS_RODADA = 2000
+MAXIMO_ARVORES = 1000
+RODADAS_SEM_MELHORA = 30
+
+def candidatos(grade, anteriores=None):
+    # Combinações da grade; os melhores parâmetros da execução anterior entram primeiro (ponto de partida)
+    lista = [dict(zip(grade, valores)) for valores in product(*grade.values())]
+    if anteriores and all(parametro in anteriores for parametro in grade):
+        anteriores = {parametro: anteriores[parametro] for parametro in grade}
+        if anteriores in lista:
+            lista.remove(anteriores)
+        lista.insert(0, anteriores)
+    return lista
+
+def _modelo(parametros, nucleos, semente, arvores=MAXIMO_ARVORES, parada=RODADAS_SEM_MELHORA):
+    return XGBRegressor(**parametros, n_estimators=arvores, early_stopping_rounds=parada, eval_metric="rmse",
+                        tree_method="hist", n_jobs=nucleos, random_state=semente)
+
+def buscar(X, y, grade, nucleos=1, anteriores=None, orcamento_segundos=ORCAMENTO_BUSCA_SEGUNDOS,
+           orcamento_ajustes=ORCAMENTO_BUSCA_AJUSTES, semente=42):
+    # X já pré-processado (numpy). Devolve os melhores parâmetros (com n_estimators da parada antecipada) e a trilha
+    X, y = np.asarray(X), np.asarray(y)
+    X_ajuste, X_validacao, y_ajuste, y_validacao = train_test_split(X, y, test_size=0.2, random_state=semente)
+    ordem = np.random.RandomState(semente).permutation(len(X_ajuste))
+    restantes = candidatos(grade, anteriores)
+    rodadas = max(1, math.ceil(math.log(len(restantes), FATOR_ELIMINACAO)))
+
+    inicio = time.perf_counter()
+    trilha, melhor, ajustes, esgotado = [], None, 0, False
+
+    def estourou():
+        # Pelo menos um ajuste sempre roda
+        if ajustes == 0:
+            return False
+        if orcamento_segundos and time.perf_counter() - inicio >= orcamento_segundos:
+            return True
+        return bool(orcamento_ajustes) and ajustes >= orcamento_ajustes
+
+    for rodada in range(rodadas):
+        linhas = len(X_ajuste) if rodada == rodadas - 1 else \
+            min(len(X_ajuste), max(LINHAS_MINIMAS_RODADA, len(X_ajuste) // FATOR_ELIMINACAO ** (rodadas - 1 - rodada)))
+        amostra = ordem[:linhas]
+        pontuados = []
+        for parametros in restantes:
+            if estourou():
+                esgotado = True
+                break
+            comeco = time.perf_counter()
+            modelo = _modelo(parametros, nucleos, semente)
+            modelo.fit(X_ajuste[amostra], y_ajuste[amostra], eval_set=[(X_validacao, y_validacao)], verbose=False)
+            ajustes += 1
+            rmse, arvores = float(modelo.best_score), int(modelo.best_iteration) + 1
+            trilha.append({"rodada": rodada, "linhas": int(linhas), "parametros": parametros, "rmse_validacao": rmse,
+                           "arvores": arvores, "tempo_s": round(time.perf_counter() - comeco, 3)})
+            pontuados.append((rmse, arvores, parametros))
+
+        if pontuados:
+            # Candidatos da rodada mais recente: mais linhas, comparação mais fiel
+            pontuados.sort(key=lambda item: item[0])
+            melhor = pontuados[0]
+        if esgotado or len(pontuados) <= 1:
+            break
+        # Os melhores primeiro: se o orçamento acabar no meio da próxima rodada, eles já foram avaliados
+        restantes = [parametros for _, _, parametros in pontuados[:max(1, math.ceil(len(pontuados) / FATOR_ELIMINACAO))]]
+
+    rmse, arvores, parametros = melhor
+    return {"modo": "halving", "gerado_em": datetime.now().isoformat(timespec="seconds"),
+            "orcamento": {"segundos": orcamento_segundos, "ajustes": orcamento_ajustes}, "orcamento_esgotado": esgotado,
+            "ajustes": ajustes, "tempo_s": round(time.perf_counter() - inicio, 3), "rmse_validacao": rmse,
+            "melhores_parametros": dict(parametros, n_estimators=arvores), "partiu_de_anteriores": bool(anteriores),
+            "trilha": trilha}
+
+def carregar_trilha(caminho):
+    if not caminho.exists():
+        return None
+    with open(caminho, encoding="utf-8") as f:
+        return json.load(f)
+
+def salvar_trilha(resultado, caminho):
+    with open(caminho.with_suffix(".tmp"), "w", encoding="utf-8") as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    os.replace(caminho.with_suffix(".tmp"), caminho)
+    return caminho
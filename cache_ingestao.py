@@ -0,0 +1,107 @@
+import os
+import json
+import shutil
+import hashlib
+from pathlib import Path
+from datetime import datetime
+from dotenv import load_dotenv
+import armazenamento
+
+# 1. Configurações do cache local da ingestão
+load_dotenv('credenciais_arquivos.env')
+# Dentro do DIRETORIO_SAIDA, como os demais estados do pipeline (um caminho absoluto no .env vale como está)
+DIRETORIO_CACHE = os.getenv("DIRETORIO_CACHE_INGESTAO", "cache_ingestao")
+ARQUIVO_MANIFESTO = "manifesto_ingestao.json"
+ARQUIVO_FONTES_ALTERADAS = "fontes_alteradas.json"
+
+# Marcador devolvido no lugar do DataFrame quando a planilha não mudou no servidor
+INALTERADO = "inalterado"
+
+CAMPOS_METADADOS = ["TimeLastModified", "ETag", "Length"]
+
+def diretorio_cache():
+    return armazenamento.DIRETORIO_SAIDA / DIRETORIO_CACHE
+
+def caminho_manifesto():
+    return diretorio_cache() / ARQUIVO_MANIFESTO
+
+def carregar_manifesto():
+    caminho = caminho_manifesto()
+    if caminho.exists():
+        with open(caminho, encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+def salvar_manifesto(manifesto):
+    caminho = caminho_manifesto()
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+    temporario = caminho.with_suffix(".tmp")
+    with open(temporario, "w", encoding="utf-8") as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=2)
+    os.replace(temporario, caminho)
+
+def obter_metadados_servidor(ctxOD, server_relative_url_OD):
+    arquivoOD = ctxOD.web.get_file_by_server_relative_path(server_relative_url_OD)
+    ctxOD.load(arquivoOD, CAMPOS_METADADOS)
+    ctxOD.execute_query()
+    return {campo: str(arquivoOD.properties.get(campo)) for campo in CAMPOS_METADADOS}
+
+def hash_conteudo(conteudo):
+    return hashlib.sha256(conteudo).hexdigest()
+
+def arquivo_em_cache(registro):
+    return Path(registro.get("arquivo_cache", ""))
+
+def esta_inalterado(manifesto, nome, metadados, hash_arquivo=None):
+    # Sem hash compara só os metadados do servidor; com hash compara o conteúdo baixado.
+    # Um cache gravado em outro FORMATO_INTERMEDIARIO não serve e força a releitura.
+    registro = manifesto.get(nome)
+    if not registro:
+        return False
+    cache = arquivo_em_cache(registro)
+    if not cache.is_file() or cache.suffix != armazenamento.caminho_intermediario(nome).suffix:
+        return False
+    if hash_arquivo is None:
+        return registro.get("metadados") == metadados
+    return registro.get("hash") == hash_arquivo
+
+def _assinatura(caminho):
+    estatistica = os.stat(caminho)
+    return [estatistica.st_size, estatistica.st_mtime_ns]
+
+def registrar(manifesto, nome, metadados, hash_arquivo, caminho_saida):
+    cache = diretorio_cache() / Path(caminho_saida).name
+    cache.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(caminho_saida, cache)
+    manifesto[nome] = {
+        "metadados": metadados,
+        "hash": hash_arquivo,
+        "arquivo_cache": str(cache),
+        "assinatura_saida": _assinatura(caminho_saida),
+        "atualizado_em": datetime.now().isoformat(timespec="seconds")
+    }
+
+def restaurar(manifesto, nome, caminho_saida, metadados=None):
+    # Só copia do cache se o arquivo de saída sumiu ou foi reescrito por outra etapa
+    registro = manifesto[nome]
+    if not (os.path.exists(caminho_saida) and _assinatura(caminho_saida) == registro.get("assinatura_saida")):
+        shutil.copyfile(arquivo_em_cache(registro), caminho_saida)
+        registro["assinatura_saida"] = _assinatura(caminho_saida)
+    if metadados is not None:
+        registro["metadados"] = metadados
+
+def salvar_fontes_alteradas(alteradas, inalteradas, diretorio="."):
+    caminho = Path(diretorio) / ARQUIVO_FONTES_ALTERADAS
+    with open(caminho, "w", encoding="utf-8") as f:
+        json.dump({
+            "alteradas": sorted(alteradas),
+            "inalteradas": sorted(inalteradas),
+            "gerado_em": datetime.now().isoformat(timespec="seconds")
+        }, f, ensure_ascii=False, indent=2)
+
+def carregar_fontes_alteradas(diretorio="."):
+    caminho = Path(diretorio) / ARQUIVO_FONTES_ALTERADAS
+    if caminho.exists():
+        with open(caminho, encoding="utf-8") as f:
+            return json.load(f)
+    return None
@@ -0,0 +1,290 @@
+import os
+import re
+import json
+import difflib
+import threading
+import unicodedata
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from dotenv import load_dotenv
+import armazenamento
+from controle_incremental import hash_arquivo
+
+load_dotenv('credenciais_arquivos.env')
+
+# Camada geográfica pré-processada do geojs-GOIAS.json: índice nome normalizado -> código IBGE, centroides,
+# retângulos envolventes e uma grade regular para achar o município de um ponto sem varrer todos os polígonos.
+# Montada uma vez e guardada em camada_geo.npz (refeita só quando o hash do GeoJSON muda).
+ARQUIVO_GEOJSON = Path(__file__).resolve().parent / "geojs-GOIAS.json"
+ARQUIVO_CACHE_GEO = "camada_geo.npz"
+ARQUIVO_SEM_POLIGONO = "municipios_sem_poligono.json"
+RESOLUCAO_GRADE_GEO = int(os.getenv("RESOLUCAO_GRADE_GEO", "32"))  # células por lado da grade
+SUFIXO_UF = re.compile(r"\s*-\s*GO$")
+# Limite de elementos da matriz pontos x arestas testada de uma vez
+LIMITE_MATRIZ = 4_000_000
+
+def normalizar_nome(nome):
+    # "Abadia de Goiás", "ABADIA DE GOIAS" e "ABADIA DE GOIAS - GO" viram "ABADIA DE GOIAS"
+    sem_acento = unicodedata.normalize("NFKD", str(nome)).encode("ascii", "ignore").decode("ascii").upper()
+    sem_acento = SUFIXO_UF.sub("", sem_acento.strip())
+    return " ".join(re.sub(r"[^A-Z0-9]+", " ", sem_acento).split())
+
+def _compacto(nome):
+    # Segunda chance para grafias com ou sem separador ("SAO JOAO D ALIANCA" x "SAO JOAO DALIANCA")
+    return normalizar_nome(nome).replace(" ", "")
+
+def caminho_cache(diretorio=None):
+    diretorio = armazenamento.DIRETORIO_SAIDA if diretorio is None else diretorio
+    return diretorio / ARQUIVO_CACHE_GEO
+
+def _aneis(geometria):
+    if geometria["type"] == "Polygon":
+        return [geometria["coordinates"]]
+    if geometria["type"] == "MultiPolygon":
+        return geometria["coordinates"]
+    raise ValueError(f"Geometria não suportada: {geometria['type']}")
+
+def _area_momentos(anel):
+    # Área com sinal e momentos (fórmula do laço) de um anel fechado
+    x, y = anel[:, 0], anel[:, 1]
+    produto = x[:-1] * y[1:] - x[1:] * y[:-1]
+    area = produto.sum() / 2
+    return area, ((x[:-1] + x[1:]) * produto).sum() / 6, ((y[:-1] + y[1:]) * produto).sum() / 6
+
+def construir(caminho_geojson=ARQUIVO_GEOJSON, resolucao=RESOLUCAO_GRADE_GEO):
+    with open(caminho_geojson, encoding="utf-8") as f:
+        geojson = json.load(f)
+
+    ids, nomes, coordenadas, inicio_anel, municipio_anel, anel_externo = [], [], [], [0], [], []
+    centroides, caixas = [], []
+    for posicao, feature in enumerate(geojson["features"]):
+        ids.append(int(feature["properties"]["id"]))
+        nomes.append(feature["properties"]["name"])
+        area_total, momento_x, momento_y = 0.0, 0.0, 0.0
+        primeiro_anel = len(coordenadas)
+        for poligono in _aneis(feature["geometry"]):
+            for ordem, anel in enumerate(poligono):
+                anel = np.asarray(anel, dtype=np.float64)
+                if not np.array_equal(anel[0], anel[-1]):
+                    anel = np.vstack([anel, anel[:1]])
+                coordenadas.append(anel)
+                inicio_anel.append(inicio_anel[-1] + len(anel))
+                municipio_anel.append(posicao)
+                anel_externo.append(ordem == 0)
+                # Externo soma e buraco subtrai, qualquer que seja a orientação gravada no arquivo
+                area, mx, my = _area_momentos(anel)
+                sinal = (1.0 if ordem == 0 else -1.0) * (1.0 if area >= 0 else -1.0)
+                area_total += sinal * area
+                momento_x += sinal * mx
+                momento_y += sinal * my
+        pontos = np.vstack(coordenadas[primeiro_anel:])
+        caixas.append([pontos[:, 0].min(), pontos[:, 1].min(), pontos[:, 0].max(), pontos[:, 1].max()])
+        centroides.append([momento_x / area_total, momento_y / area_total] if area_total else
+                          [pontos[:, 0].mean(), pontos[:, 1].mean()])
+
+    caixas = np.asarray(caixas, dtype=np.float64)
+    limites = np.array([caixas[:, 0].min(), caixas[:, 1].min(), caixas[:, 2].max(), caixas[:, 3].max()])
+    celula_municipio = _grade(caixas, limites, resolucao)
+    ordem = np.lexsort((celula_municipio[:, 1], celula_municipio[:, 0]))
+    celula_municipio = celula_municipio[ordem]
+    inicio_celula = np.searchsorted(celula_municipio[:, 0], np.arange(resolucao * resolucao + 1))
+
+    return {
+        "hash_geojson": np.array(hash_arquivo(caminho_geojson)),
+        "ids": np.asarray(ids, dtype=np.int64),
+        "nomes": np.asarray(nomes, dtype=str),
+        "coordenadas": np.vstack(coordenadas),
+        "inicio_anel": np.asarray(inicio_anel, dtype=np.int64),
+        "municipio_anel": np.asarray(municipio_anel, dtype=np.int32),
+        "anel_externo": np.asarray(anel_externo, dtype=bool),
+        "centroides": np.asarray(centroides, dtype=np.float64),
+        "caixas": caixas,
+        "limites": limites,
+        "resolucao": np.array(resolucao, dtype=np.int64),
+        "inicio_celula": inicio_celula.astype(np.int64),
+        "municipios_celula": celula_municipio[:, 1].astype(np.int32),
+    }
+
+def _indices_celula(x, y, limites, resolucao):
+    largura = (limites[2] - limites[0]) / resolucao
+    altura = (limites[3] - limites[1]) / resolucao
+    coluna = np.clip(np.floor((x - limites[0]) / largura).astype(np.int64), 0, resolucao - 1)
+    linha = np.clip(np.floor((y - limites[1]) / altura).astype(np.int64), 0, resolucao - 1)
+    return linha * resolucao + coluna, linha, coluna
+
+def _grade(caixas, limites, resolucao):
+    # Pares (célula, município) para cada célula que o retângulo do município toca
+    pares = []
+    _, linha_min, coluna_min = _indices_celula(caixas[:, 0], caixas[:, 1], limites, resolucao)
+    _, linha_max, coluna_max = _indices_celula(caixas[:, 2], caixas[:, 3], limites, resolucao)
+    for municipio in range(len(caixas)):
+        linhas = np.arange(linha_min[municipio], linha_max[municipio] + 1)
+        colunas = np.arange(coluna_min[municipio], coluna_max[municipio] + 1)
+        celulas = (linhas[:, None] * resolucao + colunas[None, :]).ravel()
+        pares.append(np.column_stack([celulas, np.full(len(celulas), municipio)]))
+    return np.vstack(pares)
+
+class CamadaGeo:
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.ids = arrays["ids"]
+        self.nomes = arrays["nomes"]
+        self.centroides = arrays["centroides"]
+        self.caixas = arrays["caixas"]
+        self.limites = arrays["limites"]
+        self.resolucao = int(arrays["resolucao"])
+        self.inicio_celula = arrays["inicio_celula"]
+        self.municipios_celula = arrays["municipios_celula"]
+
+        # Arestas de cada município: vértice i -> i+1 dentro do mesmo anel
+        coordenadas = arrays["coordenadas"]
+        inicio_anel = arrays["inicio_anel"]
+        ultimo = np.zeros(len(coordenadas), dtype=bool)
+        ultimo[inicio_anel[1:] - 1] = True
+        municipio_vertice = np.repeat(arrays["municipio_anel"], np.diff(inicio_anel))
+        validas = np.flatnonzero(~ultimo)
+        self._origem = coordenadas[validas]
+        self._destino = coordenadas[validas + 1]
+        municipio_aresta = municipio_vertice[validas]
+        self._inicio_arestas = np.searchsorted(municipio_aresta, np.arange(len(self.ids) + 1))
+
+        self._posicao_nome = {}
+        self._posicao_compacto = {}
+        for posicao, nome in enumerate(self.nomes):
+            self._posicao_nome.setdefault(normalizar_nome(nome), posicao)
+            self._posicao_compacto.setdefault(_compacto(nome), posicao)
+
+    def posicao(self, municipio):
+        # Posição do município pelo nome (qualquer grafia) ou -1
+        if municipio is None or (isinstance(municipio, float) and np.isnan(municipio)):
+            return -1
+        posicao = self._posicao_nome.get(normalizar_nome(municipio))
+        if posicao is None:
+            posicao = self._posicao_compacto.get(_compacto(municipio), -1)
+        return posicao
+
+    def posicoes(self, municipios):
+        # Vetorizado pelos valores distintos: cada nome é normalizado uma vez
+        codigos, valores = pd.factorize(pd.Series(municipios), sort=False)
+        tabela = np.array([self.posicao(valor) for valor in valores] + [-1], dtype=np.int64)
+        return tabela[codigos]
+
+    def ids_ibge(self, municipios):
+        posicoes = self.posicoes(municipios)
+        ids = pd.array(np.where(posicoes >= 0, self.ids[posicoes], 0), dtype="Int64")
+        ids[posicoes < 0] = pd.NA
+        return pd.Series(ids, index=getattr(municipios, "index", None), name="ID_IBGE")
+
+    def tabela(self):
+        # Um registro por polígono: código, nome, nome normalizado, centroide e retângulo
+        return pd.DataFrame({
+            "ID_IBGE": self.ids, "NOME": self.nomes, "MUNICIPIO": [normalizar_nome(nome) for nome in self.nomes],
+            "CENTROIDE_LON": self.centroides[:, 0], "CENTROIDE_LAT": self.centroides[:, 1],
+            "LON_MIN": self.caixas[:, 0], "LAT_MIN": self.caixas[:, 1],
+            "LON_MAX": self.caixas[:, 2], "LAT_MAX": self.caixas[:, 3]})
+
+    def _contem(self, municipio, x, y):
+        # Paridade de cruzamentos (raio para a direita) com todos os anéis: buracos se anulam sozinhos
+        inicio, fim = self._inicio_arestas[municipio], self._inicio_arestas[municipio + 1]
+        origem, destino = self._origem[inicio:fim], self._destino[inicio:fim]
+        dentro = np.zeros(len(x), dtype=bool)
+        passo = max(1, LIMITE_MATRIZ // max(1, fim - inicio))
+        for comeco in range(0, len(x), passo):
+            px, py = x[comeco:comeco + passo, None], y[comeco:comeco + passo, None]
+            atravessa = (origem[None, :, 1] > py) != (destino[None, :, 1] > py)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                corte = origem[None, :, 0] + (py - origem[None, :, 1]) * (destino[None, :, 0] - origem[None, :, 0]) \
+                        / (destino[None, :, 1] - origem[None, :, 1])
+            dentro[comeco:comeco + passo] = (np.count_nonzero(atravessa & (px < corte), axis=1) % 2) == 1
+        return dentro
+
+    def localizar(self, longitudes, latitudes):
+        # Posição do município que contém cada ponto (-1 fora do estado), testando só os candidatos da célula
+        x = np.asarray(longitudes, dtype=np.float64)
+        y = np.asarray(latitudes, dtype=np.float64)
+        resultado = np.full(len(x), -1, dtype=np.int64)
+        no_estado = np.flatnonzero((x >= self.limites[0]) & (x <= self.limites[2]) &
+                                   (y >= self.limites[1]) & (y <= self.limites[3]))
+        if not len(no_estado):
+            return resultado
+        celulas, _, _ = _indices_celula(x[no_estado], y[no_estado], self.limites, self.resolucao)
+        quantidade = self.inicio_celula[celulas + 1] - self.inicio_celula[celulas]
+        # Pares (ponto, município candidato) expandidos da grade
+        ponto = np.repeat(no_estado, quantidade)
+        deslocamento = np.arange(len(ponto)) - np.repeat(np.cumsum(quantidade) - quantidade, quantidade)
+        candidato = self.municipios_celula[np.repeat(self.inicio_celula[celulas], quantidade) + deslocamento]
+        caixa = self.caixas[candidato]
+        na_caixa = (x[ponto] >= caixa[:, 0]) & (x[ponto] <= caixa[:, 2]) & (y[ponto] >= caixa[:, 1]) & (y[ponto] <= caixa[:, 3])
+        ponto, candidato = ponto[na_caixa], candidato[na_caixa]
+        if not len(ponto):
+            return resultado
+
+        ordem = np.argsort(candidato, kind="stable")
+        ponto, candidato = ponto[ordem], candidato[ordem]
+        limites_grupo = np.flatnonzero(np.diff(candidato)) + 1
+        for pontos_grupo, municipio in zip(np.split(ponto, limites_grupo), candidato[np.r_[0, limites_grupo]]):
+            livres = pontos_grupo[resultado[pontos_grupo] < 0]
+            if len(livres):
+                resultado[livres[self._contem(municipio, x[livres], y[livres])]] = municipio
+        return resultado
+
+    def localizar_ids(self, longitudes, latitudes):
+        posicoes = self.localizar(longitudes, latitudes)
+        ids = pd.array(np.where(posicoes >= 0, self.ids[posicoes], 0), dtype="Int64")
+        ids[posicoes < 0] = pd.NA
+        return ids
+
+    def sem_correspondencia(self, municipios):
+        # Valores de MUNICIPIO sem polígono, com a quantidade de linhas e o nome mais parecido do GeoJSON
+        contagem = pd.Series(municipios).dropna().astype(str).value_counts()
+        nomes_normalizados = list(self._posicao_nome)
+        relatorio = {}
+        for valor, linhas in contagem.items():
+            if self.posicao(valor) >= 0:
+                continue
+            parecidos = difflib.get_close_matches(normalizar_nome(valor), nomes_normalizados, n=1, cutoff=0.8)
+            relatorio[valor] = {"linhas": int(linhas), "sugestao": parecidos[0] if parecidos else None}
+        return relatorio
+
+_camada = None
+_trava = threading.Lock()
+
+def salvar(arrays, diretorio=None):
+    caminho = caminho_cache(diretorio)
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+    temporario = caminho.with_name(caminho.stem + "_tmp.npz")
+    np.savez(temporario, **arrays)
+    os.replace(temporario, caminho)
+    return caminho
+
+def carregar(diretorio=None, caminho_geojson=ARQUIVO_GEOJSON):
+    # Cache binário válido enquanto o hash do GeoJSON for o mesmo; senão a camada é refeita e regravada
+    global _camada
+    with _trava:
+        hash_atual = hash_arquivo(caminho_geojson)
+        if _camada is not None and str(_camada.arrays["hash_geojson"]) == hash_atual:
+            return _camada
+        caminho = caminho_cache(diretorio)
+        arrays = None
+        if caminho.exists():
+            with np.load(caminho, allow_pickle=False) as arquivo:
+                if str(arquivo["hash_geojson"]) == hash_atual:
+                    arrays = {nome: arquivo[nome] for nome in arquivo.files}
+        if arrays is None:
+            arrays = construir(caminho_geojson)
+            salvar(arrays, diretorio)
+            print(f"Camada geográfica montada: {len(arrays['ids'])} municípios ({ARQUIVO_CACHE_GEO})")
+        _camada = CamadaGeo(arrays)
+        return _camada
+
+def relatar_sem_correspondencia(municipios, diretorio=None):
+    # Grava relatorios_execucao/municipios_sem_poligono.json (vazio quando todos casaram)
+    relatorio = carregar(diretorio).sem_correspondencia(municipios)
+    if relatorio:
+        print(f"{len(relatorio)} valores de MUNICIPIO sem polígono no GeoJSON: {list(relatorio)[:10]}")
+    diretorio = (armazenamento.DIRETORIO_SAIDA if diretorio is None else diretorio) / armazenamento.DIRETORIO_RELATORIOS
+    diretorio.mkdir(parents=True, exist_ok=True)
+    with open(diretorio / ARQUIVO_SEM_POLIGONO, "w", encoding="utf-8") as f:
+        json.dump(relatorio, f, ensure_ascii=False, indent=2)
+    return relatorio
@@ -1,22 +1,100 @@
 import os
+import shutil
+import argparse
 import subprocess
 import sys
 import logging
 from pathlib import Path
 from dotenv import load_dotenv
+import armazenamento
+import cache_ingestao
+import etl_incremental
+import etl_blocos
+import particoes_oper
+import matriz_atributos
+import motor_sql
+import geometrias_mapa
+from pipeline_dag import Etapa, ExecutorPipeline
+from controle_incremental import ControleIncremental
+from metricas_execucao import ColetorMetricas
+
+# Código de saída quando uma etapa estoura o timeout no modo processo (o mesmo do comando timeout)
+CODIGO_TIMEOUT = 124
+
+# Etapas do pipeline, na ordem de execução, com entradas e saídas declaradas.
+# Scripts desativados: in2_ETL_view_turnos_pessoas.py, in3_ETL_view_turnos.py, in4_ETL_view_pessoas.py,
+# in5_ETL_view_turnos_deslocamentos.py e in8_DF_turnos.py
+ETAPAS = [
+    # O in1 sempre consulta o OneDrive; o cache da ingestão evita reescrever planilhas inalteradas
+    Etapa("in1", "in1_conexao_banco_planilhas.py", "main",
+          saidas=["oper_comercial", "oper_emergencial", "IDs"],
+          codigo=["armazenamento.py", "cache_ingestao.py", "leitor_excel.py", "normalizacao_datas.py"], sempre_executar=True),
+    Etapa("in2", "in2_ETL_oper_comercial.py", "realizar_juncao",
+          entradas=["oper_comercial", "IDs"], saidas=["oper_comercial_tratado"],
+          codigo=["armazenamento.py", "dimensoes.py", "agregacoes.py", "etl_incremental.py", "normalizacao_datas.py", "etl_blocos.py",
+                  "motor_sql.py"],
+          parametros=["CONTADORES_EXTRAS", "ETL_INCREMENTAL", "ETL_EM_BLOCOS", "MOTOR_ETL"]),
+    Etapa("in3", "in3_ETL_oper_emergencial.py", "realizar_juncao",
+          entradas=["oper_emergencial", "IDs"], saidas=["oper_emergencial_tratado"],
+          codigo=["armazenamento.py", "dimensoes.py", "agregacoes.py", "etl_incremental.py", "normalizacao_datas.py", "etl_blocos.py",
+                  "motor_sql.py"],
+          parametros=["CONTADORES_EXTRAS", "ETL_INCREMENTAL", "ETL_EM_BLOCOS", "MOTOR_ETL"]),
+    Etapa("in4", "in4_DF_oper.py", "unificar",
+          entradas=["oper_comercial_tratado", "oper_emergencial_tratado", "IDs"], saidas=["dataframe_OPER"],
+          codigo=["armazenamento.py", "dimensoes.py", "agregacoes.py", "normalizacao_datas.py", "etl_blocos.py", "particoes_oper.py",
+                  "motor_sql.py"],
+          parametros=["CONTADORES_EXTRAS", "ETL_EM_BLOCOS", "PARTICIONAR_OPER", "MOTOR_ETL"]),
+    Etapa("ML1", "ML1_TreinoTeste.py", "executar",
+          entradas=["dataframe_OPER"], parametros=["TRIMESTRE_ATUAL", "PARTICIONAR_OPER", "TRIMESTRES_TREINO", "INICIO_JANELA_TREINO",
+                                                         "BUSCA_DESLOCAMENTO", "ORCAMENTO_BUSCA_SEGUNDOS", "ORCAMENTO_BUSCA_AJUSTES",
+                                                         "REGRESSOR_ML", "CODIFICACAO_TEMPO_IDEAL"],
+          codigo=["armazenamento.py", "dimensoes.py", "normalizacao_datas.py", "particoes_oper.py", "cubo_kpi.py", "publicacao.py",
+                  "camada_geo.py", "geometrias_mapa.py", "matriz_atributos.py",
+                  "agendador_treino.py", "busca_hiperparametros.py", "regressores.py",
+                  "codificacao_categorica.py"],
+          artefatos=["ML_dataframe_OPER.csv", "cubo_kpi.parquet", "cubo_kpi.json", "publicacao.json", "modelo_tempo_servico.pkl", "modelo_efetividade_xgb.pkl",
+                     "modelo_tempo_resposta.pkl", "modelo_tempo_ideal_xgb.pkl", "modelo_tempo_deslocamento.pkl",
+                     "modelo_tempo_ideal_xgb_vocabulario.json", "busca_deslocamento.json"])
+]
+
+def entradas_sob_demanda():
+    # Entradas que as próprias etapas leem do disco: em blocos (ETL_EM_BLOCOS), por partição (PARTICIONAR_OPER)
+    # ou pelo DuckDB (MOTOR_ETL=duckdb, que unifica direto dos Parquet do in2/in3)
+    entradas = set()
+    if etl_blocos.ETL_EM_BLOCOS:
+        entradas |= {"oper_comercial", "oper_emergencial", "oper_comercial_tratado", "oper_emergencial_tratado"}
+    if motor_sql.unificacao_em_sql():
+        entradas |= {"oper_comercial_tratado", "oper_emergencial_tratado"}
+    if particoes_oper.PARTICIONAR_OPER:
+        entradas.add("dataframe_OPER")
+    return entradas
 
 def excluir_csv_antigos(diretorio_saida):
     arquivos_csv_pkl = [ 
         "oper_comercial.csv", 
         "oper_emergencial.csv", 
         "IDs.csv",
+        "oper_comercial_tratado.csv",
+        "oper_emergencial_tratado.csv",
         "dataframe_OPER.csv",
+        "oper_comercial.parquet",
+        "oper_emergencial.parquet",
+        "IDs.parquet",
+        "oper_comercial_tratado.parquet",
+        "oper_emergencial_tratado.parquet",
+        "dataframe_OPER.parquet",
         "ML_dataframe_OPER.csv",
+        "cubo_kpi.parquet",
+        "cubo_kpi.json",
         "modelo_efetividade_xgb.pkl",
         "modelo_tempo_deslocamento.pkl",
         "modelo_tempo_ideal_xgb.pkl",
+        "modelo_tempo_ideal_xgb_vocabulario.json",
         "modelo_tempo_resposta.pkl",
-        "modelo_tempo_servico.pkl"
+        "modelo_tempo_servico.pkl",
+        "busca_deslocamento.json",
+        "publicacao.json",
+        "camada_geo.npz"
     ]
     
     for arquivo in arquivos_csv_pkl:
@@ -27,66 +105,140 @@ def excluir_csv_antigos(diretorio_saida):
         else:
             logging.info(f"Arquivo não encontrado para exclusão: {caminho_arquivo}")
 
-def main():
+    # Estado do ETL incremental (com --force o in2/in3 reprocessam todo o histórico), partições do dataframe_OPER,
+    # matriz de atributos do ML1, geometrias e camadas do mapa, relatórios das execuções anteriores e cache da
+    # ingestão (o in1 baixa e relê todas as planilhas). O historico_execucoes.jsonl fica: dele saem os timeouts
+    for diretorio in (etl_incremental.DIRETORIO_ESTADO, particoes_oper.DIRETORIO_PARTICOES, matriz_atributos.DIRETORIO_MATRIZ,
+                      geometrias_mapa.DIRETORIO_MAPAS, armazenamento.DIRETORIO_RELATORIOS, cache_ingestao.DIRETORIO_CACHE):
+        caminho_diretorio = os.path.join(diretorio_saida, diretorio)
+        if os.path.isdir(caminho_diretorio):
+            shutil.rmtree(caminho_diretorio)
+            logging.info(f"Diretório excluído: {caminho_diretorio}")
+
+def registrar_fontes_alteradas(diretorio_saida):
+    fontes = cache_ingestao.carregar_fontes_alteradas(diretorio_saida)
+    if fontes:
+        logging.info(f"Fontes alteradas: {fontes['alteradas']} | Inalteradas: {fontes['inalteradas']}")
+
+def executar_subprocessos(DIRETORIO_SAIDA, controle=None, metricas=None):
+    for etapa in ETAPAS:
+        script = etapa.script
+        script_path = os.path.join(DIRETORIO_SAIDA, script)
+
+        if controle is not None and not controle.deve_executar(etapa):
+            logging.info(f"{script} inalterado, execução pulada")
+            if metricas is not None:
+                metricas.registrar_pulada(etapa)
+            continue
+
+        logging.info(f"Iniciando execução de {script}")
+        
+        if not os.path.exists(script_path):
+            logging.error(f"Script não encontrado: {script_path}")
+            return 1
+
+        # Timeout por etapa: configurado ou derivado do histórico de execuções
+        timeout = metricas.timeout(etapa) if metricas is not None else 60
+        marcador = metricas.iniciar(etapa) if metricas is not None else None
+        try:
+            result = subprocess.run(
+                [sys.executable, script_path],
+                cwd=DIRETORIO_SAIDA,
+                env=os.environ,
+                check=True,
+                text=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                timeout=timeout
+            )
+            
+            logging.info(f"{script} concluído. Saída: {result.stdout[:200]}...")
+
+            if metricas is not None:
+                registro = metricas.finalizar(etapa, marcador, "sucesso")
+                logging.info(f"{script}: {registro['tempo_parede_s']}s, CPU {registro['tempo_cpu_s']}s, "
+                             f"{registro['linhas_saida']} linhas gravadas")
+            if controle is not None:
+                controle.registrar(etapa)
+            if script == "in1_conexao_banco_planilhas.py":
+                registrar_fontes_alteradas(DIRETORIO_SAIDA)
+
+        except subprocess.TimeoutExpired:
+            logging.error(f"Timeout ao executar {script} ({timeout}s)")
+            if metricas is not None:
+                metricas.finalizar(etapa, marcador, "timeout")
+            return 1
+        except subprocess.CalledProcessError as e:
+            logging.error(f"Erro em {script}:\n{e.stderr}")
+            if metricas is not None:
+                metricas.finalizar(etapa, marcador, "erro", e.stderr)
+            return 1
+    return 0
+
+def executar_em_processo(DIRETORIO_SAIDA, max_paralelo, controle=None, metricas=None):
+    # Os scripts ficam no diretório de saída e são importados como módulos
+    if str(DIRETORIO_SAIDA) not in sys.path:
+        sys.path.insert(0, str(DIRETORIO_SAIDA))
+    try:
+        ExecutorPipeline(ETAPAS, max_paralelo=max_paralelo, controle=controle, metricas=metricas,
+                         sob_demanda=entradas_sob_demanda()).executar()
+    except TimeoutError as e:
+        logging.error(f"{e}: o processo será encerrado, pois a thread da etapa não pode ser interrompida")
+        return CODIGO_TIMEOUT
+    except Exception as e:
+        logging.error(f"Erro na execução do pipeline: {e}", exc_info=True)
+        return 1
+    registrar_fontes_alteradas(DIRETORIO_SAIDA)
+    return 0
+
+def ler_argumentos(argv=None):
+    parser = argparse.ArgumentParser(description="Executa o pipeline do dashboard preditivo")
+    parser.add_argument("--modo", choices=["processo", "subprocesso"], default=os.getenv("MODO_PIPELINE", "processo"),
+                        help="processo: etapas como funções no mesmo processo; subprocesso: um interpretador por script")
+    parser.add_argument("--paralelo", type=int, default=int(os.getenv("MAX_ETAPAS_PARALELAS", "2")),
+                        help="Número máximo de etapas independentes executadas ao mesmo tempo (modo processo)")
+    parser.add_argument("--force", action="store_true",
+                        help="Exclui os arquivos gerados e refaz todas as etapas, ignorando o manifesto")
+    return parser.parse_args(argv)
+
+def main(argv=None):
     try:
         # 1. Configuração de ambiente
         load_dotenv("credenciais_arquivos.env")
+        argumentos = ler_argumentos(argv)
         DIRETORIO_SAIDA = Path(os.getenv("DIRETORIO_SAIDA"))
         os.chdir(DIRETORIO_SAIDA)
         
         logging.info(f"Diretório base: {DIRETORIO_SAIDA}")
 
-        # Verifica se o diretório existe e possui arquivos para excluir antes de tentar excluir
-        if os.path.exists(DIRETORIO_SAIDA):
-            # Exclui arquivos CSV antigos
-            excluir_csv_antigos(DIRETORIO_SAIDA)
-        else:
+        # Verifica se o diretório existe antes de executar
+        if not os.path.exists(DIRETORIO_SAIDA):
             logging.warning(f"O diretório especificado não existe: {DIRETORIO_SAIDA}")
             return 1
 
-        # 2. Lista de scripts
-        SCRIPTS = [
-            "in1_conexao_banco_planilhas.py",
-            # "in2_ETL_view_turnos_pessoas.py",
-            # "in3_ETL_view_turnos.py",
-            # "in4_ETL_view_pessoas.py",
-            # "in5_ETL_view_turnos_deslocamentos.py",
-            "in2_ETL_oper_comercial.py",
-            "in3_ETL_oper_emergencial.py",
-            # "in8_DF_turnos.py",
-            "in4_DF_oper.py",
-            "ML1_TreinoTeste.py"
-        ]
-
-        # 3. Execução dos scripts
-        for script in SCRIPTS:
-            script_path = os.path.join(DIRETORIO_SAIDA, script)
-            logging.info(f"Iniciando execução de {script}")
-            
-            if not os.path.exists(script_path):
-                logging.error(f"Script não encontrado: {script_path}")
-                return 1
-
-            try:
-                result = subprocess.run(
-                    [sys.executable, script_path],
-                    cwd=DIRETORIO_SAIDA,
-                    env=os.environ,
-                    check=True,
-                    text=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    timeout=60  # Timeout de 5 minutos por script
-                )
-                
-                logging.info(f"{script} concluído. Saída: {result.stdout[:200]}...")
-
-            except subprocess.TimeoutExpired:
-                logging.error(f"Timeout ao executar {script}")
-                return 1
-            except subprocess.CalledProcessError as e:
-                logging.error(f"Erro em {script}:\n{e.stderr}")
-                return 1
+        # Só com --force os arquivos antigos são excluídos; sem ele, apenas as etapas
+        # cuja impressão digital (código, parâmetros e entradas) mudou são executadas
+        if argumentos.force:
+            excluir_csv_antigos(DIRETORIO_SAIDA)
+        controle = ControleIncremental(DIRETORIO_SAIDA, forcar=argumentos.force)
+        metricas = ColetorMetricas(DIRETORIO_SAIDA, modo=argumentos.modo)
+
+        # 2. Execução das etapas
+        if argumentos.modo == "subprocesso":
+            codigo = executar_subprocessos(DIRETORIO_SAIDA, controle, metricas)
+        else:
+            codigo = executar_em_processo(DIRETORIO_SAIDA, argumentos.paralelo, controle, metricas)
+
+        # 3. Relatório da execução (JSON) e histórico para acompanhar regressões
+        relatorio = metricas.salvar(codigo)
+        logging.info(f"Relatório da execução: {relatorio}")
+        if codigo == CODIGO_TIMEOUT and argumentos.modo == "processo":
+            # A etapa atrasada segue rodando numa thread e o interpretador esperaria por ela ao sair:
+            # encerra o processo (os pools dos filhos terminam junto com o pai)
+            logging.shutdown()
+            os._exit(codigo)
+        if codigo != 0:
+            return codigo
 
         logging.info("Todos os scripts carregados com sucesso!")
         return 0
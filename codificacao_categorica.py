@@ -0,0 +1,71 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from dotenv import load_dotenv
+
+load_dotenv('credenciais_arquivos.env')
+
+# Codificação das colunas de texto (TIPO OS, MUNICIPIO, PREFIXO) do modelo de tempo ideal, escolhida por
+# CODIFICACAO_TEMPO_IDEAL:
+# "dummies" (padrão): pd.get_dummies denso, como antes
+# "nativa": colunas category direto no XGBoost (enable_categorical, tree_method hist), uma coluna por atributo
+# "esparsa": one-hot em CSR (drop_first, como o get_dummies), só os uns são guardados
+# nativa e esparsa mudam as previsões (hist, outras divisões, categorias novas como nulo) e ficam opcionais
+# até o benchmark justificar a troca
+# O vocabulário de cada coluna (categorias na ordem dos códigos) fica salvo ao lado do modelo: linhas novas
+# são mapeadas direto nele, e categorias fora do vocabulário viram nulo (nativa) ou zeros (esparsa)
+CODIFICACAO_TEMPO_IDEAL = os.getenv("CODIFICACAO_TEMPO_IDEAL", "dummies")
+CODIFICACOES = ("nativa", "esparsa", "dummies")
+
+def vocabulario(X, colunas):
+    return {coluna: [str(categoria) for categoria in X[coluna].cat.categories] for coluna in colunas}
+
+def codigos(valores, categorias):
+    # Posição de cada valor no vocabulário (-1 = nulo ou fora do vocabulário)
+    # get_indexer em vez de pd.Categorical(categories=...), que avisa (e vai falhar) com valores fora das categorias
+    return pd.Index(categorias).get_indexer(np.asarray(valores, dtype=object)).astype(np.int32)
+
+def codificar(X, vocabulario, modo=CODIFICACAO_TEMPO_IDEAL, colunas=None):
+    # colunas: ordem das colunas do treino (modo dummies, reindex como antes)
+    if modo not in CODIFICACOES:
+        raise ValueError(f"CODIFICACAO_TEMPO_IDEAL inválida: {modo} (opções: {', '.join(CODIFICACOES)})")
+    if modo == "dummies":
+        X = pd.get_dummies(X, drop_first=True)
+        return X if colunas is None else X.reindex(columns=colunas, fill_value=0)
+    if modo == "nativa":
+        X = X.copy()
+        for coluna, categorias in vocabulario.items():
+            X[coluna] = pd.Categorical.from_codes(codigos(X[coluna], categorias), categories=categorias)
+        return X
+    return _matriz_esparsa(X, vocabulario)
+
+def _matriz_esparsa(X, vocabulario):
+    # Numéricas primeiro, com os zeros guardados: no CSR o XGBoost trata célula ausente como nulo
+    numericas = [coluna for coluna in X.columns if coluna not in vocabulario]
+    linhas = np.arange(len(X))
+    valores = X[numericas].to_numpy(dtype=np.float32, na_value=np.nan)
+    blocos = [sparse.csr_matrix((valores.ravel(), (np.repeat(linhas, len(numericas)), np.tile(np.arange(len(numericas)), len(X)))),
+                                shape=(len(X), len(numericas)))]
+    for coluna, categorias in vocabulario.items():
+        posicoes = codigos(X[coluna], categorias)
+        # drop_first: a primeira categoria é a referência (linha toda zero), como no get_dummies
+        presentes = posicoes > 0
+        blocos.append(sparse.csr_matrix((np.ones(presentes.sum(), dtype=np.float32), (linhas[presentes], posicoes[presentes] - 1)),
+                                        shape=(len(X), max(len(categorias) - 1, 0))))
+    return sparse.hstack(blocos, format="csr")
+
+def caminho_vocabulario(caminho_modelo):
+    return caminho_modelo.with_name(caminho_modelo.stem + "_vocabulario.json")
+
+def salvar_vocabulario(vocabulario, modo, colunas, caminho_modelo):
+    caminho = caminho_vocabulario(caminho_modelo)
+    with open(caminho.with_suffix(".tmp"), "w", encoding="utf-8") as f:
+        json.dump({"codificacao": modo, "colunas": list(colunas), "categorias": vocabulario}, f, ensure_ascii=False, indent=2)
+    os.replace(caminho.with_suffix(".tmp"), caminho)
+    return caminho
+
+def carregar_vocabulario(caminho_modelo):
+    with open(caminho_vocabulario(caminho_modelo), encoding="utf-8") as f:
+        return json.load(f)
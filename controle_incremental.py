@@ -0,0 +1,110 @@
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
+from datetime import datetime, date
+
+ARQUIVO_MANIFESTO = "manifesto_pipeline.json"
+
+# Parâmetros que mudam o conteúdo de qualquer etapa
+PARAMETROS_GLOBAIS = ["FORMATO_INTERMEDIARIO"]
+
+def _trimestre_atual():
+    hoje = date.today()
+    return f"{hoje.year}Q{(hoje.month - 1) // 3 + 1}"
+
+def inicio_janela_treino():
+    # Primeiro mês ("aaaa-mm") dos últimos TRIMESTRES_TREINO trimestres contados a partir do trimestre atual
+    # (None = todo o histórico)
+    trimestres = int(os.getenv("TRIMESTRES_TREINO", "0"))
+    if trimestres <= 0:
+        return None
+    hoje = date.today()
+    trimestre = hoje.year * 4 + (hoje.month - 1) // 3 - (trimestres - 1)
+    return f"{trimestre // 4}-{trimestre % 4 * 3 + 1:02d}"
+
+# Parâmetros calculados na hora, para etapas cujo resultado depende da data da execução
+# (ex.: o ML1 filtra pelo trimestre atual e treina a partir do início da janela)
+PARAMETROS_DERIVADOS = {
+    "TRIMESTRE_ATUAL": _trimestre_atual,
+    "INICIO_JANELA_TREINO": inicio_janela_treino
+}
+
+def valor_parametro(nome):
+    if nome in PARAMETROS_DERIVADOS:
+        return PARAMETROS_DERIVADOS[nome]()
+    return os.getenv(nome)
+
+def hash_arquivo(caminho, tamanho_bloco=1 << 20):
+    sha = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(tamanho_bloco), b""):
+            sha.update(bloco)
+    return sha.hexdigest()
+
+class ControleIncremental:
+    # Guarda a impressão digital (código + parâmetros + entradas) de cada etapa em um manifesto
+    # e indica quais etapas podem ser puladas por terem a mesma impressão da última execução.
+
+    def __init__(self, diretorio, forcar=False):
+        self.diretorio = Path(diretorio)
+        self.caminho = self.diretorio / ARQUIVO_MANIFESTO
+        self.forcar = forcar
+        self._trava = threading.Lock()
+        self.manifesto = {"etapas": {}, "hashes": {}}
+        if self.caminho.exists() and not forcar:
+            with open(self.caminho, encoding="utf-8") as f:
+                self.manifesto = json.load(f)
+
+    def _hash_em_cache(self, caminho):
+        # Reaproveita o hash enquanto tamanho e data de modificação do arquivo não mudarem
+        caminho = Path(caminho)
+        if not caminho.exists():
+            return None
+        estatistica = caminho.stat()
+        assinatura = [estatistica.st_size, estatistica.st_mtime_ns]
+        chave = str(caminho)
+        with self._trava:
+            registro = self.manifesto["hashes"].get(chave)
+        if registro and registro[:2] == assinatura:
+            return registro[2]
+        valor = hash_arquivo(caminho)
+        with self._trava:
+            self.manifesto["hashes"][chave] = assinatura + [valor]
+        return valor
+
+    def impressao(self, etapa):
+        codigo = {arquivo: self._hash_em_cache(self.diretorio / arquivo) for arquivo in [etapa.script] + etapa.codigo}
+        parametros = {nome: valor_parametro(nome) for nome in PARAMETROS_GLOBAIS + etapa.parametros}
+        entradas = {nome: self._hash_em_cache(caminho)
+                    for nome, caminho in zip(etapa.entradas, etapa.arquivos_entrada(self.diretorio))}
+        conteudo = json.dumps({"codigo": codigo, "parametros": parametros, "entradas": entradas}, sort_keys=True)
+        return hashlib.sha256(conteudo.encode("utf-8")).hexdigest()
+
+    def deve_executar(self, etapa):
+        if self.forcar or etapa.sempre_executar:
+            return True
+        with self._trava:
+            registro = self.manifesto["etapas"].get(etapa.nome)
+        if not registro or registro.get("impressao") != self.impressao(etapa):
+            return True
+        # Mesma impressão, mas alguma saída sumiu ou foi alterada fora do pipeline
+        return any(self._hash_em_cache(caminho) != registro["saidas"].get(str(caminho))
+                   for caminho in etapa.arquivos_saida(self.diretorio))
+
+    def registrar(self, etapa):
+        registro = {
+            "impressao": self.impressao(etapa),
+            "saidas": {str(caminho): self._hash_em_cache(caminho) for caminho in etapa.arquivos_saida(self.diretorio)},
+            "executada_em": datetime.now().isoformat(timespec="seconds")
+        }
+        with self._trava:
+            self.manifesto["etapas"][etapa.nome] = registro
+            self.salvar()
+
+    def salvar(self):
+        temporario = self.caminho.with_suffix(".tmp")
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump(self.manifesto, f, ensure_ascii=False, indent=2)
+        os.replace(temporario, self.caminho)
@@ -0,0 +1,140 @@
+import os
+import json
+import hashlib
+import itertools
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from dotenv import load_dotenv
+import armazenamento
+from agregacoes import NAO_EFETIVA
+
+load_dotenv('credenciais_arquivos.env')
+
+# Cubo de KPIs do dashboard: uma linha por combinação MUNICIPIO x PREFIXO x STATUS x MES x DIA e por cada
+# agregação (roll-up) em que uma ou mais dimensões valem TODOS. Gravado ordenado pelas chaves em Parquet,
+# então qualquer combinação de filtros do dashboard é a busca de uma chave, sem reler as linhas do ML.
+NOME_CUBO = "cubo_kpi"
+TODOS = "(todos)"
+DIMENSOES_CUBO = ["MUNICIPIO", "PREFIXO", "STATUS"]
+# DIA só existe dentro de um MES: os níveis de tempo são total, mês e dia
+NIVEIS_TEMPO = [[], ["MES"], ["MES", "DIA"]]
+CHAVES = DIMENSOES_CUBO + ["MES", "DIA"]
+COLUNA_DATA = "DATA SOLICITACAO"
+
+METRICAS_TEMPO = ["TEMPO_RESPOSTA", "TEMPO_DESLOCAMENTO", "DURACAO_SERVICO"]
+METRICAS_PREVISAO = ["DURACAO_SERVICO_PRED", "TEMPO_RESPOSTA_PRED", "TEMPO_IDEAL_PRED", "TEMPO_DESLOCAMENTO_PRED",
+                     "PREVISAO_DURACAO_PREFIXO", "PREVISAO_DURACAO_CIDADE"]
+
+def caminho_cubo(diretorio=None):
+    return armazenamento.caminho_intermediario(NOME_CUBO, diretorio, "parquet")
+
+def caminho_meta(diretorio=None):
+    return caminho_cubo(diretorio).with_suffix(".json")
+
+def _base(df):
+    # Só as colunas do cubo, com as dimensões como Categorical e as métricas em float32
+    base = pd.DataFrame({dimensao: df[dimensao].astype(str).astype("category") for dimensao in DIMENSOES_CUBO})
+    datas = pd.to_datetime(df[COLUNA_DATA], errors='coerce')
+    base["MES"] = datas.dt.strftime("%Y-%m").fillna("(sem data)").astype("category")
+    base["DIA"] = datas.dt.strftime("%Y-%m-%d").fillna("(sem data)").astype("category")
+    base["EFETIVA"] = (df["EFETIVIDADE"].astype(str) != NAO_EFETIVA).to_numpy(dtype=np.int32)
+    for metrica in METRICAS_TEMPO + METRICAS_PREVISAO:
+        if metrica in df.columns:
+            base[metrica] = pd.to_numeric(df[metrica], errors='coerce').astype("float32")
+    return base
+
+def _agregar(base, chaves):
+    agregacoes = {"QTD_OS": ("EFETIVA", "size"), "QTD_EFETIVA": ("EFETIVA", "sum")}
+    for metrica in METRICAS_TEMPO:
+        if metrica in base.columns:
+            agregacoes[f"MEDIA_{metrica}"] = (metrica, "mean")
+            agregacoes[f"MEDIANA_{metrica}"] = (metrica, "median")
+    for metrica in METRICAS_PREVISAO:
+        if metrica in base.columns:
+            agregacoes[f"MEDIA_{metrica}"] = (metrica, "mean")
+    grupos = base.groupby(chaves, observed=True, sort=False) if chaves else base.groupby(np.zeros(len(base), dtype=np.int8))
+    parcial = grupos.agg(**agregacoes).reset_index(drop=not chaves)
+    for chave in CHAVES:
+        if chave not in chaves:
+            parcial[chave] = TODOS
+    return parcial
+
+def construir(df, diretorio=None):
+    # Um groupby por conjunto de agrupamento (8 combinações das dimensões x 3 níveis de tempo); as medianas
+    # não se somam, então cada roll-up sai direto das linhas e não de outro nível do cubo
+    base = _base(df)
+    partes = []
+    for quantidade in range(len(DIMENSOES_CUBO) + 1):
+        for dimensoes in itertools.combinations(DIMENSOES_CUBO, quantidade):
+            for tempo in NIVEIS_TEMPO:
+                partes.append(_agregar(base, list(dimensoes) + tempo))
+    cubo = pd.concat(partes, ignore_index=True)
+    cubo["TAXA_EFETIVIDADE"] = (cubo["QTD_EFETIVA"] / cubo["QTD_OS"]).astype("float32")
+    cubo[["QTD_OS", "QTD_EFETIVA"]] = cubo[["QTD_OS", "QTD_EFETIVA"]].astype("int64")
+    metricas = [coluna for coluna in cubo.columns if coluna not in CHAVES]
+    # Chaves ordenadas como texto e gravadas como dicionário (cada rótulo uma vez no arquivo)
+    cubo = cubo.assign(**{chave: cubo[chave].astype(str) for chave in CHAVES})
+    cubo = cubo[CHAVES + metricas].sort_values(CHAVES, ignore_index=True)
+    cubo = cubo.assign(**{chave: cubo[chave].astype("category") for chave in CHAVES})
+    salvar(cubo, diretorio)
+    return cubo
+
+def salvar(cubo, diretorio=None):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    caminho = caminho_cubo(diretorio)
+    temporario = caminho.with_suffix(".tmp")
+    pq.write_table(pa.Table.from_pandas(cubo, preserve_index=False), temporario, compression="zstd")
+    os.replace(temporario, caminho)
+    versao = hashlib.sha256(caminho.read_bytes()).hexdigest()[:16]
+    meta = {"versao": versao, "linhas": len(cubo), "chaves": CHAVES, "todos": TODOS,
+            "gerado_em": datetime.now().isoformat(timespec="seconds")}
+    with open(caminho_meta(diretorio).with_suffix(".tmp"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(caminho_meta(diretorio).with_suffix(".tmp"), caminho_meta(diretorio))
+    print(f"Cubo de KPIs salvo: {len(cubo)} linhas ({caminho.name})")
+    return caminho
+
+class CuboKPI:
+    # Cubo carregado uma vez com índice ordenado pelas chaves: consultar() é uma busca exata e fatia()
+    # devolve uma dimensão aberta (ex.: todos os meses de uma cidade) com as demais fixas
+
+    def __init__(self, diretorio=None):
+        caminho = caminho_cubo(diretorio)
+        with open(caminho_meta(diretorio), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.versao = self.meta["versao"]
+        tabela = pd.read_parquet(caminho)
+        self.tabela = tabela.set_index(CHAVES).sort_index()
+
+    @staticmethod
+    def _chave(municipio=None, prefixo=None, status=None, mes=None, dia=None):
+        if dia is not None and mes is None:
+            mes = str(dia)[:7]
+        return tuple(TODOS if valor is None else str(valor) for valor in (municipio, prefixo, status, mes, dia))
+
+    def consultar(self, municipio=None, prefixo=None, status=None, mes=None, dia=None):
+        # Filtro ausente (None) = todos os valores daquela dimensão
+        chave = self._chave(municipio, prefixo, status, mes, dia)
+        # Linha como DataFrame de uma linha: o Series misturaria int64 e float32 e viraria tudo float (QTD_OS = 4000.0)
+        try:
+            linhas = self.tabela.loc[[chave]]
+        except KeyError:
+            return None
+        return dict(zip(CHAVES, chave), **linhas.iloc[0:1].reset_index(drop=True).to_dict("records")[0])
+
+    def fatia(self, por, municipio=None, prefixo=None, status=None, mes=None, dia=None):
+        # Linhas com "por" aberto (diferente de TODOS) e as demais chaves como nos filtros
+        if por not in CHAVES:
+            raise ValueError(f"Dimensão desconhecida: {por}")
+        filtros = dict(zip(CHAVES, self._chave(municipio, prefixo, status, mes, dia)))
+        if por == "DIA" and filtros["MES"] == TODOS:
+            raise ValueError("fatia por DIA exige o filtro de mês")
+        fixas = [chave for chave in CHAVES if chave != por]
+        try:
+            resultado = self.tabela.xs(tuple(filtros[chave] for chave in fixas), level=fixas, drop_level=False)
+        except KeyError:
+            return pd.DataFrame(columns=CHAVES + list(self.tabela.columns))
+        resultado = resultado[resultado.index.get_level_values(por) != TODOS]
+        return resultado.reset_index()
@@ -0,0 +1,206 @@
+import json
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+import armazenamento
+
+LIMITE_RELATORIO = 50  # Chaves sem correspondência listadas por coluna
+
+# Dimensões de texto e as colunas (rótulo, ID) correspondentes na planilha de IDs
+DIMENSOES = {
+    "PREFIXO": ("PREFIXO", "ID PREFIXO"),
+    "MUNICIPIO": ("MUNICIPIO", "ID MUNICIPIO"),
+    "EFETIVIDADE": ("EFETIVIDADE", "ID EFETIVIDADE"),
+    "TIPO_SERVICO": ("TIPO SERVICO COMERCIAL", "ID TIPO SERVICO COMERCIAL"),
+    "SUBTIPO_SERVICO": ("SUBTIPO SERVICO COMERCIAL", "ID SUBTIPO SERVICO COMERCIAL"),
+    "CAUSA": ("CAUSA", "ID CAUSA"),
+    "MOTIVO_RECLAMACAO": ("MOTIVO RECLAMACAO EMERGENCIA", "ID MOTIVO RECLAMACAO EMERGENCIA")
+}
+
+# STATUS não está na planilha de IDs: os códigos são fixos desde o in4
+STATUS = {"COMERCIAL": 1001, "EMERGENCIAL": 1002}
+
+# No in4 comercial e emergencial dividem as colunas TIPO OS e SUB OS
+DIMENSOES_UNIFICADAS = {
+    "TIPO OS": ["TIPO_SERVICO", "CAUSA"],
+    "SUB OS": ["SUBTIPO_SERVICO", "MOTIVO_RECLAMACAO"]
+}
+
+# Coluna de cada etapa -> dimensão
+COLUNAS_DIMENSAO = {
+    "PREFIXO": "PREFIXO",
+    "MUNICIPIO": "MUNICIPIO",
+    "EFETIVIDADE": "EFETIVIDADE",
+    "EFETIVIDADE_VISITA": "EFETIVIDADE",
+    "TIPO_SERVICO": "TIPO_SERVICO",
+    "SUBTIPO_SERVICO": "SUBTIPO_SERVICO",
+    "CAUSA": "CAUSA",
+    "MOTIVO_RECLAMACAO": "MOTIVO_RECLAMACAO",
+    "TIPO OS": "TIPO OS",
+    "SUB OS": "SUB OS",
+    "STATUS": "STATUS"
+}
+
+class RegistroDimensoes:
+    # Categorias fixas (rótulos ordenados) de cada dimensão, montadas a partir da planilha de IDs.
+    # As etapas carregam as dimensões como Categorical: groupbys e merges rodam sobre os códigos
+    # inteiros e os rótulos só voltam a ser texto na exportação (CSV).
+
+    def __init__(self, IDs=None):
+        self.categorias = {}
+        self.ids = {}
+        for dimensao, (rotulo, coluna_id) in DIMENSOES.items():
+            if IDs is None or rotulo not in IDs.columns:
+                self.categorias[dimensao] = pd.Index([], dtype=object)
+                self.ids[dimensao] = np.array([], dtype=float)
+                continue
+            tabela = IDs[[rotulo, coluna_id]].dropna(subset=[rotulo])
+            tabela = tabela.assign(**{rotulo: tabela[rotulo].astype(str)}).drop_duplicates(rotulo)
+            categorias = pd.Index(tabela[rotulo]).sort_values()
+            self.categorias[dimensao] = categorias
+            self.ids[dimensao] = pd.to_numeric(tabela.set_index(rotulo)[coluna_id], errors='coerce') \
+                .reindex(categorias).to_numpy(dtype=float)
+
+        for dimensao, partes in DIMENSOES_UNIFICADAS.items():
+            self.categorias[dimensao] = self.categorias[partes[0]].union(self.categorias[partes[1]])
+        self.categorias["STATUS"] = pd.Index(list(STATUS), dtype=object)
+        self.ids["STATUS"] = np.array(list(STATUS.values()), dtype=float)
+
+        # Identifica a versão dos IDs (ex.: o estado do ETL incremental é refeito quando ela muda)
+        conteudo = {dimensao: [[str(c) for c in self.categorias[dimensao]],
+                               [None if np.isnan(i) else float(i) for i in self.ids.get(dimensao, [])]]
+                    for dimensao in sorted(self.categorias)}
+        self.versao = hashlib.sha256(json.dumps(conteudo).encode("utf-8")).hexdigest()[:16]
+
+    def tipo(self, dimensao, serie=None):
+        # Rótulos fora da planilha de IDs são acrescentados ao fim, sem alterar os códigos dos demais
+        categorias = self.categorias[dimensao]
+        if serie is not None:
+            observados = serie.cat.categories if isinstance(serie.dtype, pd.CategoricalDtype) else pd.Index(serie.dropna().unique())
+            extras = observados.astype(str).difference(categorias)
+            if len(extras):
+                categorias = categorias.append(extras.sort_values())
+        return pd.CategoricalDtype(categorias)
+
+    def categorizar_serie(self, serie, dimensao):
+        if not isinstance(serie.dtype, pd.CategoricalDtype):
+            serie = serie.where(serie.isna(), serie.astype(str))
+        tipo = self.tipo(dimensao, serie)
+        if isinstance(serie.dtype, pd.CategoricalDtype) and serie.dtype == tipo:
+            return serie
+        return serie.astype(tipo)
+
+    def categorizar(self, df, colunas=None):
+        for coluna in colunas or [c for c in df.columns if c in COLUNAS_DIMENSAO]:
+            df[coluna] = self.categorizar_serie(df[coluna], COLUNAS_DIMENSAO[coluna])
+        return df
+
+    def canonizar(self, df):
+        # Categorias canônicas: as da planilha de IDs + os rótulos extras realmente presentes, ordenados.
+        # Não depende de como a coluna chegou (texto, Categorical com categorias sem uso, concat de tipos
+        # diferentes), então o pandas e o DuckDB gravam o mesmo dataframe_OPER.
+        for coluna in [c for c in df.columns if c in COLUNAS_DIMENSAO]:
+            serie = df[coluna]
+            if isinstance(serie.dtype, pd.CategoricalDtype):
+                serie = serie.cat.remove_unused_categories()
+            df[coluna] = self.categorizar_serie(serie, COLUNAS_DIMENSAO[coluna])
+        return df
+
+    def ids_de(self, serie, dimensao):
+        # Converte os códigos da coluna categórica no ID da dimensão (NaN fora da planilha)
+        serie = self.categorizar_serie(serie, dimensao)
+        ids = self.ids[dimensao]
+        codigos = serie.cat.codes.to_numpy()
+        validos = (codigos >= 0) & (codigos < len(ids))
+        valores = np.full(len(serie), np.nan)
+        valores[validos] = ids[codigos[validos]]
+        return pd.Series(valores, index=serie.index)
+
+    def atribuir_ids(self, df, juncoes, nome=None, acumulado=None):
+        # Substitui a cadeia de merges com a planilha de IDs: cada ID vem dos códigos da coluna
+        # categórica (mapa rótulo -> ID deduplicado, montado uma vez por versão dos IDs).
+        # Junções "inner" descartam as linhas sem correspondência num único filtro; "left" mantém com ID nulo.
+        # As chaves sem correspondência são contadas e relatadas em vez de sumirem em silêncio.
+        # Com "acumulado" (processamento em blocos) as chaves são somadas nele e o relatório fica para o fim.
+        manter = np.ones(len(df), dtype=bool)
+        relatorio = {}
+        for coluna, dimensao, coluna_id, como in juncoes:
+            ids = self.ids_de(df[coluna], dimensao)
+            sem_id = ids.isna().to_numpy()
+            if sem_id.any():
+                rotulos = df[coluna].astype(object)[sem_id].fillna("(vazio)")
+                contagem = rotulos.value_counts()
+                relatorio[coluna] = {"linhas": int(sem_id.sum()), "juncao": como,
+                                     "chaves": {str(k): int(v) for k, v in contagem.head(LIMITE_RELATORIO).items()}}
+            if como == "inner":
+                # As linhas sem ID serão descartadas: o ID já sai inteiro, como no merge
+                manter &= ~sem_id
+                ids = ids.fillna(0).astype("int64")
+            df[coluna_id] = ids
+
+        if acumulado is None:
+            self.relatar(relatorio, nome)
+        else:
+            acumular_relatorio(acumulado, relatorio)
+        if not manter.all():
+            df = df[manter].reset_index(drop=True)
+        return df
+
+    def relatar(self, relatorio, nome):
+        # Grava relatorios_execucao/chaves_sem_id_<nome>.json (vazio quando tudo casou)
+        for coluna, dados in relatorio.items():
+            acao = "descartadas" if dados["juncao"] == "inner" else "mantidas com ID nulo"
+            print(f"{nome or ''} {coluna}: {dados['linhas']} linhas sem ID ({acao}); chaves: {list(dados['chaves'])[:10]}")
+        if nome:
+            diretorio = armazenamento.DIRETORIO_SAIDA / armazenamento.DIRETORIO_RELATORIOS
+            diretorio.mkdir(parents=True, exist_ok=True)
+            with open(diretorio / f"chaves_sem_id_{nome}.json", "w", encoding="utf-8") as f:
+                json.dump(relatorio, f, ensure_ascii=False, indent=2)
+
+def acumular_relatorio(acumulado, relatorio):
+    # Soma o relatório de um bloco ao acumulado (linhas e contagem por chave)
+    for coluna, dados in relatorio.items():
+        atual = acumulado.setdefault(coluna, {"linhas": 0, "juncao": dados["juncao"], "chaves": {}})
+        atual["linhas"] += dados["linhas"]
+        for chave, quantidade in dados["chaves"].items():
+            atual["chaves"][chave] = atual["chaves"].get(chave, 0) + quantidade
+        atual["chaves"] = dict(sorted(atual["chaves"].items(), key=lambda item: -item[1])[:LIMITE_RELATORIO])
+    return acumulado
+
+def compactar(serie):
+    # Só as categorias presentes, em ordem alfabética: get_dummies e cat.codes ficam iguais aos de uma coluna de texto
+    if not isinstance(serie.dtype, pd.CategoricalDtype):
+        return serie
+    serie = serie.cat.remove_unused_categories()
+    return serie.cat.reorder_categories(serie.cat.categories.sort_values())
+
+def compactar_colunas(df):
+    return df.assign(**{coluna: compactar(df[coluna]) for coluna in df.columns})
+
+_registros = {}
+_trava_registros = threading.Lock()
+
+def _colunas_IDs():
+    return [coluna for par in DIMENSOES.values() for coluna in par]
+
+def carregar_registro(IDs=None):
+    # Um registro por versão dos IDs: em memória pelo hash do conteúdo, em disco pelo arquivo e data de
+    # modificação (in2, in3 e in4 reaproveitam o mesmo registro)
+    if IDs is not None:
+        colunas = [coluna for coluna in _colunas_IDs() if coluna in IDs.columns]
+        chave = ("memoria", int(pd.util.hash_pandas_object(IDs[colunas], index=False).sum()), tuple(colunas))
+    else:
+        caminho = armazenamento.caminho_intermediario("IDs")
+        if not caminho.exists():
+            return RegistroDimensoes()
+        chave = (str(caminho), caminho.stat().st_mtime_ns)
+
+    with _trava_registros:
+        if chave not in _registros:
+            if IDs is None:
+                IDs = armazenamento.carregar_intermediario("IDs", colunas=_colunas_IDs())
+            if len(_registros) >= 4:
+                _registros.pop(next(iter(_registros)))
+            _registros[chave] = RegistroDimensoes(IDs)
+        return _registros[chave]
@@ -0,0 +1,160 @@
+import os
+import pickle
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from dotenv import load_dotenv
+import armazenamento
+import agregacoes
+import etl_incremental
+
+load_dotenv('credenciais_arquivos.env')
+
+# ETL_EM_BLOCOS=1: in2, in3 e in4 leem os intermediários em blocos de TAMANHO_BLOCO_ETL linhas e gravam
+# a saída bloco a bloco. Os pares (balde, OS) dos contadores e os blocos já tratados vão para o disco
+# (etl_blocos_tmp/, apagado ao fim): a memória depende do bloco, de uma partição dos pares e da quantidade
+# de baldes (PREFIXO/MUNICIPIO x período), e não da quantidade de linhas do histórico
+ETL_EM_BLOCOS = os.getenv("ETL_EM_BLOCOS", "0") == "1"
+TAMANHO_BLOCO = int(os.getenv("TAMANHO_BLOCO_ETL", "500000"))
+PARTICOES_CONTADOR = int(os.getenv("PARTICOES_CONTADOR_ETL", "64"))
+DIRETORIO_TEMPORARIO = "etl_blocos_tmp"
+
+class MediaParcial:
+    # Média do intervalo (em segundos) somada bloco a bloco; parciais de blocos diferentes se juntam somando
+    def __init__(self):
+        self.soma = 0.0
+        self.contagem = 0
+
+    def adicionar(self, segundos):
+        validos = segundos[~np.isnan(segundos)]
+        self.soma += float(validos.sum())
+        self.contagem += len(validos)
+        return self
+
+    def juntar(self, outra):
+        self.soma += outra.soma
+        self.contagem += outra.contagem
+        return self
+
+    def valor(self):
+        return pd.to_timedelta(self.soma / self.contagem, unit="s") if self.contagem else pd.NaT
+
+class ContadorDistintos:
+    # Quantidade exata de OS distintas por balde (rótulo, período), acumulada bloco a bloco.
+    # Os pares (rótulo, período, OS) de cada bloco, sem repetições, são anexados a um de PARTICOES_CONTADOR
+    # arquivos escolhido pelo balde: um balde fica sempre no mesmo arquivo, então cada arquivo é contado
+    # sozinho (pares únicos e tamanho de cada grupo) com os valores exatos, sem depender de hash.
+    def __init__(self, diretorio, particoes=PARTICOES_CONTADOR):
+        self.diretorio = Path(diretorio)
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        self.particoes = particoes
+
+    def adicionar(self, rotulos, periodos, os_valores):
+        pares = pd.DataFrame({"rotulo": rotulos, "periodo": periodos, "os": os_valores}).drop_duplicates()
+        particao = pd.util.hash_pandas_object(pares[["rotulo", "periodo"]], index=False).to_numpy() % self.particoes
+        for numero, parte in pares.groupby(particao, sort=False):
+            with open(self.diretorio / f"{numero}.pkl", "ab") as f:
+                pickle.dump(parte, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return self
+
+    @staticmethod
+    def _ler(caminho):
+        partes = []
+        with open(caminho, "rb") as f:
+            while True:
+                try:
+                    partes.append(pickle.load(f))
+                except EOFError:
+                    break
+        return pd.concat(partes, ignore_index=True)
+
+    def contagens(self):
+        # OS distintas indexadas por (rótulo, período); uma partição por vez na memória
+        resultados = [self._ler(caminho).drop_duplicates().groupby(["rotulo", "periodo"], sort=False).size()
+                      for caminho in sorted(self.diretorio.glob("*.pkl"))]
+        shutil.rmtree(self.diretorio, ignore_errors=True)
+        if not resultados:
+            return pd.Series([], dtype="int64", index=pd.MultiIndex.from_arrays([[], []], names=["rotulo", "periodo"]))
+        return pd.concat(resultados)
+
+def baldes(df, esquema, granularidade, tipo):
+    # Balde (rótulo de PREFIXO/MUNICIPIO, período) de cada linha e a máscara das linhas com chave válida.
+    # Usa os rótulos (e não os códigos das categorias), então é comparável entre blocos.
+    colunas = agregacoes.ESQUEMAS[esquema]
+    datas = df[colunas["data"]].to_numpy(dtype="datetime64[ns]")
+    valida = ~np.isnat(datas)
+    periodo = np.zeros(len(df), dtype=np.int64)
+    if valida.any():
+        periodo[valida] = agregacoes.GRANULARIDADES[granularidade](datas[valida])
+    rotulos = df[colunas[tipo]].astype(object)
+    valida &= rotulos.notna().to_numpy()
+    return valida, rotulos.astype(str).to_numpy(dtype=object), periodo
+
+def novos_contadores(diretorio):
+    granularidades = agregacoes.GRANULARIDADES_PADRAO + agregacoes.GRANULARIDADES_EXTRAS
+    return {(granularidade, tipo): ContadorDistintos(Path(diretorio) / f"{granularidade}_{tipo}")
+            for granularidade in granularidades for tipo in ("prefixo", "municipio")}
+
+def acumular_contadores(df, esquema, contadores):
+    # Parcial de um bloco: mesmas regras do agregacoes.calcular_contadores (OS nula não conta; na cidade só
+    # as OS não efetivas)
+    colunas = agregacoes.ESQUEMAS[esquema]
+    os_valida = df[colunas["os"]].notna().to_numpy()
+    os_texto = df[colunas["os"]].astype(object).astype(str).to_numpy(dtype=object)
+    nao_efetiva = (df[colunas["efetividade"]] == agregacoes.NAO_EFETIVA).to_numpy(dtype=bool)
+    for (granularidade, tipo), contador in contadores.items():
+        valida, rotulos, periodo = baldes(df, esquema, granularidade, tipo)
+        mascara = valida & os_valida & (nao_efetiva if tipo == "municipio" else True)
+        contador.adicionar(rotulos[mascara], periodo[mascara], os_texto[mascara])
+    return contadores
+
+def aplicar_contadores(df, esquema, contagens):
+    # Preenche QTD OS POR PREFIXO(<g>) e EFETIVIDADE POR CIDADE (<g>) do bloco com as contagens globais.
+    # Tipos fixos em todos os blocos: Int64 (nulo onde o balde não é válido) no prefixo e int64 na cidade
+    for (granularidade, tipo), contagem in contagens.items():
+        valida, rotulos, periodo = baldes(df, esquema, granularidade, tipo)
+        valores = contagem.reindex(pd.MultiIndex.from_arrays([rotulos, periodo])).fillna(0).to_numpy(dtype=np.int64)
+        if tipo == "municipio":
+            df[agregacoes.coluna_cidade(granularidade)] = np.where(valida, valores, 0).astype(np.int64)
+        else:
+            df[agregacoes.coluna_prefixo(granularidade)] = pd.array(valores, dtype="Int64")
+            df.loc[~valida, agregacoes.coluna_prefixo(granularidade)] = pd.NA
+    return df
+
+def processar(nome, nome_saida, esquema, registro, tratar_linhas, juncoes, finalizar_bloco, colunas_saida):
+    # Duas leituras em blocos do intermediário bruto:
+    # 1. média do intervalo usado no preenchimento das datas nulas (soma e contagem parciais)
+    # 2. tratamento (uma vez por bloco, guardado em disco) e pares (balde, OS) dos contadores
+    # Depois os blocos tratados voltam do disco com os contadores globais e os IDs e são gravados
+    inicio, fim = etl_incremental.COLUNAS_INTERVALO[esquema]
+    media = MediaParcial()
+    for bloco in armazenamento.ler_intermediario_em_blocos(nome, TAMANHO_BLOCO, colunas=[inicio, fim]):
+        media.adicionar(etl_incremental.intervalo_segundos(bloco, esquema))
+    average_diff = media.valor()
+
+    temporario = armazenamento.DIRETORIO_SAIDA / DIRETORIO_TEMPORARIO
+    temporario.mkdir(parents=True, exist_ok=True)
+    relatorio = {}
+    with tempfile.TemporaryDirectory(dir=temporario) as pasta:
+        pasta = Path(pasta)
+        contadores = novos_contadores(pasta / "contadores")
+        tratados = []
+        for bloco in armazenamento.ler_intermediario_em_blocos(nome, TAMANHO_BLOCO):
+            df = tratar_linhas(bloco, registro, average_diff)
+            acumular_contadores(df, esquema, contadores)
+            tratados.append(pasta / f"bloco_{len(tratados)}.pkl")
+            df.to_pickle(tratados[-1])
+        contagens = {chave: contador.contagens() for chave, contador in contadores.items()}
+
+        with armazenamento.GravadorIntermediario(nome_saida) as gravador:
+            for caminho in tratados:
+                df = aplicar_contadores(pd.read_pickle(caminho), esquema, contagens)
+                os.remove(caminho)
+                df = registro.atribuir_ids(df, juncoes, acumulado=relatorio)
+                gravador.escrever(finalizar_bloco(df))
+            gravador.fechar(colunas_vazio=colunas_saida)
+    registro.relatar(relatorio, nome)
+    print(f"{nome_saida}: {gravador.linhas} linhas gravadas em blocos de {TAMANHO_BLOCO}")
+    return gravador.linhas
@@ -0,0 +1,186 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from datetime import datetime
+from dotenv import load_dotenv
+import armazenamento
+import agregacoes
+import normalizacao_datas
+from controle_incremental import hash_arquivo
+
+load_dotenv('credenciais_arquivos.env')
+
+# ETL_INCREMENTAL=1: in2/in3 tratam só as linhas novas ou alteradas e refazem só os contadores afetados
+ETL_INCREMENTAL = os.getenv("ETL_INCREMENTAL", "0") == "1"
+DIRETORIO_ESTADO = "estado_incremental"
+# Acima desta fração de linhas alteradas o processamento completo sai mais barato
+LIMITE_DELTA = float(os.getenv("LIMITE_DELTA_INCREMENTAL", "0.5"))
+
+# Chave de cada linha do arquivo bruto (a OS do emergencial sai da OCORRENCIA)
+CHAVES = {"comercial": "SS_NUMERO", "emergencial": "OCORRENCIA"}
+# Colunas do intervalo cuja média preenche INICIO_DESLOCAMENTO
+COLUNAS_INTERVALO = {"comercial": ("DATA_SOLICITACAO", "INICIO_DESLOCAMENTO"),
+                     "emergencial": ("DATA_ABERTURA", "INICIO_DESLOCAMENTO")}
+# Mudança em qualquer um destes arquivos invalida o estado
+ARQUIVOS_CODIGO = {"comercial": ["in2_ETL_oper_comercial.py", "agregacoes.py", "dimensoes.py", "etl_incremental.py", "normalizacao_datas.py"],
+                   "emergencial": ["in3_ETL_oper_emergencial.py", "agregacoes.py", "dimensoes.py", "etl_incremental.py", "normalizacao_datas.py"]}
+
+def diretorio_estado():
+    return armazenamento.DIRETORIO_SAIDA / DIRETORIO_ESTADO
+
+def versao_estado(esquema, registro):
+    base = Path(__file__).resolve().parent
+    codigo = {arquivo: hash_arquivo(base / arquivo) for arquivo in ARQUIVOS_CODIGO[esquema] if (base / arquivo).exists()}
+    conteudo = {"codigo": codigo, "ids": registro.versao,
+                "granularidades": agregacoes.GRANULARIDADES_PADRAO + agregacoes.GRANULARIDADES_EXTRAS}
+    return hashlib.sha256(json.dumps(conteudo, sort_keys=True).encode("utf-8")).hexdigest()
+
+def identificar_linhas(df, esquema):
+    # Chave estável de cada linha (chave bruta + ordem entre repetidas) e assinatura do conteúdo bruto
+    chave_bruta = df[CHAVES[esquema]].astype(str)
+    ordem = chave_bruta.groupby(chave_bruta.to_numpy(), sort=False).cumcount()
+    chave = pd.util.hash_pandas_object(pd.DataFrame({"chave": chave_bruta.to_numpy(), "ordem": ordem.to_numpy()}),
+                                       index=False).to_numpy()
+    assinatura = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return chave, assinatura
+
+def intervalo_segundos(df, esquema):
+    # Os textos convertidos aqui ficam no cache e o tratar_linhas não os converte de novo
+    inicio, fim = COLUNAS_INTERVALO[esquema]
+    return ((normalizacao_datas.converter_serie(df[fim]) - normalizacao_datas.converter_serie(df[inicio]))
+            .dt.total_seconds().to_numpy(dtype=float))
+
+def carregar_estado(esquema):
+    caminho_meta = diretorio_estado() / f"{esquema}.json"
+    if not caminho_meta.exists():
+        return None, {}
+    with open(caminho_meta, encoding="utf-8") as f:
+        meta = json.load(f)
+    df = armazenamento.carregar_intermediario(esquema, diretorio=diretorio_estado(), formato="parquet",
+                                              manter_categorias=True)
+    return df, meta
+
+def salvar_estado(esquema, df, versao, soma_intervalo, contagem_intervalo):
+    # Dados e metadados gravados em arquivos temporários e trocados no fim (estado nunca fica pela metade)
+    diretorio = diretorio_estado()
+    diretorio.mkdir(parents=True, exist_ok=True)
+    temporario = armazenamento.salvar_intermediario(df, f"{esquema}_tmp", diretorio, "parquet")
+    os.replace(temporario, armazenamento.caminho_intermediario(esquema, diretorio, "parquet"))
+    meta = {
+        "versao": versao,
+        "linhas": len(df),
+        "soma_intervalo_s": float(soma_intervalo),
+        "contagem_intervalo": int(contagem_intervalo),
+        "atualizado_em": datetime.now().isoformat(timespec="seconds")
+    }
+    caminho_meta = diretorio / f"{esquema}.json"
+    with open(caminho_meta.with_suffix(".tmp"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(caminho_meta.with_suffix(".tmp"), caminho_meta)
+
+def unificar_categorias(a, b):
+    # Mesmas categorias nos dois lados (as de "a" primeiro, códigos preservados) para o concat
+    # manter Categorical e os códigos serem comparáveis
+    for coluna in a.columns:
+        if coluna in b.columns and isinstance(a[coluna].dtype, pd.CategoricalDtype) \
+                and isinstance(b[coluna].dtype, pd.CategoricalDtype) and a[coluna].dtype != b[coluna].dtype:
+            categorias = a[coluna].cat.categories
+            categorias = categorias.append(b[coluna].cat.categories.difference(categorias))
+            a[coluna] = a[coluna].cat.set_categories(categorias)
+            b[coluna] = b[coluna].cat.set_categories(categorias)
+    return a, b
+
+def atualizar_contadores(novo, saindo, n_delta, esquema):
+    # Refaz os contadores só nos baldes (PREFIXO/MUNICIPIO, período) tocados pelas linhas que saíram
+    # ou entraram. As linhas novas ficam no fim de "novo" e sempre entram no recálculo.
+    granularidades = agregacoes.GRANULARIDADES_PADRAO + agregacoes.GRANULARIDADES_EXTRAS
+    delta = novo.iloc[len(novo) - n_delta:]
+    eh_delta = np.zeros(len(novo), dtype=bool)
+    eh_delta[len(novo) - n_delta:] = True
+
+    mascaras = {}
+    for granularidade in granularidades:
+        chaves_novo = agregacoes.chaves_baldes(novo, esquema, granularidade)
+        chaves_saindo = agregacoes.chaves_baldes(saindo, esquema, granularidade)
+        chaves_delta = agregacoes.chaves_baldes(delta, esquema, granularidade)
+        for tipo in ("prefixo", "municipio"):
+            afetadas = np.unique(np.concatenate([chaves_saindo[tipo], chaves_delta[tipo]]))
+            afetadas = afetadas[afetadas >= 0]
+            mascaras[(granularidade, tipo)] = np.isin(chaves_novo[tipo], afetadas) | eh_delta
+
+    selecao = np.logical_or.reduce(list(mascaras.values()))
+    colunas = list(dict.fromkeys(agregacoes.ESQUEMAS[esquema].values()))
+    parcial = agregacoes.calcular_contadores(novo.loc[selecao, colunas].copy(), esquema, granularidades)
+
+    for (granularidade, tipo), mascara in mascaras.items():
+        coluna = agregacoes.coluna_prefixo(granularidade) if tipo == "prefixo" else agregacoes.coluna_cidade(granularidade)
+        valores = novo[coluna].to_numpy(dtype=float, copy=True) if coluna in novo.columns else np.full(len(novo), np.nan)
+        valores[mascara] = parcial[coluna].to_numpy(dtype=float)[mascara[selecao]]
+        if tipo == "municipio" or not np.isnan(valores).any():
+            novo[coluna] = valores.astype(int)
+        else:
+            novo[coluna] = valores
+    print(f"Contadores recalculados em {int(selecao.sum())} de {len(novo)} linhas")
+    return novo
+
+def processar_completo(df_bruto, esquema, registro, tratar_linhas, chave, assinatura, versao):
+    intervalo = intervalo_segundos(df_bruto, esquema)
+    df = tratar_linhas(df_bruto, registro)
+    df = agregacoes.calcular_contadores(df, esquema)
+    df["_CHAVE"] = chave
+    df["_ASSINATURA"] = assinatura
+    df["_INTERVALO"] = intervalo
+    salvar_estado(esquema, df, versao, np.nansum(intervalo), np.count_nonzero(~np.isnan(intervalo)))
+    return df
+
+def processar(df_bruto, esquema, registro, tratar_linhas):
+    # Aplica ao estado salvo só as linhas novas/alteradas (e remove as que sumiram do arquivo).
+    # As linhas inalteradas mantêm o tratamento da execução anterior: o preenchimento de datas nulas
+    # usa a média do intervalo mantida no estado, sem reprocessar o histórico quando ela varia.
+    versao = versao_estado(esquema, registro)
+    chave, assinatura = identificar_linhas(df_bruto, esquema)
+    anterior, meta = carregar_estado(esquema)
+    if anterior is None or meta.get("versao") != versao or len(anterior) != meta.get("linhas"):
+        print(f"Estado incremental de {esquema} ausente ou desatualizado: processamento completo")
+        return processar_completo(df_bruto, esquema, registro, tratar_linhas, chave, assinatura, versao)
+
+    posicao = pd.Index(anterior["_CHAVE"].to_numpy()).get_indexer(chave)
+    assinatura_anterior = anterior["_ASSINATURA"].to_numpy()
+    existentes = posicao >= 0
+    alterada = ~existentes
+    alterada[existentes] = assinatura_anterior[posicao[existentes]] != assinatura[existentes]
+    manter = np.zeros(len(anterior), dtype=bool)
+    manter[posicao[~alterada]] = True
+    sair = ~manter
+
+    if not alterada.any() and not sair.any():
+        print(f"{esquema}: nenhuma linha nova ou alterada")
+        return anterior
+    if alterada.sum() > LIMITE_DELTA * max(len(df_bruto), 1):
+        print(f"{esquema}: {int(alterada.sum())} linhas alteradas, processamento completo")
+        return processar_completo(df_bruto, esquema, registro, tratar_linhas, chave, assinatura, versao)
+
+    # Média do intervalo atualizada com o que saiu e o que entrou
+    intervalo_anterior = anterior["_INTERVALO"].to_numpy(dtype=float)[sair]
+    intervalo_delta = intervalo_segundos(df_bruto[alterada], esquema)
+    soma = meta["soma_intervalo_s"] - np.nansum(intervalo_anterior) + np.nansum(intervalo_delta)
+    contagem = meta["contagem_intervalo"] - np.count_nonzero(~np.isnan(intervalo_anterior)) \
+        + np.count_nonzero(~np.isnan(intervalo_delta))
+    media = pd.to_timedelta(soma / contagem, unit="s") if contagem > 0 else pd.NaT
+
+    delta = tratar_linhas(df_bruto[alterada].copy(), registro, media)
+    delta["_CHAVE"] = chave[alterada]
+    delta["_ASSINATURA"] = assinatura[alterada]
+    delta["_INTERVALO"] = intervalo_delta
+
+    anterior, delta = unificar_categorias(anterior, delta)
+    saindo = anterior[sair]
+    novo = pd.concat([anterior[manter], delta], ignore_index=True)
+    novo = atualizar_contadores(novo, saindo, len(delta), esquema)
+
+    salvar_estado(esquema, novo, versao, soma, contagem)
+    print(f"{esquema}: {len(delta)} linhas novas/alteradas, {int(sair.sum())} substituídas ou removidas")
+    return novo
@@ -0,0 +1,277 @@
+import os
+import json
+import math
+import shutil
+import hashlib
+import argparse
+import threading
+from pathlib import Path
+from dotenv import load_dotenv
+import armazenamento
+import camada_geo
+from controle_incremental import hash_arquivo
+
+load_dotenv('credenciais_arquivos.env')
+
+# Geometrias do mapa em vários níveis de detalhe, no formato TopoJSON: cada divisa entre dois municípios vira
+# um arco guardado uma vez e simplificado uma vez (Douglas-Peucker), então os vizinhos continuam encaixados
+# em qualquer tolerância; as coordenadas são inteiras (quantizadas) e gravadas como diferenças.
+# As camadas coropléticas (geometria + KPI por município) ficam em cache por publicação do pipeline.
+DIRETORIO_MAPAS = "mapas"
+DIRETORIO_CAMADAS = "camadas"
+ARQUIVO_META_MAPAS = "geometrias.json"
+# Nível: (tolerância em graus, posições inteiras por eixo). O GeoJSON tem vértices a ~1 km (0,01 grau):
+# detalhado para zoom em uma cidade, estadual para o estado inteiro (1 grau ~ 111 km)
+NIVEIS_MAPA = {"detalhado": (0.002, 100000), "municipal": (0.005, 30000), "estadual": (0.02, 10000)}
+NIVEL_PADRAO = os.getenv("NIVEL_MAPA_PADRAO", "municipal")
+PRECISAO_VERTICE = 10 ** 7  # vértices iguais no GeoJSON (divisas) viram a mesma chave
+NOME_OBJETO = "municipios"
+
+_geometrias = {}
+_trava = threading.Lock()
+
+def diretorio_mapas(diretorio=None):
+    return (armazenamento.DIRETORIO_SAIDA if diretorio is None else diretorio) / DIRETORIO_MAPAS
+
+def caminho_geometria(nivel, diretorio=None):
+    return diretorio_mapas(diretorio) / f"goias_{nivel}.topojson"
+
+def _chave(ponto):
+    return (round(ponto[0] * PRECISAO_VERTICE), round(ponto[1] * PRECISAO_VERTICE))
+
+def _ponto(chave):
+    return (chave[0] / PRECISAO_VERTICE, chave[1] / PRECISAO_VERTICE)
+
+def _ler_poligonos(caminho_geojson):
+    # (código IBGE, nome, polígonos) com cada anel como lista de chaves, sem o vértice de fechamento
+    with open(caminho_geojson, encoding="utf-8") as f:
+        geojson = json.load(f)
+    municipios = []
+    for feature in geojson["features"]:
+        poligonos = []
+        for poligono in camada_geo._aneis(feature["geometry"]):
+            aneis = []
+            for anel in poligono:
+                chaves = [_chave(ponto) for ponto in anel]
+                if chaves[0] == chaves[-1]:
+                    chaves.pop()
+                # Vértices repetidos em sequência não mudam a forma e atrapalham a detecção de junções
+                chaves = [chave for i, chave in enumerate(chaves) if chave != chaves[i - 1]]
+                aneis.append(chaves)
+            poligonos.append(aneis)
+        municipios.append((feature["properties"]["id"], feature["properties"]["name"], poligonos))
+    return municipios
+
+def _juncoes(aneis):
+    # Junção: vértice que aparece com pares de vizinhos diferentes (onde uma divisa começa ou termina)
+    vizinhos, juncoes = {}, set()
+    for anel in aneis:
+        for i, chave in enumerate(anel):
+            par = (anel[i - 1], anel[(i + 1) % len(anel)])
+            conhecido = vizinhos.setdefault(chave, par)
+            if conhecido != par and conhecido != par[::-1]:
+                juncoes.add(chave)
+    return juncoes
+
+def construir_topologia(caminho_geojson=camada_geo.ARQUIVO_GEOJSON):
+    municipios = _ler_poligonos(caminho_geojson)
+    juncoes = _juncoes([anel for _, _, poligonos in municipios for poligono in poligonos for anel in poligono])
+    arcos, referencias = [], {}
+
+    def referencia(arco):
+        arco = tuple(arco)
+        if arco not in referencias:
+            referencias[arco] = len(arcos)
+            referencias[arco[::-1]] = ~len(arcos)
+            arcos.append(arco)
+        return referencias[arco]
+
+    objetos = []
+    for identificador, nome, poligonos in municipios:
+        poligonos_arcos = []
+        for poligono in poligonos:
+            aneis_arcos = []
+            for anel in poligono:
+                cortes = [i for i, chave in enumerate(anel) if chave in juncoes]
+                if not cortes:
+                    # Anel sem divisas parciais (ilha ou enclave): um arco fechado começando no menor vértice
+                    inicio = anel.index(min(anel))
+                    rotacionado = anel[inicio:] + anel[:inicio]
+                    aneis_arcos.append([referencia(rotacionado + [rotacionado[0]])])
+                    continue
+                rotacionado = anel[cortes[0]:] + anel[:cortes[0]]
+                cortes = [i - cortes[0] for i in cortes] + [len(anel)]
+                rotacionado.append(rotacionado[0])
+                aneis_arcos.append([referencia(rotacionado[inicio:fim + 1]) for inicio, fim in zip(cortes, cortes[1:])])
+            poligonos_arcos.append(aneis_arcos)
+        objetos.append({"id": identificador, "nome": nome, "poligonos": poligonos_arcos})
+    return {"arcos": [[_ponto(chave) for chave in arco] for arco in arcos], "objetos": objetos}
+
+def _douglas_peucker(pontos, tolerancia):
+    manter = [False] * len(pontos)
+    manter[0] = manter[-1] = True
+    pilha = [(0, len(pontos) - 1)]
+    while pilha:
+        inicio, fim = pilha.pop()
+        if fim - inicio < 2:
+            continue
+        (x0, y0), (x1, y1) = pontos[inicio], pontos[fim]
+        dx, dy = x1 - x0, y1 - y0
+        comprimento = math.hypot(dx, dy)
+        maior, indice = -1.0, inicio
+        for i in range(inicio + 1, fim):
+            x, y = pontos[i]
+            distancia = abs(dy * (x - x0) - dx * (y - y0)) / comprimento if comprimento else math.hypot(x - x0, y - y0)
+            if distancia > maior:
+                maior, indice = distancia, i
+        if maior > tolerancia:
+            manter[indice] = True
+            pilha.extend([(inicio, indice), (indice, fim)])
+    return manter
+
+def simplificar_arco(pontos, tolerancia):
+    if pontos[0] != pontos[-1]:
+        manter = _douglas_peucker(pontos, tolerancia)
+    else:
+        # Arco fechado: parte no vértice mais distante do início e mantém pelo menos um triângulo
+        x0, y0 = pontos[0]
+        distante = max(range(len(pontos)), key=lambda i: math.hypot(pontos[i][0] - x0, pontos[i][1] - y0))
+        manter = _douglas_peucker(pontos[:distante + 1], tolerancia)[:-1] + _douglas_peucker(pontos[distante:], tolerancia)
+        if sum(manter) < 4:
+            maior_metade = (distante // 2) if distante >= len(pontos) - 1 - distante else (distante + len(pontos) - 1) // 2
+            manter[maior_metade] = True
+    return [ponto for ponto, mantido in zip(pontos, manter) if mantido]
+
+def codificar(topologia, tolerancia, quantizacao):
+    # TopoJSON com transformação: arcos simplificados, quantizados e em diferenças entre vértices
+    arcos = [simplificar_arco(arco, tolerancia) for arco in topologia["arcos"]]
+    xs = [x for arco in arcos for x, _ in arco]
+    ys = [y for arco in arcos for _, y in arco]
+    caixa = [min(xs), min(ys), max(xs), max(ys)]
+    escala = [(caixa[2] - caixa[0]) / (quantizacao - 1) or 1.0, (caixa[3] - caixa[1]) / (quantizacao - 1) or 1.0]
+
+    arcos_codificados = []
+    for arco in arcos:
+        inteiros = [(round((x - caixa[0]) / escala[0]), round((y - caixa[1]) / escala[1])) for x, y in arco]
+        inteiros = [ponto for i, ponto in enumerate(inteiros) if i == 0 or ponto != inteiros[i - 1]] or inteiros[:1]
+        if len(inteiros) == 1:
+            inteiros.append(inteiros[0])
+        arcos_codificados.append([list(inteiros[0])] + [[x - px, y - py] for (px, py), (x, y) in zip(inteiros, inteiros[1:])])
+
+    geometrias = []
+    for objeto in topologia["objetos"]:
+        if len(objeto["poligonos"]) == 1:
+            geometria = {"type": "Polygon", "arcs": objeto["poligonos"][0]}
+        else:
+            geometria = {"type": "MultiPolygon", "arcs": objeto["poligonos"]}
+        geometria["id"] = objeto["id"]
+        geometria["properties"] = {"ID_IBGE": int(objeto["id"]), "NOME": objeto["nome"],
+                                   "MUNICIPIO": camada_geo.normalizar_nome(objeto["nome"])}
+        geometrias.append(geometria)
+    return {"type": "Topology", "bbox": caixa, "transform": {"scale": escala, "translate": caixa[:2]},
+            "objects": {NOME_OBJETO: {"type": "GeometryCollection", "geometries": geometrias}},
+            "arcs": arcos_codificados}
+
+def _serializar(conteudo):
+    return json.dumps(conteudo, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def _gravar(caminho, corpo):
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+    temporario = caminho.with_name(caminho.name + ".tmp")
+    temporario.write_bytes(corpo)
+    os.replace(temporario, caminho)
+
+def gerar_geometrias(diretorio=None, caminho_geojson=camada_geo.ARQUIVO_GEOJSON, forcar=False):
+    # Um TopoJSON por nível; refeito só quando o GeoJSON ou os níveis mudam
+    caminho_meta = diretorio_mapas(diretorio) / ARQUIVO_META_MAPAS
+    assinatura = {"hash_geojson": hash_arquivo(caminho_geojson), "niveis": {nivel: list(valores) for nivel, valores in NIVEIS_MAPA.items()}}
+    if not forcar and caminho_meta.exists():
+        with open(caminho_meta, encoding="utf-8") as f:
+            meta = json.load(f)
+        if {chave: meta.get(chave) for chave in assinatura} == assinatura and \
+                all(caminho_geometria(nivel, diretorio).exists() for nivel in NIVEIS_MAPA):
+            return meta
+
+    topologia = construir_topologia(caminho_geojson)
+    meta = dict(assinatura, tamanhos={})
+    for nivel, (tolerancia, quantizacao) in NIVEIS_MAPA.items():
+        corpo = _serializar(codificar(topologia, tolerancia, quantizacao))
+        _gravar(caminho_geometria(nivel, diretorio), corpo)
+        meta["tamanhos"][nivel] = len(corpo)
+    _gravar(caminho_meta, json.dumps(meta, ensure_ascii=False, indent=2).encode("utf-8"))
+    print(f"Geometrias do mapa geradas: {meta['tamanhos']} bytes (GeoJSON original: {Path(caminho_geojson).stat().st_size})")
+    with _trava:
+        _geometrias.clear()
+    return meta
+
+def carregar_geometria(nivel=NIVEL_PADRAO, diretorio=None):
+    if nivel not in NIVEIS_MAPA:
+        raise ValueError(f"Nível de mapa desconhecido: {nivel} (use {', '.join(NIVEIS_MAPA)})")
+    with _trava:
+        if nivel in _geometrias:
+            return _geometrias[nivel]
+    gerar_geometrias(diretorio)
+    with open(caminho_geometria(nivel, diretorio), encoding="utf-8") as f:
+        topologia = json.load(f)
+    with _trava:
+        _geometrias[nivel] = topologia
+    return topologia
+
+def _valor(valor):
+    if valor is None or (isinstance(valor, float) and math.isnan(valor)):
+        return None
+    return valor.item() if hasattr(valor, "item") else valor
+
+def camada_coropletica(cubo, versao, metrica, mes=None, status=None, nivel=NIVEL_PADRAO, diretorio=None):
+    # TopoJSON do nível com a métrica (e QTD_OS) de cada município nas propriedades, pronto para o mapa.
+    # Gravado em mapas/camadas/<versão da publicação>/: só uma nova publicação invalida as camadas.
+    # Os filtros vêm da query string: só valores que existem no cubo, e o nome do arquivo é o hash deles
+    # (nenhum valor da requisição entra no caminho, e o cache fica limitado às combinações do cubo)
+    if nivel not in NIVEIS_MAPA:
+        raise ValueError(f"Nível de mapa desconhecido: {nivel} (use {', '.join(NIVEIS_MAPA)})")
+    if metrica not in cubo.tabela.columns:
+        raise ValueError(f"Métrica desconhecida: {metrica}")
+    for chave, valor in (("MES", mes), ("STATUS", status)):
+        if valor is not None and str(valor) not in cubo.tabela.index.levels[cubo.tabela.index.names.index(chave)]:
+            raise ValueError(f"{chave} desconhecido: {valor}")
+    filtros = [nivel, metrica, None if mes is None else str(mes), None if status is None else str(status)]
+    nome = hashlib.sha1(json.dumps(filtros, ensure_ascii=False).encode("utf-8")).hexdigest()
+    pasta = diretorio_mapas(diretorio) / DIRETORIO_CAMADAS / str(versao)
+    caminho = pasta / f"{nome}.topojson"
+    if caminho.exists():
+        return caminho.read_bytes()
+
+    topologia = carregar_geometria(nivel, diretorio)
+    fatia = cubo.fatia("MUNICIPIO", mes=mes, status=status)
+    posicoes = camada_geo.carregar().posicoes(fatia["MUNICIPIO"])
+    valores = {}
+    # Duas grafias do mesmo município (ex.: com e sem " - GO"): fica a linha com mais OS
+    for posicao, municipio, quantidade, valor in zip(posicoes, fatia["MUNICIPIO"], fatia["QTD_OS"], fatia[metrica]):
+        if posicao >= 0 and (posicao not in valores or quantidade > valores[posicao][1]):
+            valores[int(posicao)] = (str(municipio), _valor(quantidade), _valor(valor))
+
+    geometrias = []
+    for posicao, geometria in enumerate(topologia["objects"][NOME_OBJETO]["geometries"]):
+        municipio, quantidade, valor = valores.get(posicao, (None, 0, None))
+        propriedades = dict(geometria["properties"], MUNICIPIO_OPER=municipio, QTD_OS=quantidade)
+        if metrica != "QTD_OS":
+            propriedades[metrica] = valor
+        geometrias.append(dict(geometria, properties=propriedades))
+    camada = dict(topologia, objects={NOME_OBJETO: {"type": "GeometryCollection", "geometries": geometrias}},
+                  filtros={"metrica": metrica, "mes": mes, "status": status, "nivel": nivel, "versao": versao})
+    corpo = _serializar(camada)
+
+    # Camadas de publicações anteriores não serão mais lidas
+    for antiga in pasta.parent.glob("*"):
+        if antiga.is_dir() and antiga.name != pasta.name:
+            shutil.rmtree(antiga, ignore_errors=True)
+    _gravar(caminho, corpo)
+    return corpo
+
+def ler_argumentos(argv=None):
+    parser = argparse.ArgumentParser(description="Gera as geometrias simplificadas do mapa de Goiás")
+    parser.add_argument("--forcar", action="store_true", help="regera mesmo com o GeoJSON inalterado")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    gerar_geometrias(forcar=ler_argumentos().forcar)
@@ -0,0 +1,200 @@
+import json
+import argparse
+import unicodedata
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from datetime import datetime
+import armazenamento
+from in1_conexao_banco_planilhas import colunas_do_arquivo, tratar_colunas
+
+ARQUIVO_GEOJSON = Path(__file__).resolve().parent / "geojs-GOIAS.json"
+
+# Seis bases regionais atuais; "PIR" aparece cru como nas planilhas e vira "PRI" no in2
+BASES_REGIONAIS = {
+    "CALDAS NOVAS": "CDN",
+    "CATALAO": "CAT",
+    "ITUMBIARA": "ITB",
+    "MORRINHOS": "MOR",
+    "RIO VERDE": "RVD",
+    "PIRES DO RIO": "PIR"
+}
+CIDADES_COM_SUFIXO = set(BASES_REGIONAIS)
+
+TIPOS_SERVICO = {
+    "LIGACAO NOVA": ["MONOFASICA", "BIFASICA", "TRIFASICA"],
+    "CORTE": ["INADIMPLENCIA", "A PEDIDO"],
+    "RELIGACAO": ["NORMAL", "URGENTE"],
+    "INSPECAO": ["MEDIDOR", "PADRAO DE ENTRADA"],
+    "TROCA DE MEDIDOR": ["DEFEITO", "MODERNIZACAO"]
+}
+CAUSAS = ["ARVORE NA REDE", "DESCARGA ATMOSFERICA", "ABALROAMENTO", "DEFEITO EM EQUIPAMENTO", "VANDALISMO", "NAO IDENTIFICADA"]
+MOTIVOS_RECLAMACAO = ["FALTA DE ENERGIA", "OSCILACAO DE TENSAO", "FIO PARTIDO", "POSTE DANIFICADO", "CHAVE ABERTA"]
+EFETIVIDADES = ["EFETIVA", "NÃO EFETIVA"]
+
+def normalizar_nome(nome):
+    sem_acento = unicodedata.normalize("NFKD", nome).encode("ascii", "ignore").decode("ascii")
+    return sem_acento.upper().strip()
+
+def carregar_municipios(caminho=ARQUIVO_GEOJSON):
+    with open(caminho, encoding="utf-8") as f:
+        geojson = json.load(f)
+    return [(int(feature["properties"]["id"]), normalizar_nome(feature["properties"]["name"]))
+            for feature in geojson["features"]]
+
+def gerar_prefixos(equipes_por_base, rng):
+    prefixos = []
+    for base in BASES_REGIONAIS.values():
+        for numero in range(1, equipes_por_base + 1):
+            prefixos.append(f"{base}{rng.choice(['C', 'E'])}{numero:03d}")
+    return prefixos
+
+def _pesos_municipios(municipios):
+    # As cidades das bases concentram a maior parte das ordens
+    pesos = np.array([30.0 if nome in CIDADES_COM_SUFIXO else 1.0 for _, nome in municipios])
+    return pesos / pesos.sum()
+
+def gerar_datas(n, rng, inicio, fim, proporcao_nulos, resposta_media_min):
+    segundos = int((fim - inicio).total_seconds())
+    solicitacao = pd.to_datetime(inicio) + pd.to_timedelta(rng.integers(0, segundos, n), unit="s")
+    inicio_desl = solicitacao + pd.to_timedelta(rng.exponential(resposta_media_min, n), unit="m")
+    fim_desl = inicio_desl + pd.to_timedelta(np.clip(rng.normal(35, 15, n), 5, 180), unit="m")
+    inicio_exec = fim_desl + pd.to_timedelta(rng.exponential(3, n), unit="m")
+    fim_exec = inicio_exec + pd.to_timedelta(np.clip(rng.exponential(60, n), 5, 600), unit="m")
+
+    colunas = [solicitacao, inicio_desl, fim_desl, inicio_exec, fim_exec]
+    # Lacunas nas datas de deslocamento/execução (a solicitação é sempre preenchida)
+    for i in range(1, len(colunas)):
+        serie = pd.Series(colunas[i])
+        serie[rng.random(n) < proporcao_nulos] = pd.NaT
+        colunas[i] = serie.values
+    return colunas
+
+def _sortear_subtipos(tipos, tipo, rng):
+    subtipos = np.empty(len(tipo), dtype=object)
+    for i, nome in enumerate(tipos):
+        posicoes = np.flatnonzero(tipo == i)
+        subtipos[posicoes] = np.asarray(TIPOS_SERVICO[nome], dtype=object)[rng.integers(0, len(TIPOS_SERVICO[nome]), len(posicoes))]
+    return subtipos
+
+def gerar_comercial(n, rng, municipios, prefixos, inicio, fim, proporcao_nao_efetiva, proporcao_nulos):
+    tipos = list(TIPOS_SERVICO)
+    tipo = rng.choice(len(tipos), n)
+    datas = gerar_datas(n, rng, inicio, fim, proporcao_nulos, resposta_media_min=24 * 60)
+    efetividade = np.where(rng.random(n) < proporcao_nao_efetiva, EFETIVIDADES[1], EFETIVIDADES[0]).astype(object)
+    efetividade[rng.random(n) < proporcao_nulos / 2] = None
+
+    df = pd.DataFrame({
+        "PREFIXO": np.asarray(prefixos, dtype=object)[rng.integers(0, len(prefixos), n)],
+        "SS_NUMERO": rng.permutation(n) + 10_000_000,
+        "MUNICIPIO": np.asarray([nome for _, nome in municipios], dtype=object)[
+            rng.choice(len(municipios), n, p=_pesos_municipios(municipios))],
+        "TIPO_SERVICO": np.asarray(tipos, dtype=object)[tipo],
+        "SUBTIPO_SERVICO": _sortear_subtipos(tipos, tipo, rng),
+        "EFETIVIDADE_VISITA": efetividade,
+        "DATA_SOLICITACAO": datas[0],
+        "INICIO_DESLOCAMENTO": datas[1],
+        "FIM_DESLOCAMENTO": datas[2],
+        "INICIO_EXECUCAO": datas[3],
+        "FIM_EXECUCAO": datas[4]
+    })
+    return tratar_colunas(df[colunas_do_arquivo("oper_comercial")].copy(), "oper_comercial")
+
+def gerar_emergencial(n, rng, municipios, prefixos, inicio, fim, proporcao_nao_efetiva, proporcao_nulos):
+    datas = gerar_datas(n, rng, inicio, fim, proporcao_nulos, resposta_media_min=90)
+    efetividade = np.where(rng.random(n) < proporcao_nao_efetiva, EFETIVIDADES[1], EFETIVIDADES[0]).astype(object)
+    efetividade[rng.random(n) < proporcao_nulos / 2] = None
+    numeros = rng.permutation(n) + 500_000
+
+    df = pd.DataFrame({
+        "PREFIXO": np.asarray(prefixos, dtype=object)[rng.integers(0, len(prefixos), n)],
+        "OCORRENCIA": pd.Series(numeros).astype(str) + " - " + pd.Series(rng.integers(1, 4, n)).astype(str),
+        "MUNICIPIO": np.asarray([nome for _, nome in municipios], dtype=object)[
+            rng.choice(len(municipios), n, p=_pesos_municipios(municipios))],
+        "CAUSA": np.asarray(CAUSAS, dtype=object)[rng.integers(0, len(CAUSAS), n)],
+        "MOTIVO_RECLAMACAO": np.asarray(MOTIVOS_RECLAMACAO, dtype=object)[rng.integers(0, len(MOTIVOS_RECLAMACAO), n)],
+        "EFETIVIDADE": efetividade,
+        "DATA_ABERTURA": datas[0],
+        "INICIO_DESLOCAMENTO": datas[1],
+        "FIM_DESLOCAMENTO": datas[2],
+        "INICIO_EXECUCAO": datas[3],
+        "FIM_EXECUCAO": datas[4]
+    })
+    return tratar_colunas(df[colunas_do_arquivo("oper_emergencial")].copy(), "oper_emergencial")
+
+def gerar_IDs(municipios, prefixos):
+    # Mesmo formato da planilha de IDs: pares (ID, nome) de tamanhos diferentes, completados com vazios
+    prefixos_tratados = sorted({p[:3].replace("PIR", "PRI") + p[3:] for p in prefixos})
+    nomes_municipios = [nome + " - GO" if nome in CIDADES_COM_SUFIXO else nome for _, nome in municipios]
+    subtipos = sorted({s for lista in TIPOS_SERVICO.values() for s in lista})
+    pares = {
+        "PREFIXO": (list(range(1, len(prefixos_tratados) + 1)), prefixos_tratados),
+        "MUNICIPIO": ([id_ibge for id_ibge, _ in municipios], nomes_municipios),
+        "EFETIVIDADE": ([1, 0], EFETIVIDADES),
+        "TIPO SERVICO COMERCIAL": (list(range(1, len(TIPOS_SERVICO) + 1)), list(TIPOS_SERVICO)),
+        "SUBTIPO SERVICO COMERCIAL": (list(range(1, len(subtipos) + 1)), subtipos),
+        "MOTIVO RECLAMACAO EMERGENCIA": (list(range(1, len(MOTIVOS_RECLAMACAO) + 1)), MOTIVOS_RECLAMACAO),
+        "CAUSA": (list(range(1, len(CAUSAS) + 1)), CAUSAS),
+        "PLACA": ([1, 2, 3], ["ABC1D23", "EFG4H56", "IJK7L89"]),
+        "TIPO EQUIPE": ([1, 2], ["LEVE", "PESADA"]),
+        "PERFIL": ([1, 2], ["COMERCIAL", "EMERGENCIAL"]),
+        "TIPO": ([1, 2], ["PROPRIA", "TERCEIRIZADA"])
+    }
+    colunas = {}
+    for nome, (ids, valores) in pares.items():
+        colunas[f"ID {nome}"] = pd.Series(ids)
+        colunas[nome] = pd.Series(valores, dtype=object)
+    df = pd.DataFrame(colunas)
+    return tratar_colunas(df[colunas_do_arquivo("IDs")].copy(), "IDs")
+
+def gerar_dados(linhas, destino, semente=42, anos=2, proporcao_emergencial=0.5, proporcao_nao_efetiva=0.2,
+                proporcao_nulos=0.05, equipes_por_base=12):
+    if linhas < 0:
+        raise ValueError(f"linhas deve ser >= 0 (recebido: {linhas})")
+    if anos <= 0 or equipes_por_base <= 0:
+        raise ValueError(f"anos e equipes_por_base devem ser positivos (recebido: {anos}, {equipes_por_base})")
+    for nome, proporcao in (("proporcao_emergencial", proporcao_emergencial), ("proporcao_nao_efetiva", proporcao_nao_efetiva),
+                            ("proporcao_nulos", proporcao_nulos)):
+        if not 0 <= proporcao <= 1:
+            raise ValueError(f"{nome} deve estar entre 0 e 1 (recebido: {proporcao})")
+    rng = np.random.default_rng(semente)
+    municipios = carregar_municipios()
+    prefixos = gerar_prefixos(equipes_por_base, rng)
+    fim = pd.Timestamp(datetime.now().date())
+    inicio = fim - pd.DateOffset(years=anos)
+
+    n_emergencial = int(linhas * proporcao_emergencial)
+    tabelas = {
+        "oper_comercial": gerar_comercial(linhas - n_emergencial, rng, municipios, prefixos, inicio, fim,
+                                          proporcao_nao_efetiva, proporcao_nulos),
+        "oper_emergencial": gerar_emergencial(n_emergencial, rng, municipios, prefixos, inicio, fim,
+                                              proporcao_nao_efetiva, proporcao_nulos),
+        "IDs": gerar_IDs(municipios, prefixos)
+    }
+
+    destino = Path(destino)
+    destino.mkdir(parents=True, exist_ok=True)
+    for nome, df in tabelas.items():
+        if list(df.columns) != colunas_do_arquivo(nome):
+            raise ValueError(f"Colunas geradas para {nome} diferem das do in1: {list(df.columns)} != {colunas_do_arquivo(nome)}")
+        armazenamento.salvar_intermediario(df, nome, destino)
+    print(f"Dados sintéticos gerados em {destino}: " + ", ".join(f"{n}={len(df)}" for n, df in tabelas.items()))
+    return tabelas
+
+def ler_argumentos(argv=None):
+    parser = argparse.ArgumentParser(description="Gera oper_comercial, oper_emergencial e IDs sintéticos")
+    parser.add_argument("--linhas", type=int, default=10_000, help="Total de ordens (comercial + emergencial)")
+    parser.add_argument("--destino", default="dados_sinteticos")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--anos", type=int, default=2)
+    parser.add_argument("--proporcao-emergencial", type=float, default=0.5)
+    parser.add_argument("--proporcao-nao-efetiva", type=float, default=0.2)
+    parser.add_argument("--proporcao-nulos", type=float, default=0.05)
+    parser.add_argument("--equipes-por-base", type=int, default=12)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    argumentos = ler_argumentos()
+    gerar_dados(argumentos.linhas, argumentos.destino, argumentos.semente, argumentos.anos,
+                argumentos.proporcao_emergencial, argumentos.proporcao_nao_efetiva,
+                argumentos.proporcao_nulos, argumentos.equipes_por_base)
@@ -1,10 +1,16 @@
 import os
 import pandas as pd
 import io
+import time
+import queue
+from contextlib import contextmanager
+from pathlib import Path
 import warnings
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from dotenv import load_dotenv
-from office365.runtime.auth.user_credential import UserCredential
-from office365.sharepoint.client_context import ClientContext
+import armazenamento
+import cache_ingestao
+import leitor_excel
 warnings.filterwarnings('ignore')
 
 # 1. Configurações do OneDrive e Sharepoint a partir do .env
@@ -39,10 +45,42 @@ ARQUIVOS_ONEDRIVE = {
 ONEDRIVE_SITE = os.getenv("SITE_ONEDRIVE_PAI")
 # SHAREPOINT_SITE = os.getenv("SITE_SHAREPOINT_PAI")
 
-def conectar_onedrive():
+# 3. Configuração do download (MODO_DOWNLOAD = "concorrente" ou "sequencial")
+MODO_DOWNLOAD = os.getenv("MODO_DOWNLOAD", "concorrente")
+MAX_DOWNLOADS_SIMULTANEOS = int(os.getenv("MAX_DOWNLOADS_SIMULTANEOS", "3"))
+MAX_PROCESSOS_LEITURA = int(os.getenv("MAX_PROCESSOS_LEITURA", "3"))
+TENTATIVAS_DOWNLOAD = int(os.getenv("TENTATIVAS_DOWNLOAD", "3"))
+ESPERA_BASE_DOWNLOAD = float(os.getenv("ESPERA_BASE_DOWNLOAD", "2"))
+USAR_CACHE_INGESTAO = os.getenv("USAR_CACHE_INGESTAO", "1") == "1"
+
+# 4. Leitura do Excel (LEITOR_EXCEL = "streaming" ou "pandas")
+LEITOR_EXCEL = os.getenv("LEITOR_EXCEL", "streaming")
+TAMANHO_BLOCO_EXCEL = int(os.getenv("TAMANHO_BLOCO_EXCEL", str(leitor_excel.TAMANHO_BLOCO_EXCEL)))
+
+COLUNAS_INTEIROS = ['ID PREFIXO', 'ID MUNICIPIO', 'ID EFETIVIDADE', 'ID TIPO SERVICO COMERCIAL', 
+                    'ID SUBTIPO SERVICO COMERCIAL', 'ID MOTIVO RECLAMACAO EMERGENCIA', 'ID CAUSA',
+                    'ID PLACA', 'ID TIPO EQUIPE', 'ID PERFIL', 'ID TIPO']
+
+# Tipos de destino aplicados bloco a bloco pelo leitor streaming
+TIPOS_COLUNAS = {
+    **{coluna: "int64" for coluna in COLUNAS_INTEIROS},
+    **{coluna: "datetime64[ns]" for coluna in ['DATA_SOLICITACAO', 'DATA_ABERTURA', 'INICIO_DESLOCAMENTO',
+                                                'FIM_DESLOCAMENTO', 'INICIO_EXECUCAO', 'FIM_EXECUCAO']}
+}
+
+def criar_contexto():
+    # Import local: permite usar as funções de leitura sem o office365 instalado
+    from office365.runtime.auth.user_credential import UserCredential
+    from office365.sharepoint.client_context import ClientContext
+
+    credenciais = UserCredential(USUARIO, SENHA)
+    return ClientContext(ONEDRIVE_SITE).with_credentials(credenciais)
+
+def conectar_onedrive(fabrica_contexto=None):
+    # fabrica_contexto: função que devolve um ClientContext (padrão: criar_contexto, com as credenciais do .env);
+    # os testes passam um contexto falso por aqui
     try:
-        credenciais = UserCredential(USUARIO, SENHA)
-        ctxOD = ClientContext(ONEDRIVE_SITE).with_credentials(credenciais)
+        ctxOD = (fabrica_contexto or criar_contexto)()
         ctxOD.load(ctxOD.web)  # Carrega informações do site
         ctxOD.execute_query()  # Executa a consulta
         print("Conexão estabelecida com o OneDrive")
@@ -51,54 +89,182 @@ def conectar_onedrive():
         print(f"Erro ao baixar arquivo do OneDrive: {e}")
         return None
 
-def baixar_arquivo_onedrive(ctxOD, server_relative_url_OD, nome_arquivo):
-    try:
-        arquivoOD = ctxOD.web.get_file_by_server_relative_path(server_relative_url_OD)
-        responseOD = arquivoOD.open_binary(ctxOD, server_relative_url_OD)
+class ContextosOneDrive:
+    # O ClientContext não é thread-safe (guarda as consultas pendentes numa fila própria), então cada download
+    # simultâneo usa um contexto só seu: a thread pega um contexto livre ou abre outro com "conectar" e o
+    # devolve ao terminar. No máximo um contexto por download simultâneo.
 
+    def __init__(self, conectar=conectar_onedrive, inicial=None):
+        self._conectar = conectar
+        self._livres = queue.SimpleQueue()
+        if inicial is not None:
+            self._livres.put(inicial)
+
+    @contextmanager
+    def contexto(self):
         try:
-            df = pd.read_excel(io.BytesIO(responseOD.content), engine='openpyxl')
-            print("Arquivo lido com sucesso!")
-        except Exception as e:
-            print("Erro ao ler o arquivo Excel:", e)
-            return None
+            ctxOD = self._livres.get_nowait()
+        except queue.Empty:
+            ctxOD = self._conectar()
+            if ctxOD is None:
+                raise ConnectionError("Não foi possível abrir outra conexão com o OneDrive")
+        try:
+            yield ctxOD
+        finally:
+            self._livres.put(ctxOD)
 
-        # Escolher as colunas dependendo do arquivo
-        if nome_arquivo == "oper_comercial":
-            colunas = ARQUIVOS_ONEDRIVE[nome_arquivo].get("colunas_comercial", [])
-        elif nome_arquivo == "oper_emergencial":
-            colunas = ARQUIVOS_ONEDRIVE[nome_arquivo].get("colunas_emergencial", [])
-        elif nome_arquivo == "IDs":
-            colunas = ARQUIVOS_ONEDRIVE[nome_arquivo].get("colunas_IDs", [])
-        else:
-            colunas = []
+def baixar_bytes_onedrive(ctxOD, server_relative_url_OD):
+    arquivoOD = ctxOD.web.get_file_by_server_relative_path(server_relative_url_OD)
+    responseOD = arquivoOD.open_binary(ctxOD, server_relative_url_OD)
+    return responseOD.content
+
+def colunas_do_arquivo(nome_arquivo):
+    # Escolher as colunas dependendo do arquivo
+    if nome_arquivo == "oper_comercial":
+        return ARQUIVOS_ONEDRIVE[nome_arquivo].get("colunas_comercial", [])
+    elif nome_arquivo == "oper_emergencial":
+        return ARQUIVOS_ONEDRIVE[nome_arquivo].get("colunas_emergencial", [])
+    elif nome_arquivo == "IDs":
+        return ARQUIVOS_ONEDRIVE[nome_arquivo].get("colunas_IDs", [])
+    return []
+
+def tratar_colunas(df, nome_arquivo):
+    # Adicionar "- GO" SOMENTE para cidades específicas na coluna MUNICIPIO
+    if nome_arquivo == "oper_comercial" and "MUNICIPIO" in df.columns:
+        cidades_para_modificar = ["CALDAS NOVAS", "CATALAO", "ITUMBIARA", "MORRINHOS", "RIO VERDE", "PIRES DO RIO"]
+        df["MUNICIPIO"] = df["MUNICIPIO"].apply(lambda x: x + " - GO" if x in cidades_para_modificar else x)
+
+    if nome_arquivo == "oper_emergencial" and "MUNICIPIO" in df.columns:
+        cidades_para_modificar = ["CALDAS NOVAS", "CATALAO", "ITUMBIARA", "MORRINHOS", "RIO VERDE", "PIRES DO RIO"]
+        df["MUNICIPIO"] = df["MUNICIPIO"].apply(lambda x: x + " - GO" if x in cidades_para_modificar else x)
+
+    # Transformar as colunas para o tipo inteiro
+    for coluna in COLUNAS_INTEIROS:
+        if coluna in df.columns:
+            df[coluna] = pd.to_numeric(df[coluna], errors='coerce').fillna(0).astype(int)
 
-        # Seleciona as colunas do DataFrame
-        df = df[colunas]
+    return df
 
-        # Adicionar "- GO" SOMENTE para cidades específicas na coluna MUNICIPIO
-        if nome_arquivo == "oper_comercial" and "MUNICIPIO" in df.columns:
-            cidades_para_modificar = ["CALDAS NOVAS", "CATALAO", "ITUMBIARA", "MORRINHOS", "RIO VERDE", "PIRES DO RIO"]
-            df["MUNICIPIO"] = df["MUNICIPIO"].apply(lambda x: x + " - GO" if x in cidades_para_modificar else x)
+def ler_excel_onedrive(conteudo, nome_arquivo):
+    try:
+        df = pd.read_excel(io.BytesIO(conteudo), engine='openpyxl')
+        print("Arquivo lido com sucesso!")
+    except Exception as e:
+        print("Erro ao ler o arquivo Excel:", e)
+        return None
 
-        if nome_arquivo == "oper_emergencial" and "MUNICIPIO" in df.columns:
-            cidades_para_modificar = ["CALDAS NOVAS", "CATALAO", "ITUMBIARA", "MORRINHOS", "RIO VERDE", "PIRES DO RIO"]
-            df["MUNICIPIO"] = df["MUNICIPIO"].apply(lambda x: x + " - GO" if x in cidades_para_modificar else x)
+    # Seleciona as colunas do DataFrame
+    df = df[colunas_do_arquivo(nome_arquivo)]
+    return tratar_colunas(df, nome_arquivo)
 
-        # Transformar as colunas para o tipo inteiro
-        colunas_inteiros = ['ID PREFIXO', 'ID MUNICIPIO', 'ID EFETIVIDADE', 'ID TIPO SERVICO COMERCIAL', 
-                            'ID SUBTIPO SERVICO COMERCIAL', 'ID MOTIVO RECLAMACAO EMERGENCIA', 'ID CAUSA',
-                            'ID PLACA', 'ID TIPO EQUIPE', 'ID PERFIL', 'ID TIPO']
+def ler_excel_streaming(conteudo, nome_arquivo, tamanho_bloco=TAMANHO_BLOCO_EXCEL):
+    # Gera blocos já tratados, contendo só as colunas configuradas e com os tipos de TIPOS_COLUNAS
+    colunas = colunas_do_arquivo(nome_arquivo)
+    tipos = {c: TIPOS_COLUNAS[c] for c in colunas if c in TIPOS_COLUNAS}
+    for bloco in leitor_excel.ler_excel_em_blocos(conteudo, colunas, tipos, tamanho_bloco):
+        yield tratar_colunas(bloco, nome_arquivo)
 
-        for coluna in colunas_inteiros:
-            if coluna in df.columns:
-                df[coluna] = pd.to_numeric(df[coluna], errors='coerce').fillna(0).astype(int)
+def processar_planilha(conteudo, nome_arquivo, caminho_saida=None):
+    # Converte a planilha para o intermediário local (CSV ou Parquet, conforme FORMATO_INTERMEDIARIO)
+    # e devolve o número de linhas gravadas (None em caso de erro)
+    caminho_saida = caminho_saida or armazenamento.caminho_intermediario(nome_arquivo)
+    if LEITOR_EXCEL == "pandas":
+        df = ler_excel_onedrive(conteudo, nome_arquivo)
+        if df is None:
+            return None
+        armazenamento.salvar_intermediario(df, Path(caminho_saida).stem, Path(caminho_saida).parent)
+        return len(df)
+
+    try:
+        with armazenamento.GravadorIntermediario(Path(caminho_saida).stem, Path(caminho_saida).parent) as gravador:
+            for bloco in ler_excel_streaming(conteudo, nome_arquivo):
+                gravador.escrever(bloco)
+            gravador.fechar(colunas_vazio=colunas_do_arquivo(nome_arquivo))
+        print("Arquivo lido com sucesso!")
+        return gravador.linhas
+    except Exception as e:
+        print("Erro ao ler o arquivo Excel:", e)
+        return None
 
-        return df
+def baixar_arquivo_onedrive(ctxOD, server_relative_url_OD, nome_arquivo):
+    try:
+        conteudo = baixar_bytes_onedrive(ctxOD, server_relative_url_OD)
+        return ler_excel_onedrive(conteudo, nome_arquivo)
     except Exception as e:
         print("Erro ao baixar arquivo do OneDrive:", e)
         return None
 
+def baixar_com_tentativas(ctxOD, server_relative_url_OD, nome_arquivo, tentativas=TENTATIVAS_DOWNLOAD,
+                          espera_base=ESPERA_BASE_DOWNLOAD):
+    # Backoff exponencial: espera_base, 2*espera_base, 4*espera_base...
+    for tentativa in range(1, tentativas + 1):
+        try:
+            return baixar_bytes_onedrive(ctxOD, server_relative_url_OD)
+        except Exception as e:
+            if tentativa == tentativas:
+                raise
+            espera = espera_base * 2 ** (tentativa - 1)
+            print(f"Falha ao baixar {nome_arquivo} (tentativa {tentativa}/{tentativas}): {e}. Nova tentativa em {espera:.1f}s")
+            time.sleep(espera)
+
+def baixar_se_alterado(ctxOD, nome_arquivo, config, manifesto, pendentes, tentativas=TENTATIVAS_DOWNLOAD,
+                       espera_base=ESPERA_BASE_DOWNLOAD):
+    # Devolve os bytes da planilha ou cache_ingestao.INALTERADO quando ela não mudou.
+    # Os metadados e o hash calculados ficam em "pendentes" para serem gravados no manifesto.
+    url = config["server_relative_url_OD"]
+    if manifesto is None:
+        return baixar_com_tentativas(ctxOD, url, nome_arquivo, tentativas, espera_base)
+
+    metadados = cache_ingestao.obter_metadados_servidor(ctxOD, url)
+    pendentes[nome_arquivo] = {"metadados": metadados, "hash": None}
+    if cache_ingestao.esta_inalterado(manifesto, nome_arquivo, metadados):
+        print(f"{nome_arquivo} inalterado no servidor, usando cache local")
+        return cache_ingestao.INALTERADO
+
+    conteudo = baixar_com_tentativas(ctxOD, url, nome_arquivo, tentativas, espera_base)
+    hash_arquivo = cache_ingestao.hash_conteudo(conteudo)
+    pendentes[nome_arquivo]["hash"] = hash_arquivo
+    if cache_ingestao.esta_inalterado(manifesto, nome_arquivo, metadados, hash_arquivo):
+        print(f"{nome_arquivo} com conteúdo idêntico ao cache, leitura ignorada")
+        return cache_ingestao.INALTERADO
+    return conteudo
+
+def baixar_arquivos_concorrente(ctxOD, arquivos=None, max_downloads=MAX_DOWNLOADS_SIMULTANEOS,
+                                max_processos=MAX_PROCESSOS_LEITURA, tentativas=TENTATIVAS_DOWNLOAD,
+                                espera_base=ESPERA_BASE_DOWNLOAD, usar_processos=True, manifesto=None, pendentes=None,
+                                conectar=conectar_onedrive):
+    # Downloads em threads (I/O) e leitura do Excel em um pool de processos (CPU).
+    # Cada leitura é enviada ao pool assim que o seu download termina e grava o intermediário "<nome>";
+    # o resultado de cada arquivo é o número de linhas gravadas.
+    # ctxOD atende o primeiro download; os simultâneos abrem as próprias conexões com "conectar".
+    arquivos = ARQUIVOS_ONEDRIVE if arquivos is None else arquivos
+    pendentes = {} if pendentes is None else pendentes
+    contextos = ContextosOneDrive(conectar, ctxOD)
+    pool_leitura = ProcessPoolExecutor if usar_processos else ThreadPoolExecutor
+    resultados = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, max_downloads)) as pool_download, \
+         pool_leitura(max_workers=max(1, max_processos)) as pool_excel:
+
+        def baixar_e_enviar(nome, config):
+            with contextos.contexto() as ctxThread:
+                conteudo = baixar_se_alterado(ctxThread, nome, config, manifesto, pendentes, tentativas, espera_base)
+            if conteudo is cache_ingestao.INALTERADO:
+                return None
+            return pool_excel.submit(processar_planilha, conteudo, nome)
+
+        downloads = {nome: pool_download.submit(baixar_e_enviar, nome, config) for nome, config in arquivos.items()}
+
+        for nome, download in downloads.items():
+            try:
+                leitura = download.result()
+                resultados[nome] = cache_ingestao.INALTERADO if leitura is None else leitura.result()
+            except Exception as e:
+                print(f"Erro ao baixar arquivo do OneDrive ({nome}):", e)
+                resultados[nome] = None
+
+    return resultados
+
 def main():
     print("Iniciando Conexão com o OneDrive...")
     # Conectar ao OneDrive
@@ -107,21 +273,50 @@ def main():
         return
     
     resultados = {}
-    
-    for nomeOD, configOD in ARQUIVOS_ONEDRIVE.items():
-        
-        dfOD = baixar_arquivo_onedrive(ctxOD, configOD["server_relative_url_OD"], nomeOD)
-        
-        if dfOD is not None:
-            resultados[nomeOD] = dfOD
-            
-            # Salvar localmente como backup
-            dfOD.to_csv(f"{nomeOD}.csv", index=False, encoding='utf-8-sig', sep=';')
+    manifesto = cache_ingestao.carregar_manifesto() if USAR_CACHE_INGESTAO else None
+    pendentes = {}
+
+    if MODO_DOWNLOAD == "sequencial":
+        linhas_por_arquivo = {}
+        for nomeOD, configOD in ARQUIVOS_ONEDRIVE.items():
+            try:
+                conteudo = baixar_se_alterado(ctxOD, nomeOD, configOD, manifesto, pendentes)
+            except Exception as e:
+                print("Erro ao baixar arquivo do OneDrive:", e)
+                linhas_por_arquivo[nomeOD] = None
+                continue
+            if conteudo is cache_ingestao.INALTERADO:
+                linhas_por_arquivo[nomeOD] = conteudo
+            else:
+                linhas_por_arquivo[nomeOD] = processar_planilha(conteudo, nomeOD)
+    else:
+        linhas_por_arquivo = baixar_arquivos_concorrente(ctxOD, manifesto=manifesto, pendentes=pendentes)
+
+    alteradas, inalteradas = [], []
+    for nomeOD, linhasOD in linhas_por_arquivo.items():
+        caminho_saida = armazenamento.caminho_intermediario(nomeOD)
+
+        if linhasOD is cache_ingestao.INALTERADO:
+            # Servido do cache: sem download, sem read_excel e sem reescrever o CSV
+            cache_ingestao.restaurar(manifesto, nomeOD, caminho_saida, pendentes[nomeOD]["metadados"])
+            inalteradas.append(nomeOD)
+        elif linhasOD is not None:
+            # O arquivo local (backup) já foi gravado por processar_planilha
+            resultados[nomeOD] = linhasOD
+            alteradas.append(nomeOD)
+            if manifesto is not None:
+                cache_ingestao.registrar(manifesto, nomeOD, pendentes[nomeOD]["metadados"],
+                                         pendentes[nomeOD]["hash"], caminho_saida)
         else:
             print("Falha ao processar")
-    
-    if resultados:
-        print("Processamento concluído com sucesso!")
+
+    if manifesto is not None:
+        cache_ingestao.salvar_manifesto(manifesto)
+    # Informa às etapas seguintes quais fontes realmente mudaram nesta execução
+    cache_ingestao.salvar_fontes_alteradas(alteradas, inalteradas)
+
+    if resultados or inalteradas:
+        print(f"Processamento concluído com sucesso! Alteradas: {alteradas} | Inalteradas: {inalteradas}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -3,114 +3,139 @@ import os
 from dotenv import load_dotenv
 from pathlib import Path
 from datetime import timedelta
+import armazenamento
+import dimensoes
+import agregacoes
+import etl_incremental
+import normalizacao_datas
+import etl_blocos
+import motor_sql
 
 # 1. Carregar configurações
 load_dotenv('credenciais_arquivos.env')
 DIRETORIO_SAIDA = Path(os.getenv("DIRETORIO_SAIDA"))
 
+# (coluna, dimensão, coluna de ID, junção): "inner" descarta linhas sem ID, "left" mantém com ID nulo
+JUNCOES = [
+    ("PREFIXO", "PREFIXO", "ID PREFIXO", "inner"),
+    ("MUNICIPIO", "MUNICIPIO", "ID MUNICIPIO", "inner"),
+    ("EFETIVIDADE", "EFETIVIDADE", "ID EFETIVIDADE", "inner"),
+    ("CAUSA", "CAUSA", "ID CAUSA", "left"),
+    ("MOTIVO_RECLAMACAO", "MOTIVO_RECLAMACAO", "ID MOTIVO RECLAMACAO EMERGENCIA", "inner")
+]
+
+COLUNAS_DATA = ['DATA_ABERTURA', 'INICIO_DESLOCAMENTO', 'FIM_DESLOCAMENTO', 'INICIO_EXECUCAO', 'FIM_EXECUCAO']
+
+# Colunas do oper_emergencial_tratado
+COLUNAS_SAIDA = ['PREFIXO', 'OS', 'MUNICIPIO', 'CAUSA', 'MOTIVO_RECLAMACAO', 'EFETIVIDADE', 'DATA_ABERTURA',
+                 'INICIO_DESLOCAMENTO', 'FIM_DESLOCAMENTO', 'INICIO_EXECUCAO', 'FIM_EXECUCAO',
+                 'ID PREFIXO', 'ID MUNICIPIO', 'ID EFETIVIDADE', 'ID CAUSA',
+                 'ID MOTIVO RECLAMACAO EMERGENCIA','QTD OS POR PREFIXO(MES)', 'QTD OS POR PREFIXO(DIA)',
+                 'EFETIVIDADE POR CIDADE (MES)','EFETIVIDADE POR CIDADE (DIA)', 'TEMPO_RESPOSTA'] + agregacoes.colunas_extras()
+
 def carregar_IDs():
-    arquivo = DIRETORIO_SAIDA / "IDs.csv"
-    if arquivo.exists():
-        df = pd.read_csv(arquivo, sep=";", encoding_errors='ignore')
-        return df
-    return None
+    return armazenamento.carregar_intermediario("IDs")
 
-def carregar_emergencial():
-    arquivo = DIRETORIO_SAIDA / "oper_emergencial.csv"
-    if arquivo.exists():
-        df = pd.read_csv(arquivo, sep=";", encoding_errors='ignore')
+def tratar_linhas(df, registro, average_diff=None):
+    # Tratamento linha a linha (datas, PREFIXO, OS, dimensões e TEMPO_RESPOSTA); no modo incremental
+    # recebe só as ocorrências novas/alteradas e a média do intervalo mantida no estado
 
-        # 1. Converter colunas para datetime
-        date_cols = ['DATA_ABERTURA', 'INICIO_DESLOCAMENTO', 'FIM_DESLOCAMENTO', 'INICIO_EXECUCAO', 'FIM_EXECUCAO']
-        for col in date_cols: df[date_cols] = df[date_cols].apply(pd.to_datetime, errors='coerce')
+    # 1. Converter colunas para datetime (uma única vez por coluna)
+    df = normalizacao_datas.normalizar_datas(df, COLUNAS_DATA, "oper_emergencial")
 
-        # 2. Tratamento de datas nulas
+    # 2. Tratamento de datas nulas
+    if average_diff is None:
         valid_diff = (df['INICIO_DESLOCAMENTO'] - df['DATA_ABERTURA']).dropna()
         average_diff = valid_diff.mean()
-        
-        df.loc[df['INICIO_DESLOCAMENTO'].isna(), 'INICIO_DESLOCAMENTO'] = df['DATA_ABERTURA'] + average_diff
-        df.loc[df['FIM_DESLOCAMENTO'].isna(), 'FIM_DESLOCAMENTO'] = df['INICIO_DESLOCAMENTO'] + timedelta(hours=1)
-        df.loc[df['INICIO_EXECUCAO'].isna(), 'INICIO_EXECUCAO'] = df['FIM_DESLOCAMENTO']
-        df.loc[df['FIM_EXECUCAO'].isna(), 'FIM_EXECUCAO'] = df['INICIO_EXECUCAO'] + timedelta(hours=1)
-        
-        # 3. Garantir FIM > INICIO
-        df['FIM_DESLOCAMENTO'] = df[['INICIO_DESLOCAMENTO', 'FIM_DESLOCAMENTO']].max(axis=1)
-        df['FIM_EXECUCAO'] = df[['INICIO_EXECUCAO', 'FIM_EXECUCAO']].max(axis=1)
-
-        # 4. Tratamento do PREFIXO
-        if 'PREFIXO' in df.columns:
-            df['PREFIXO'] = df['PREFIXO'].str.slice(0, 3).replace('PIR', 'PRI') + df['PREFIXO'].str.slice(3)
-        
-        # 5. Tratamento da coluna OS
-        if 'OCORRENCIA' in df.columns:
-            df['OS'] = pd.to_numeric(
-                df['OCORRENCIA'].astype(str).str.split('-').str[0].str.strip(),
-                errors='coerce'
-            ).fillna(0).astype(int)
-            df.drop(columns=['OCORRENCIA'], inplace=True)
-
-        # 6. Criar colunas de agrupamento ANTES de usá-las
-        df['ANO_MES'] = df['INICIO_DESLOCAMENTO'].dt.to_period('M')
-        df['DATA_DIA'] = df['INICIO_DESLOCAMENTO'].dt.date
-
-        # 7. Cálculo das quantidades de OS
-        df['QTD OS POR PREFIXO(MES)'] = df.groupby(['PREFIXO', 'ANO_MES'])['OS'].transform('nunique').astype(int)
-        df['QTD OS POR PREFIXO(DIA)'] = df.groupby(['PREFIXO', 'DATA_DIA'])['OS'].transform('nunique').astype(int)
-
-        # 8. Cálculo de efetividade (AGORA com ANO_MES já criado)
-        if all(col in df.columns for col in ['MUNICIPIO', 'EFETIVIDADE', 'OS']):
-            df['EFETIVIDADE'] = df['EFETIVIDADE'].fillna('EFETIVA')
-            
-            efetividade_mes = df[df['EFETIVIDADE'] == 'NÃO EFETIVA'].groupby(['MUNICIPIO', 'ANO_MES'])['OS'].nunique()
-            df['EFETIVIDADE POR CIDADE (MES)'] = df.set_index(['MUNICIPIO', 'ANO_MES']).index.map(efetividade_mes).fillna(0).astype(int)
-            
-            efetividade_dia = df[df['EFETIVIDADE'] == 'NÃO EFETIVA'].groupby(['MUNICIPIO', 'DATA_DIA'])['OS'].nunique()
-            df['EFETIVIDADE POR CIDADE (DIA)'] = df.set_index(['MUNICIPIO', 'DATA_DIA']).index.map(efetividade_dia).fillna(0).astype(int)
-
-        # Calcular a diferença de tempo entre 'INICIO_DESLOCAMENTO' e 'DATA_SOLICITACAO' retorna em minutos
-            df['TEMPO_RESPOSTA'] = (df['INICIO_DESLOCAMENTO'] - df['DATA_ABERTURA']).dt.total_seconds() / 60
-            df['TEMPO_RESPOSTA'] = pd.to_numeric(df['TEMPO_RESPOSTA'], errors='coerce').fillna(0).astype(int)
-        
-        # 10. Remover colunas temporárias
-        df.drop(columns=['ANO_MES', 'DATA_DIA'], inplace=True, errors='ignore')
-        
-        return df
+
+    df.loc[df['INICIO_DESLOCAMENTO'].isna(), 'INICIO_DESLOCAMENTO'] = df['DATA_ABERTURA'] + average_diff
+    df.loc[df['FIM_DESLOCAMENTO'].isna(), 'FIM_DESLOCAMENTO'] = df['INICIO_DESLOCAMENTO'] + timedelta(hours=1)
+    df.loc[df['INICIO_EXECUCAO'].isna(), 'INICIO_EXECUCAO'] = df['FIM_DESLOCAMENTO']
+    df.loc[df['FIM_EXECUCAO'].isna(), 'FIM_EXECUCAO'] = df['INICIO_EXECUCAO'] + timedelta(hours=1)
+
+    # 3. Garantir FIM > INICIO
+    df['FIM_DESLOCAMENTO'] = df[['INICIO_DESLOCAMENTO', 'FIM_DESLOCAMENTO']].max(axis=1)
+    df['FIM_EXECUCAO'] = df[['INICIO_EXECUCAO', 'FIM_EXECUCAO']].max(axis=1)
+
+    # 4. Tratamento do PREFIXO
+    if 'PREFIXO' in df.columns:
+        df['PREFIXO'] = df['PREFIXO'].str.slice(0, 3).replace('PIR', 'PRI') + df['PREFIXO'].str.slice(3)
+
+    # 5. Tratamento da coluna OS
+    if 'OCORRENCIA' in df.columns:
+        df['OS'] = pd.to_numeric(
+            df['OCORRENCIA'].astype(str).str.split('-').str[0].str.strip(),
+            errors='coerce'
+        ).fillna(0).astype(int)
+        df.drop(columns=['OCORRENCIA'], inplace=True)
+
+    # Nulos de efetividade contam como efetiva; depois disso as dimensões viram Categorical
+    if 'EFETIVIDADE' in df.columns:
+        df['EFETIVIDADE'] = df['EFETIVIDADE'].fillna('EFETIVA')
+    df = registro.categorizar(df)
+
+    # Calcular a diferença de tempo entre 'INICIO_DESLOCAMENTO' e 'DATA_SOLICITACAO' retorna em minutos
+    df['TEMPO_RESPOSTA'] = (df['INICIO_DESLOCAMENTO'] - df['DATA_ABERTURA']).dt.total_seconds() / 60
+    df['TEMPO_RESPOSTA'] = pd.to_numeric(df['TEMPO_RESPOSTA'], errors='coerce').fillna(0).astype(int)
+    return df
+
+def carregar_emergencial(df=None, registro=None):
+    # Sem DataFrame em memória (execução como script), lê o intermediário gravado pelo in1
+    registro = dimensoes.carregar_registro() if registro is None else registro
+    if df is None:
+        df = armazenamento.carregar_intermediario("oper_emergencial")
+    if df is not None:
+        # Modo incremental: só as ocorrências novas ou alteradas são tratadas e só os contadores afetados são refeitos
+        if etl_incremental.ETL_INCREMENTAL:
+            df = etl_incremental.processar(df, "emergencial", registro, tratar_linhas)
+        else:
+            df = tratar_linhas(df, registro)
+
+            # 6-8. QTD OS POR PREFIXO(MES/DIA) e EFETIVIDADE POR CIDADE (MES/DIA) em uma única passada
+            df = agregacoes.calcular_contadores(df, "emergencial",
+                                                distintos=motor_sql.distintos_por_chave if motor_sql.ATIVO else None)
+        return converter_contadores(df)
     return None
 
+def converter_contadores(df):
+    df['QTD OS POR PREFIXO(MES)'] = df['QTD OS POR PREFIXO(MES)'].astype(int)
+    df['QTD OS POR PREFIXO(DIA)'] = df['QTD OS POR PREFIXO(DIA)'].astype(int)
+    return df
+
+def selecionar_colunas(df_resultado):
+    # Selecionar apenas as colunas desejadas
+    df_resultado = df_resultado[COLUNAS_SAIDA].copy()
+    # Converte ID EFETIVIDADE para inteiro no df_resultado
+    df_resultado['ID EFETIVIDADE'] = pd.to_numeric(df_resultado['ID EFETIVIDADE'], errors='coerce').fillna(0).astype(int)
+    return df_resultado
+
 # Realiza a junção e salva
-def realizar_juncao():
-    oper_emergencial = carregar_emergencial()
-    IDs = carregar_IDs()
+def realizar_juncao(oper_emergencial=None, IDs=None):
+    IDs = carregar_IDs() if IDs is None else IDs
+    registro = dimensoes.carregar_registro(IDs)
+    if etl_blocos.ETL_EM_BLOCOS and oper_emergencial is None and IDs is not None:
+        # Modo em blocos: lê, trata e grava o oper_emergencial_tratado sem carregar o arquivo inteiro
+        etl_blocos.processar("oper_emergencial", "oper_emergencial_tratado", "emergencial", registro, tratar_linhas,
+                             JUNCOES, lambda df: selecionar_colunas(converter_contadores(df)), COLUNAS_SAIDA)
+        print("Arquivo Salvo")
+        return None
+    oper_emergencial = carregar_emergencial(oper_emergencial, registro)
 
     if oper_emergencial is not None and IDs is not None:
-        # Realiza a junção e adiciona a coluna "ID PREFIXO"
-        df_resultado = oper_emergencial \
-            .merge(IDs[['PREFIXO', 'ID PREFIXO']], on='PREFIXO', how='inner') \
-            .merge(IDs[['MUNICIPIO', 'ID MUNICIPIO']], on='MUNICIPIO', how='inner') \
-            .merge(IDs[['EFETIVIDADE', 'ID EFETIVIDADE']], on='EFETIVIDADE', how='inner') \
-            .merge(IDs[['CAUSA', 'ID CAUSA']], on='CAUSA', how='left') \
-            .merge(IDs[['MOTIVO RECLAMACAO EMERGENCIA', 'ID MOTIVO RECLAMACAO EMERGENCIA']], left_on='MOTIVO_RECLAMACAO', right_on='MOTIVO RECLAMACAO EMERGENCIA', how='inner')
-
-        # Selecionar apenas as colunas desejadas
-        df_resultado = df_resultado[['PREFIXO', 'OS', 'MUNICIPIO', 'CAUSA', 'MOTIVO_RECLAMACAO', 'EFETIVIDADE', 'DATA_ABERTURA',
-                                     'INICIO_DESLOCAMENTO', 'FIM_DESLOCAMENTO', 'INICIO_EXECUCAO', 'FIM_EXECUCAO',
-                                     'ID PREFIXO', 'ID MUNICIPIO', 'ID EFETIVIDADE', 'ID CAUSA',
-                                     'ID MOTIVO RECLAMACAO EMERGENCIA','QTD OS POR PREFIXO(MES)', 'QTD OS POR PREFIXO(DIA)',
-                                     'EFETIVIDADE POR CIDADE (MES)','EFETIVIDADE POR CIDADE (DIA)', 'TEMPO_RESPOSTA']]
-        # print(df_resultado.dtypes)
-
-        # Converte ID EFETIVIDADE para inteiro no df_resultado
-        df_resultado['ID EFETIVIDADE'] = pd.to_numeric(df_resultado['ID EFETIVIDADE'], errors='coerce').fillna(0).astype(int)
-        # Converte DATA_ABERTURA e INICIO_DESLOCAMENTO para datetime no df_resultado
-        colunas_data = ['DATA_ABERTURA', 'INICIO_DESLOCAMENTO', 'FIM_DESLOCAMENTO', 'INICIO_EXECUCAO', 'FIM_EXECUCAO']
-        for col in colunas_data: df_resultado[col] = pd.to_datetime(df_resultado[col], errors='coerce')
-
-        # Salvar a versão atualizada no CSV
-        arquivo_saida_csv = DIRETORIO_SAIDA / "oper_emergencial.csv"
-        df_resultado.to_csv(arquivo_saida_csv, index=False, sep=";", encoding="utf-8-sig")
+        # Atribui os IDs (PREFIXO, MUNICIPIO, ...) pelos mapas do registro, numa única passada
+        df_resultado = registro.atribuir_ids(oper_emergencial, JUNCOES, "oper_emergencial")
+
+        df_resultado = selecionar_colunas(df_resultado)
+
+        # Salvar a versão atualizada (CSV ou Parquet, conforme FORMATO_INTERMEDIARIO)
+        armazenamento.salvar_intermediario(df_resultado, "oper_emergencial_tratado")
         print("Arquivo Salvo")
+        # Com a unificação no DuckDB o in4 lê o Parquet gravado: o DataFrame não fica em memória no executor
+        return None if motor_sql.unificacao_em_sql() else df_resultado
     else:
         print("Erro ao carregar os dados, junção não realizada.")
+        return None
 
 # Chamar a função para realizar a junção e salvar os arquivos
-realizar_juncao()
\ No newline at end of file
+if __name__ == "__main__":
+    realizar_juncao()
\ No newline at end of file
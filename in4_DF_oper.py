@@ -2,99 +2,183 @@ import pandas as pd
 import os
 from dotenv import load_dotenv
 from pathlib import Path
+import armazenamento
+import dimensoes
+import agregacoes
+import normalizacao_datas
+import etl_blocos
+import particoes_oper
+import motor_sql
+from contextlib import nullcontext
 
 load_dotenv('credenciais_arquivos.env')
 DIRETORIO_SAIDA = Path(os.getenv("DIRETORIO_SAIDA"))
 
-def carregar_comercial():
-    caminho = DIRETORIO_SAIDA / "oper_comercial.csv"
-    if not caminho.exists():
+COLUNAS_COMERCIAL = ["PREFIXO", "SS_NUMERO", "MUNICIPIO", "TIPO_SERVICO", "SUBTIPO_SERVICO", "EFETIVIDADE_VISITA", "DATA_SOLICITACAO",
+                     "INICIO_DESLOCAMENTO", "FIM_DESLOCAMENTO", "INICIO_EXECUCAO", "FIM_EXECUCAO", "ID PREFIXO", "ID MUNICIPIO", "ID EFETIVIDADE",
+                     "ID TIPO SERVICO COMERCIAL", "ID SUBTIPO SERVICO COMERCIAL", "QTD OS POR PREFIXO(MES)", "QTD OS POR PREFIXO(DIA)",
+                     "EFETIVIDADE POR CIDADE (MES)", "EFETIVIDADE POR CIDADE (DIA)", "TEMPO_RESPOSTA"] + agregacoes.colunas_extras()
+
+COLUNAS_EMERGENCIAL = ["PREFIXO", "OS", "MUNICIPIO", "CAUSA", "MOTIVO_RECLAMACAO", "EFETIVIDADE", "DATA_ABERTURA",
+                       "INICIO_DESLOCAMENTO", "FIM_DESLOCAMENTO", "INICIO_EXECUCAO", "FIM_EXECUCAO", "ID PREFIXO", "ID MUNICIPIO", "ID EFETIVIDADE",
+                       "ID CAUSA", "ID MOTIVO RECLAMACAO EMERGENCIA", "QTD OS POR PREFIXO(MES)", "QTD OS POR PREFIXO(DIA)",
+                       "EFETIVIDADE POR CIDADE (MES)", "EFETIVIDADE POR CIDADE (DIA)", "TEMPO_RESPOSTA"] + agregacoes.colunas_extras()
+
+# Nome de cada coluna do arquivo tratado no dataframe_OPER
+RENOMEAR_COMERCIAL = {
+    "PREFIXO": "PREFIXO",
+    "SS_NUMERO": "OS",
+    "MUNICIPIO": "MUNICIPIO",
+    "TIPO_SERVICO": "TIPO OS",
+    "SUBTIPO_SERVICO": "SUB OS",
+    "EFETIVIDADE_VISITA": "EFETIVIDADE",
+    "DATA_SOLICITACAO": "DATA SOLICITACAO",
+    "INICIO_DESLOCAMENTO": "DATA INICIO DESLOCAMENTO",
+    "FIM_DESLOCAMENTO": "DATA FIM DESLOCAMENTO",
+    "INICIO_EXECUCAO": "DATA INICIO EXECUCAO",
+    "FIM_EXECUCAO": "DATA FIM EXECUCAO",
+    "ID PREFIXO": "ID PREFIXO",
+    "ID MUNICIPIO": "ID MUNICIPIO",
+    "ID EFETIVIDADE": "ID EFETIVIDADE",
+    "ID TIPO SERVICO COMERCIAL": "ID TIPO OS",
+    "ID SUBTIPO SERVICO COMERCIAL": "ID SUB OS",
+    "QTD OS POR PREFIXO(MES)": "QTD OS POR PREFIXO(MES)",
+    "QTD OS POR PREFIXO(DIA)": "QTD OS POR PREFIXO(DIA)",
+    "EFETIVIDADE POR CIDADE (MES)": "EFETIVIDADE POR CIDADE (MES)",
+    "EFETIVIDADE POR CIDADE (DIA)": "EFETIVIDADE POR CIDADE (DIA)",
+    "TEMPO_RESPOSTA": "TEMPO_RESPOSTA"
+}
+
+RENOMEAR_EMERGENCIAL = {
+    "PREFIXO": "PREFIXO",
+    "OS": "OS",
+    "MUNICIPIO": "MUNICIPIO",
+    "CAUSA": "TIPO OS",
+    "MOTIVO_RECLAMACAO": "SUB OS",
+    "EFETIVIDADE": "EFETIVIDADE",
+    "DATA_ABERTURA": "DATA SOLICITACAO",
+    "INICIO_DESLOCAMENTO": "DATA INICIO DESLOCAMENTO",
+    "FIM_DESLOCAMENTO": "DATA FIM DESLOCAMENTO",
+    "INICIO_EXECUCAO": "DATA INICIO EXECUCAO",
+    "FIM_EXECUCAO": "DATA FIM EXECUCAO",
+    "ID PREFIXO": "ID PREFIXO",
+    "ID MUNICIPIO": "ID MUNICIPIO",
+    "ID EFETIVIDADE": "ID EFETIVIDADE",
+    "ID CAUSA": "ID TIPO OS",
+    "ID MOTIVO RECLAMACAO EMERGENCIA": "ID SUB OS",
+    "QTD OS POR PREFIXO(MES)": "QTD OS POR PREFIXO(MES)",
+    "QTD OS POR PREFIXO(DIA)": "QTD OS POR PREFIXO(DIA)",
+    "EFETIVIDADE POR CIDADE (MES)": "EFETIVIDADE POR CIDADE (MES)",
+    "EFETIVIDADE POR CIDADE (DIA)": "EFETIVIDADE POR CIDADE (DIA)",
+    "TEMPO_RESPOSTA": "TEMPO_RESPOSTA"
+}
+
+COLUNAS_UNIFICADAS = ["PREFIXO", "OS", "MUNICIPIO", "TIPO OS", "SUB OS", "EFETIVIDADE", "DATA SOLICITACAO", "DATA INICIO DESLOCAMENTO", "DATA FIM DESLOCAMENTO",
+                      "DATA INICIO EXECUCAO", "DATA FIM EXECUCAO", "ID PREFIXO", "ID MUNICIPIO", "ID EFETIVIDADE", "ID TIPO OS", "ID SUB OS", "QTD OS POR PREFIXO(MES)",
+                      "QTD OS POR PREFIXO(DIA)", "EFETIVIDADE POR CIDADE (MES)", "EFETIVIDADE POR CIDADE (DIA)", "TEMPO_RESPOSTA", "STATUS"] \
+                     + agregacoes.colunas_extras()
+
+def carregar_comercial(df=None, registro=None):
+    # Leitura projetada: só as colunas usadas na unificação (dimensões mantidas como Categorical)
+    registro = dimensoes.carregar_registro() if registro is None else registro
+    if df is None:
+        df = armazenamento.carregar_intermediario("oper_comercial_tratado", colunas=COLUNAS_COMERCIAL, manter_categorias=True)
+    if df is None:
         return pd.DataFrame()
-    df = pd.read_csv(caminho, sep=";", encoding_errors='ignore')
+    df = df[COLUNAS_COMERCIAL].copy()
     df["STATUS"] = "COMERCIAL"
-    df = df.rename(columns={
-        "PREFIXO": "PREFIXO",
-        "SS_NUMERO": "OS",
-        "MUNICIPIO": "MUNICIPIO",
-        "TIPO_SERVICO": "TIPO OS",
-        "SUBTIPO_SERVICO": "SUB OS",
-        "EFETIVIDADE_VISITA": "EFETIVIDADE",
-        "DATA_SOLICITACAO": "DATA SOLICITACAO",
-        "INICIO_DESLOCAMENTO": "DATA INICIO DESLOCAMENTO",
-        "FIM_DESLOCAMENTO": "DATA FIM DESLOCAMENTO",
-        "INICIO_EXECUCAO": "DATA INICIO EXECUCAO",
-        "FIM_EXECUCAO": "DATA FIM EXECUCAO",
-        "ID PREFIXO": "ID PREFIXO",
-        "ID MUNICIPIO": "ID MUNICIPIO",
-        "ID EFETIVIDADE": "ID EFETIVIDADE",
-        "ID TIPO SERVICO COMERCIAL": "ID TIPO OS",
-        "ID SUBTIPO SERVICO COMERCIAL": "ID SUB OS",
-        "QTD OS POR PREFIXO(MES)": "QTD OS POR PREFIXO(MES)",
-        "QTD OS POR PREFIXO(DIA)": "QTD OS POR PREFIXO(DIA)",
-        "EFETIVIDADE POR CIDADE (MES)": "EFETIVIDADE POR CIDADE (MES)",
-        "EFETIVIDADE POR CIDADE (DIA)": "EFETIVIDADE POR CIDADE (DIA)",
-        "TEMPO_RESPOSTA": "TEMPO_RESPOSTA"
-    })
-    return df[["PREFIXO", "OS", "MUNICIPIO", "TIPO OS", "SUB OS", "EFETIVIDADE", "DATA SOLICITACAO", "DATA INICIO DESLOCAMENTO", "DATA FIM DESLOCAMENTO",
-               "DATA INICIO EXECUCAO", "DATA FIM EXECUCAO", "ID PREFIXO", "ID MUNICIPIO", "ID EFETIVIDADE", "ID TIPO OS", "ID SUB OS", "QTD OS POR PREFIXO(MES)",
-               "QTD OS POR PREFIXO(DIA)", "EFETIVIDADE POR CIDADE (MES)", "EFETIVIDADE POR CIDADE (DIA)", "TEMPO_RESPOSTA", "STATUS"]]
-
-def carregar_emergencial():
-    caminho = DIRETORIO_SAIDA / "oper_emergencial.csv"
-    if not caminho.exists():
+    df = df.rename(columns=RENOMEAR_COMERCIAL)
+    # TIPO OS, SUB OS e STATUS passam para as categorias comuns aos dois arquivos, para o concat manter Categorical
+    df = registro.categorizar(df)
+    return df[COLUNAS_UNIFICADAS]
+
+def carregar_emergencial(df=None, registro=None):
+    registro = dimensoes.carregar_registro() if registro is None else registro
+    if df is None:
+        df = armazenamento.carregar_intermediario("oper_emergencial_tratado", colunas=COLUNAS_EMERGENCIAL, manter_categorias=True)
+    if df is None:
         return pd.DataFrame()
-    df = pd.read_csv(caminho, sep=";", encoding_errors='ignore')
+    df = df[COLUNAS_EMERGENCIAL].copy()
     df["STATUS"] = "EMERGENCIAL"
-    df = df.rename(columns={
-        "PREFIXO": "PREFIXO",
-        "OS": "OS",
-        "MUNICIPIO": "MUNICIPIO",
-        "CAUSA": "TIPO OS",
-        "MOTIVO_RECLAMACAO": "SUB OS",
-        "EFETIVIDADE": "EFETIVIDADE",
-        "DATA_ABERTURA": "DATA SOLICITACAO",
-        "INICIO_DESLOCAMENTO": "DATA INICIO DESLOCAMENTO",
-        "FIM_DESLOCAMENTO": "DATA FIM DESLOCAMENTO",
-        "INICIO_EXECUCAO": "DATA INICIO EXECUCAO",
-        "FIM_EXECUCAO": "DATA FIM EXECUCAO",
-        "ID PREFIXO": "ID PREFIXO",
-        "ID MUNICIPIO": "ID MUNICIPIO",
-        "ID EFETIVIDADE": "ID EFETIVIDADE",
-        "ID CAUSA": "ID TIPO OS",
-        "ID MOTIVO RECLAMACAO EMERGENCIA": "ID SUB OS",
-        "QTD OS POR PREFIXO(MES)": "QTD OS POR PREFIXO(MES)",
-        "QTD OS POR PREFIXO(DIA)": "QTD OS POR PREFIXO(DIA)",
-        "EFETIVIDADE POR CIDADE (MES)": "EFETIVIDADE POR CIDADE (MES)",
-        "EFETIVIDADE POR CIDADE (DIA)": "EFETIVIDADE POR CIDADE (DIA)",
-        "TEMPO_RESPOSTA": "TEMPO_RESPOSTA"
-    })
-    return df[["PREFIXO", "OS", "MUNICIPIO", "TIPO OS", "SUB OS", "EFETIVIDADE", "DATA SOLICITACAO", "DATA INICIO DESLOCAMENTO", "DATA FIM DESLOCAMENTO",
-               "DATA INICIO EXECUCAO", "DATA FIM EXECUCAO", "ID PREFIXO", "ID MUNICIPIO", "ID EFETIVIDADE", "ID TIPO OS", "ID SUB OS", "QTD OS POR PREFIXO(MES)",
-               "QTD OS POR PREFIXO(DIA)", "EFETIVIDADE POR CIDADE (MES)", "EFETIVIDADE POR CIDADE (DIA)", "TEMPO_RESPOSTA", "STATUS"]]
-
-# Carrega os dois já no formato padronizado
-df_comercial = carregar_comercial()
-df_emergencial = carregar_emergencial()
-
-# Junta tudo
-df_unificado = pd.concat([df_emergencial, df_comercial], ignore_index=True)
-
-# Converte colunas de data para datetime
-colunas_data = ['DATA SOLICITACAO', 'DATA INICIO DESLOCAMENTO', 'DATA FIM DESLOCAMENTO', 'DATA INICIO EXECUCAO', 'DATA FIM EXECUCAO']
-for col in colunas_data: df_unificado[col] = pd.to_datetime(df_unificado[col], errors='coerce')
-
-# Adiciona coluna ID STATUS
-df_unificado["ID STATUS"] = df_unificado["STATUS"].map({
-    "COMERCIAL": 1001,
-    "EMERGENCIAL": 1002
-})
-
-# print(df_unificado.dtypes)
+    df = df.rename(columns=RENOMEAR_EMERGENCIAL)
+    # TIPO OS, SUB OS e STATUS passam para as categorias comuns aos dois arquivos, para o concat manter Categorical
+    df = registro.categorizar(df)
+    return df[COLUNAS_UNIFICADAS]
 
 # Salva o resultado
 def salvar_unificado(df):
-    caminho = DIRETORIO_SAIDA / "dataframe_OPER.csv"
-    df.to_csv(caminho, sep=";", index=False, encoding="utf-8-sig")
-    print("Arquivo dataframe_OPER.csv salvo com sucesso!")
+    caminho = armazenamento.salvar_intermediario(df, "dataframe_OPER")
+    print(f"Arquivo {caminho.name} salvo com sucesso!")
+
+def completar(df_unificado, registro):
+    # Datas já chegam em datetime64 do in2/in3 (ou da leitura do intermediário): só converte o que faltar
+    colunas_data = ['DATA SOLICITACAO', 'DATA INICIO DESLOCAMENTO', 'DATA FIM DESLOCAMENTO', 'DATA INICIO EXECUCAO', 'DATA FIM EXECUCAO']
+    df_unificado = normalizacao_datas.normalizar_datas(df_unificado, colunas_data, "dataframe_OPER")
+
+    # Adiciona coluna ID STATUS
+    # (COMERCIAL = 1001, EMERGENCIAL = 1002, pelos códigos da coluna categórica)
+    df_unificado["ID STATUS"] = registro.ids_de(df_unificado["STATUS"], "STATUS").astype("int64")
+    # IDs/contadores em Int64: o concat virava float64 nas colunas com nulos de um dos arquivos (ID TIPO OS = 3.0
+    # no CSV) e os blocos de cada arquivo não; com um tipo só, o dataframe_OPER sai igual nos dois modos
+    df_unificado = armazenamento.inteiros_anulaveis(df_unificado)
+    # Dimensões com as categorias canônicas (mesmo resultado no pandas, em blocos e no DuckDB)
+    return registro.canonizar(df_unificado)
+
+def unificar_em_blocos(registro):
+    # Mesma ordem do concat (emergencial e depois comercial), gravando cada bloco assim que é padronizado
+    fontes = [("oper_emergencial_tratado", COLUNAS_EMERGENCIAL, carregar_emergencial),
+              ("oper_comercial_tratado", COLUNAS_COMERCIAL, carregar_comercial)]
+    particoes = particoes_oper.GravadorParticoes() if particoes_oper.PARTICIONAR_OPER else nullcontext()
+    with armazenamento.GravadorIntermediario("dataframe_OPER") as gravador, particoes:
+        colunas = None
+        for nome, colunas_fonte, carregar in fontes:
+            for bloco in armazenamento.ler_intermediario_em_blocos(nome, etl_blocos.TAMANHO_BLOCO, colunas=colunas_fonte,
+                                                                   manter_categorias=True):
+                df = completar(carregar(bloco, registro), registro)
+                colunas = colunas or list(df.columns)
+                gravador.escrever(df[colunas])
+                if particoes_oper.PARTICIONAR_OPER:
+                    particoes.escrever(df[colunas])
+        gravador.fechar(colunas_vazio=colunas)
+    print(f"Arquivo {gravador.caminho.name} salvo com sucesso! ({gravador.linhas} linhas, em blocos)")
+
+def juntar(oper_comercial_tratado=None, oper_emergencial_tratado=None, registro=None, sql=None):
+    # sql=None: DuckDB quando MOTOR_ETL=duckdb com intermediários Parquet e nenhum dos dois veio em memória
+    registro = dimensoes.carregar_registro() if registro is None else registro
+    if sql is None:
+        sql = motor_sql.unificacao_em_sql() and oper_comercial_tratado is None and oper_emergencial_tratado is None
+    if sql:
+        # Projeção, renomeação e concat numa consulta do DuckDB sobre os Parquet do in2/in3
+        fontes = [(armazenamento.caminho_intermediario("oper_emergencial_tratado"), RENOMEAR_EMERGENCIAL, "EMERGENCIAL"),
+                  (armazenamento.caminho_intermediario("oper_comercial_tratado"), RENOMEAR_COMERCIAL, "COMERCIAL")]
+        df_unificado = motor_sql.unificar([(str(caminho), renomear, status) for caminho, renomear, status in fontes],
+                                          COLUNAS_UNIFICADAS)
+    else:
+        # Carrega os dois já no formato padronizado
+        df_comercial = carregar_comercial(oper_comercial_tratado, registro)
+        df_emergencial = carregar_emergencial(oper_emergencial_tratado, registro)
+
+        # Junta tudo
+        df_unificado = pd.concat([df_emergencial, df_comercial], ignore_index=True)
+
+    return completar(df_unificado, registro)
+
+def unificar(oper_comercial_tratado=None, oper_emergencial_tratado=None, IDs=None):
+    registro = dimensoes.carregar_registro(IDs)
+    if etl_blocos.ETL_EM_BLOCOS and oper_comercial_tratado is None and oper_emergencial_tratado is None:
+        unificar_em_blocos(registro)
+        return None
+
+    df_unificado = juntar(oper_comercial_tratado, oper_emergencial_tratado, registro)
+
+    # print(df_unificado.dtypes)
+
+    salvar_unificado(df_unificado)
+    if particoes_oper.PARTICIONAR_OPER:
+        # Partições por STATUS e ano-mês, para o ML1 ler só o que precisa
+        particoes_oper.gravar(df_unificado)
+    # Em memória o ML1 recebe os mesmos tipos da leitura do intermediário (int64, ou float64 com nulos)
+    return armazenamento.restaurar_tipos(df_unificado, manter_categorias=True)
 
-salvar_unificado(df_unificado)
\ No newline at end of file
+if __name__ == "__main__":
+    unificar()
\ No newline at end of file
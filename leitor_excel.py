@@ -0,0 +1,63 @@
+import io
+import pandas as pd
+from openpyxl import load_workbook
+import normalizacao_datas
+
+TAMANHO_BLOCO_EXCEL = 50000
+
+def _aplicar_tipos(df, tipos):
+    df = normalizacao_datas.normalizar_datas(df, [c for c, tipo in tipos.items() if tipo == "datetime64[ns]"])
+    for coluna, tipo in tipos.items():
+        if coluna not in df.columns or tipo == "datetime64[ns]":
+            continue
+        if tipo in ("int64", "int32"):
+            df[coluna] = pd.to_numeric(df[coluna], errors='coerce').fillna(0).astype(tipo)
+        elif tipo in ("float64", "float32"):
+            df[coluna] = pd.to_numeric(df[coluna], errors='coerce').astype(tipo)
+        else:
+            df[coluna] = df[coluna].astype(tipo)
+    return df
+
+def _montar_bloco(linhas, colunas, tipos):
+    df = pd.DataFrame.from_records(linhas, columns=colunas)
+    sem_tipo = [c for c in colunas if c not in tipos]
+    if sem_tipo:
+        df[sem_tipo] = df[sem_tipo].infer_objects()
+    return _aplicar_tipos(df, tipos)
+
+def ler_excel_em_blocos(conteudo, colunas, tipos=None, tamanho_bloco=TAMANHO_BLOCO_EXCEL, aba=None):
+    # Lê a planilha linha a linha (openpyxl read-only), guardando apenas as colunas pedidas.
+    # Cada bloco tem no máximo "tamanho_bloco" linhas, então a memória não cresce com a planilha.
+    tipos = tipos or {}
+    origem = io.BytesIO(conteudo) if isinstance(conteudo, (bytes, bytearray)) else conteudo
+    workbook = load_workbook(origem, read_only=True, data_only=True)
+    try:
+        planilha = workbook[aba] if aba else workbook.worksheets[0]
+        linhas = planilha.iter_rows(values_only=True)
+        cabecalho = next(linhas, None)
+        if cabecalho is None:
+            return
+
+        posicoes = {}
+        for i, nome in enumerate(cabecalho):
+            if nome is not None and str(nome) not in posicoes:
+                posicoes[str(nome)] = i
+        faltantes = [c for c in colunas if c not in posicoes]
+        if faltantes:
+            raise KeyError(f"Colunas ausentes na planilha: {faltantes}")
+        indices = [posicoes[c] for c in colunas]
+
+        bloco = []
+        for linha in linhas:
+            valores = tuple(linha[i] if i < len(linha) else None for i in indices)
+            # Linhas totalmente vazias (comuns no fim das planilhas) são ignoradas
+            if all(v is None for v in valores):
+                continue
+            bloco.append(valores)
+            if len(bloco) >= tamanho_bloco:
+                yield _montar_bloco(bloco, colunas, tipos)
+                bloco = []
+        if bloco:
+            yield _montar_bloco(bloco, colunas, tipos)
+    finally:
+        workbook.close()
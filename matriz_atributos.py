@@ -0,0 +1,167 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from datetime import datetime
+import armazenamento
+import dimensoes
+
+# Matriz de atributos do ML1: todos os atributos e alvos dos cinco modelos montados uma vez a partir do df
+# preparado e gravados em matriz_atributos/ como .npy (abertos com mmap), com um manifesto das colunas e as
+# linhas usadas por cada modelo. Os modelos treinam de fatias da matriz em vez de cópias do DataFrame.
+DIRETORIO_MATRIZ = "matriz_atributos"
+ARQUIVO_MANIFESTO_MATRIZ = "manifesto.json"
+ARQUIVO_REAIS = "float32.npy"
+ARQUIVO_INTEIROS = "int32.npy"
+
+COLUNAS_BASE = ['ID MUNICIPIO', 'ID STATUS', 'ID TIPO OS', 'ID SUB OS',
+                'QTD OS POR PREFIXO(MES)', 'QTD OS POR PREFIXO(DIA)',
+                'EFETIVIDADE POR CIDADE (MES)', 'EFETIVIDADE POR CIDADE (DIA)']
+COLUNAS_DESLOCAMENTO = ['DIA_SEMANA_FIM_DESLOCAMENTO', 'MES_FIM_DESLOCAMENTO', 'DIA_SEMANA_IN_DESLOCAMENTO',
+                        'MES_IN_DESLOCAMENTO', 'DIA_SEMANA', 'MES']
+# Atributos numéricos e alvos em float32 (IDs e contagens são inteiros pequenos, exatos em float32). A ordem deixa
+# as colunas da duração (TRIMESTRE_PREVISTO + base) e as da resposta/efetividade (base) contíguas
+COLUNAS_FLOAT32 = ['TRIMESTRE_PREVISTO'] + COLUNAS_BASE + ['ID PREFIXO', 'TEMPO_RESPOSTA'] + COLUNAS_DESLOCAMENTO + \
+                  ['DURACAO_SERVICO', 'TEMPO_DESLOCAMENTO']
+# Rótulo da efetividade e colunas de texto como códigos (-1 = nulo), com o vocabulário no manifesto
+COLUNAS_CATEGORICAS = ['TIPO OS', 'MUNICIPIO', 'PREFIXO']
+COLUNAS_INT32 = ['ID EFETIVIDADE'] + COLUNAS_CATEGORICAS
+# O MES_SOLICITACAO do deslocamento é o mês da DATA SOLICITACAO, a mesma coluna MES
+APELIDOS = {"MES_SOLICITACAO": "MES"}
+
+MODELOS = {
+    "duracao": {"atributos": ['TRIMESTRE_PREVISTO'] + COLUNAS_BASE, "alvo": 'DURACAO_SERVICO'},
+    "efetividade": {"atributos": COLUNAS_BASE, "alvo": 'ID EFETIVIDADE'},
+    "resposta": {"atributos": COLUNAS_BASE, "alvo": 'TEMPO_RESPOSTA'},
+    "tempo_ideal": {"atributos": COLUNAS_CATEGORICAS + ['DIA_SEMANA', 'MES'], "alvo": 'DURACAO_SERVICO'},
+    "deslocamento": {"atributos": COLUNAS_DESLOCAMENTO + COLUNAS_BASE + ['ID PREFIXO', 'TEMPO_RESPOSTA', 'MES_SOLICITACAO'],
+                     "alvo": 'TEMPO_DESLOCAMENTO'},
+}
+
+def diretorio_matriz(diretorio=None):
+    return (armazenamento.DIRETORIO_SAIDA if diretorio is None else diretorio) / DIRETORIO_MATRIZ
+
+def _reais(serie):
+    if isinstance(serie.dtype, pd.PeriodDtype):
+        serie = serie.astype('int64')
+    return pd.to_numeric(serie, errors='coerce').to_numpy(dtype=np.float32, na_value=np.nan)
+
+def construir(df, linhas_modelos, diretorio=None, janela=None):
+    # linhas_modelos: {modelo: posições das linhas de df na ordem de uso, ou None para todas}.
+    # janela: posições das linhas que podem entrar no treino (TRIMESTRES_TREINO), ou None para todas.
+    # Cada coluna é escrita direto no arquivo (ordem de Fortran: colunas contíguas), sem matriz inteira na memória
+    pasta = diretorio_matriz(diretorio)
+    pasta.mkdir(parents=True, exist_ok=True)
+    caminho_manifesto = pasta / ARQUIVO_MANIFESTO_MATRIZ
+    if caminho_manifesto.exists():
+        os.remove(caminho_manifesto)
+
+    reais = np.lib.format.open_memmap(pasta / ARQUIVO_REAIS, mode="w+", dtype=np.float32,
+                                      shape=(len(df), len(COLUNAS_FLOAT32)), fortran_order=True)
+    for posicao, coluna in enumerate(COLUNAS_FLOAT32):
+        reais[:, posicao] = _reais(df[coluna])
+    reais.flush()
+    del reais
+
+    inteiros = np.lib.format.open_memmap(pasta / ARQUIVO_INTEIROS, mode="w+", dtype=np.int32,
+                                         shape=(len(df), len(COLUNAS_INT32)), fortran_order=True)
+    categorias = {}
+    inteiros[:, 0] = pd.to_numeric(df['ID EFETIVIDADE'], errors='coerce').fillna(-1).to_numpy(dtype=np.int32)
+    for posicao, coluna in enumerate(COLUNAS_CATEGORICAS, start=1):
+        # Mesmos códigos do get_dummies/cat.codes de antes: só as categorias presentes, em ordem alfabética
+        serie = dimensoes.compactar(df[coluna].astype('category'))
+        inteiros[:, posicao] = serie.cat.codes.to_numpy(dtype=np.int32)
+        categorias[coluna] = [str(valor) for valor in serie.cat.categories]
+    inteiros.flush()
+    del inteiros
+
+    modelos = {}
+    for modelo, definicao in MODELOS.items():
+        linhas = linhas_modelos.get(modelo)
+        arquivo_linhas = None
+        if linhas is not None:
+            arquivo_linhas = f"linhas_{modelo}.npy"
+            np.save(pasta / arquivo_linhas, np.asarray(linhas, dtype=np.int32))
+        modelos[modelo] = dict(definicao, linhas=arquivo_linhas, quantidade=len(df) if linhas is None else len(linhas))
+
+    arquivo_janela = None
+    if janela is not None:
+        arquivo_janela = "linhas_janela.npy"
+        np.save(pasta / arquivo_janela, np.asarray(janela, dtype=np.int32))
+
+    manifesto = {"linhas": len(df), "janela": arquivo_janela, "float32": COLUNAS_FLOAT32, "int32": COLUNAS_INT32, "apelidos": APELIDOS,
+                 "categorias": categorias, "modelos": modelos, "gerado_em": datetime.now().isoformat(timespec="seconds")}
+    # Manifesto por último: sem ele a matriz está incompleta
+    with open(caminho_manifesto.with_suffix(".tmp"), "w", encoding="utf-8") as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=2)
+    os.replace(caminho_manifesto.with_suffix(".tmp"), caminho_manifesto)
+    print(f"Matriz de atributos: {len(df)} linhas x {len(COLUNAS_FLOAT32)} float32 + {len(COLUNAS_INT32)} int32 ({pasta})")
+    return MatrizAtributos(diretorio)
+
+class MatrizAtributos:
+    # Leitura por mmap: colunas e fatias de colunas contíguas são visões do arquivo; só a seleção de linhas
+    # de um modelo gera uma cópia (já em float32)
+
+    def __init__(self, diretorio=None):
+        self.pasta = diretorio_matriz(diretorio)
+        with open(self.pasta / ARQUIVO_MANIFESTO_MATRIZ, encoding="utf-8") as f:
+            self.manifesto = json.load(f)
+        self.reais = np.load(self.pasta / ARQUIVO_REAIS, mmap_mode="r")
+        self.inteiros = np.load(self.pasta / ARQUIVO_INTEIROS, mmap_mode="r")
+        self._posicao_real = {coluna: i for i, coluna in enumerate(self.manifesto["float32"])}
+        self._posicao_inteiro = {coluna: i for i, coluna in enumerate(self.manifesto["int32"])}
+
+    def __len__(self):
+        return self.manifesto["linhas"]
+
+    def _bloco(self, coluna):
+        coluna = self.manifesto["apelidos"].get(coluna, coluna)
+        if coluna in self._posicao_real:
+            return self.reais, self._posicao_real[coluna]
+        return self.inteiros, self._posicao_inteiro[coluna]
+
+    def coluna(self, nome, linhas=None):
+        bloco, posicao = self._bloco(nome)
+        valores = bloco[:, posicao]
+        return valores if linhas is None else valores[linhas]
+
+    def linhas(self, modelo):
+        arquivo = self.manifesto["modelos"][modelo]["linhas"]
+        return None if arquivo is None else np.load(self.pasta / arquivo)
+
+    def linhas_treino(self, modelo):
+        # Linhas do modelo dentro da janela de treino, na mesma ordem (None = todas)
+        linhas = self.linhas(modelo)
+        arquivo = self.manifesto.get("janela")
+        if arquivo is None:
+            return linhas
+        janela = np.load(self.pasta / arquivo)
+        return janela if linhas is None else linhas[np.isin(linhas, janela)]
+
+    def atributos(self, modelo, linhas=None, colunas=None):
+        # DataFrame float32 com os nomes das colunas do modelo (os modelos salvos mantêm os nomes dos atributos)
+        colunas = colunas or self.manifesto["modelos"][modelo]["atributos"]
+        posicoes = [self._bloco(coluna)[1] for coluna in colunas]
+        if all(self._bloco(coluna)[0] is self.reais for coluna in colunas) and \
+                posicoes == list(range(posicoes[0], posicoes[0] + len(posicoes))):
+            matriz = self.reais[:, posicoes[0]:posicoes[-1] + 1]
+            matriz = matriz if linhas is None else matriz[linhas]
+        else:
+            matriz = np.empty((len(self) if linhas is None else len(linhas), len(colunas)), dtype=np.float32, order="F")
+            for destino, coluna in enumerate(colunas):
+                matriz[:, destino] = self.coluna(coluna, linhas)
+        return pd.DataFrame(matriz, columns=colunas, copy=False)
+
+    def alvo(self, modelo, linhas=None):
+        return self.coluna(self.manifesto["modelos"][modelo]["alvo"], linhas)
+
+    def dados(self, modelo, treino=False):
+        # (X, y) do modelo já com a seleção de linhas gravada na matriz; treino=True restringe à janela de treino
+        linhas = self.linhas_treino(modelo) if treino else self.linhas(modelo)
+        return self.atributos(modelo, linhas), self.alvo(modelo, linhas)
+
+    def categoricas(self, colunas=COLUNAS_CATEGORICAS, linhas=None):
+        # Colunas de texto de volta como Categorical (códigos + vocabulário do manifesto)
+        return pd.DataFrame({coluna: pd.Categorical.from_codes(self.coluna(coluna, linhas),
+                                                               categories=self.manifesto["categorias"][coluna])
+                             for coluna in colunas})
@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import threading
+from pathlib import Path
+from datetime import datetime
+from armazenamento import DIRETORIO_RELATORIOS
+
+# psutil (opcional) mede a memória e a CPU dos processos filhos ainda vivos; sem ele, a memória é só a do
+# processo atual (/proc, Linux) e a CPU dos filhos conta depois que eles terminam
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+ARQUIVO_HISTORICO = "historico_execucoes.jsonl"
+
+# Timeout das etapas: explícito na Etapa, TIMEOUT_<NOME> no .env ou derivado do histórico
+TIMEOUT_PADRAO = int(os.getenv("TIMEOUT_PADRAO_ETAPA", "60"))
+TIMEOUT_MINIMO = int(os.getenv("TIMEOUT_MINIMO_ETAPA", "60"))
+FATOR_TIMEOUT = float(os.getenv("FATOR_TIMEOUT_ETAPA", "3"))
+EXECUCOES_PARA_TIMEOUT = int(os.getenv("EXECUCOES_PARA_TIMEOUT", "20"))
+INTERVALO_AMOSTRA_RSS = float(os.getenv("INTERVALO_AMOSTRA_RSS", "0.2"))
+
+def contar_linhas(caminho):
+    caminho = Path(caminho)
+    if caminho.suffix == ".parquet":
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(caminho).metadata.num_rows
+    if caminho.suffix == ".csv":
+        # Conta quebras de linha em blocos binários, sem interpretar o CSV (desconta o cabeçalho)
+        linhas = 0
+        with open(caminho, "rb") as f:
+            for bloco in iter(lambda: f.read(1 << 20), b""):
+                linhas += bloco.count(b"\n")
+        return max(linhas - 1, 0)
+    return None
+
+def medir_arquivos(caminhos):
+    linhas, tamanho = 0, 0
+    for caminho in caminhos:
+        if not Path(caminho).exists():
+            continue
+        tamanho += Path(caminho).stat().st_size
+        quantidade = contar_linhas(caminho)
+        linhas += quantidade or 0
+    return linhas, tamanho
+
+def carregar_historico(diretorio):
+    caminho = Path(diretorio) / ARQUIVO_HISTORICO
+    historico = []
+    if caminho.exists():
+        with open(caminho, encoding="utf-8") as f:
+            for linha in f:
+                if linha.strip():
+                    historico.append(json.loads(linha))
+    return historico
+
+def _descendentes():
+    # Pools do in1 e do ML1 e, no modo subprocesso, o script em execução
+    try:
+        return psutil.Process().children(recursive=True)
+    except psutil.Error:
+        return []
+
+def rss_mb():
+    # Memória residente atual do processo e de todos os descendentes vivos
+    if psutil is not None:
+        total = 0
+        for processo in [psutil.Process()] + _descendentes():
+            try:
+                total += processo.memory_info().rss
+            except psutil.Error:
+                pass
+        return round(total / 2 ** 20, 1)
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20, 1)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def cpu_s():
+    # CPU de todas as threads do processo (inclusive as nativas do OpenMP/XGBoost), dos filhos já encerrados
+    # e aguardados (os.times, zero no Windows) e dos descendentes ainda vivos (psutil)
+    tempos = os.times()
+    total = tempos.user + tempos.system + tempos.children_user + tempos.children_system
+    if psutil is not None:
+        for processo in _descendentes():
+            try:
+                uso = processo.cpu_times()
+                total += uso.user + uso.system
+            except psutil.Error:
+                pass
+    return total
+
+class AmostradorRSS(threading.Thread):
+    # Pico de memória durante a etapa: amostra rss_mb() a cada INTERVALO_AMOSTRA_RSS segundos
+    # (o ru_maxrss é o pico da vida inteira do processo e repetia o da maior etapa em todas as seguintes)
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.inicial = rss_mb()
+        self.pico = self.inicial
+        self._parar = threading.Event()
+
+    def _registrar(self, valor):
+        if valor is not None and (self.pico is None or valor > self.pico):
+            self.pico = valor
+
+    def run(self):
+        while not self._parar.wait(INTERVALO_AMOSTRA_RSS):
+            self._registrar(rss_mb())
+
+    def parar(self):
+        self._parar.set()
+        self.join()
+        self._registrar(rss_mb())
+        return self.pico
+
+def _percentil(valores, percentil):
+    valores = sorted(valores)
+    posicao = min(len(valores) - 1, int(round(percentil * (len(valores) - 1))))
+    return valores[posicao]
+
+class ColetorMetricas:
+    # Mede tempo de parede, CPU, pico de memória e linhas/bytes de entrada e saída de cada etapa,
+    # grava o relatório JSON da execução e acrescenta a execução ao histórico.
+    # CPU e memória são do processo inteiro (mais os filhos): etapas que rodaram ao mesmo tempo no modo
+    # processo dividem esses números, e cada registro lista as etapas simultâneas em "etapas_simultaneas".
+
+    def __init__(self, diretorio, modo="processo"):
+        self.diretorio = Path(diretorio)
+        self.modo = modo
+        self.inicio = datetime.now()
+        self.etapas = []
+        self.historico = carregar_historico(self.diretorio)
+        self._trava = threading.Lock()
+        self._ativas = {}
+
+    def timeout(self, etapa):
+        if etapa.timeout is not None:
+            return etapa.timeout
+        configurado = os.getenv(f"TIMEOUT_{etapa.nome.upper()}")
+        if configurado:
+            return int(configurado)
+        # p95 das últimas execuções bem-sucedidas multiplicado por uma folga
+        tempos = [registro["tempo_parede_s"] for execucao in self.historico for registro in execucao.get("etapas", [])
+                  if registro["etapa"] == etapa.nome and registro["status"] == "sucesso"][-EXECUCOES_PARA_TIMEOUT:]
+        if not tempos:
+            return TIMEOUT_PADRAO
+        return max(TIMEOUT_MINIMO, int(FATOR_TIMEOUT * _percentil(tempos, 0.95)) + 1)
+
+    def iniciar(self, etapa):
+        amostrador = AmostradorRSS()
+        amostrador.start()
+        marcador = {"parede": time.perf_counter(), "cpu": cpu_s(), "inicio": datetime.now().isoformat(timespec="seconds"),
+                    "amostrador": amostrador, "simultaneas": set()}
+        with self._trava:
+            marcador["simultaneas"].update(self._ativas)
+            for outro in self._ativas.values():
+                outro["simultaneas"].add(etapa.nome)
+            self._ativas[etapa.nome] = marcador
+        return marcador
+
+    def finalizar(self, etapa, marcador, status, erro=None):
+        pico = marcador["amostrador"].parar()
+        with self._trava:
+            self._ativas.pop(etapa.nome, None)
+        linhas_entrada, bytes_entrada = medir_arquivos(etapa.arquivos_entrada(self.diretorio))
+        linhas_saida, bytes_saida = medir_arquivos(etapa.arquivos_saida(self.diretorio))
+        registro = {
+            "etapa": etapa.nome,
+            "status": status,
+            "inicio": marcador["inicio"],
+            "tempo_parede_s": round(time.perf_counter() - marcador["parede"], 3),
+            "tempo_cpu_s": round(cpu_s() - marcador["cpu"], 3),
+            "rss_inicial_mb": marcador["amostrador"].inicial,
+            "pico_rss_mb": pico,
+            "etapas_simultaneas": sorted(marcador["simultaneas"]),
+            "linhas_entrada": linhas_entrada,
+            "bytes_entrada": bytes_entrada,
+            "linhas_saida": linhas_saida,
+            "bytes_saida": bytes_saida,
+            "timeout_s": self.timeout(etapa)
+        }
+        if erro:
+            registro["erro"] = str(erro)[:500]
+        with self._trava:
+            self.etapas.append(registro)
+        return registro
+
+    def registrar_pulada(self, etapa):
+        with self._trava:
+            self.etapas.append({"etapa": etapa.nome, "status": "pulada"})
+
+    def salvar(self, codigo_saida):
+        relatorio = {
+            "inicio": self.inicio.isoformat(timespec="seconds"),
+            "fim": datetime.now().isoformat(timespec="seconds"),
+            "modo": self.modo,
+            "codigo_saida": codigo_saida,
+            "tempo_total_s": round((datetime.now() - self.inicio).total_seconds(), 3),
+            "etapas": self.etapas
+        }
+        diretorio_relatorios = self.diretorio / DIRETORIO_RELATORIOS
+        diretorio_relatorios.mkdir(parents=True, exist_ok=True)
+        caminho = diretorio_relatorios / f"execucao_{self.inicio:%Y%m%d_%H%M%S}.json"
+        with open(caminho, "w", encoding="utf-8") as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=2)
+        with open(self.diretorio / ARQUIVO_HISTORICO, "a", encoding="utf-8") as f:
+            f.write(json.dumps(relatorio, ensure_ascii=False) + "\n")
+        return caminho
@@ -0,0 +1,131 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+import armazenamento
+
+load_dotenv('credenciais_arquivos.env')
+
+# MOTOR_ETL=duckdb: a unificação do in4 e a contagem de OS distintas do in2/in3 rodam no DuckDB (em processo,
+# multi-thread e com despejo em disco). Sem o pacote duckdb instalado, o pandas continua sendo usado.
+MOTOR_ETL = os.getenv("MOTOR_ETL", "pandas").lower()
+DUCKDB_THREADS = int(os.getenv("DUCKDB_THREADS", "0"))  # 0 = todos os núcleos
+DUCKDB_MEMORIA = os.getenv("DUCKDB_MEMORIA", "")  # ex.: "4GB"; acima disso o DuckDB despeja em disco
+DIRETORIO_TEMPORARIO = "duckdb_tmp"
+
+def disponivel():
+    try:
+        import duckdb  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+ATIVO = MOTOR_ETL == "duckdb" and disponivel()
+if MOTOR_ETL == "duckdb" and not ATIVO:
+    print("MOTOR_ETL=duckdb, mas o pacote duckdb não está instalado: usando pandas")
+
+_local = threading.local()
+
+def unificacao_em_sql():
+    # O in4 unifica no DuckDB direto dos Parquet do in2/in3: o executor não passa esses DataFrames em memória
+    # (entradas sob demanda) e o in2/in3 não os publicam
+    return ATIVO and armazenamento.FORMATO_INTERMEDIARIO == "parquet"
+
+def conexao():
+    # Uma conexão por thread (in2 e in3 rodam em paralelo no executor)
+    if getattr(_local, "conexao", None) is None:
+        import duckdb
+        temporario = armazenamento.DIRETORIO_SAIDA / DIRETORIO_TEMPORARIO
+        temporario.mkdir(parents=True, exist_ok=True)
+        configuracao = {"threads": DUCKDB_THREADS or os.cpu_count() or 1, "temp_directory": str(temporario),
+                        "preserve_insertion_order": True}
+        if DUCKDB_MEMORIA:
+            configuracao["memory_limit"] = DUCKDB_MEMORIA
+        _local.conexao = duckdb.connect(config=configuracao)
+    return _local.conexao
+
+def _nome(coluna):
+    return '"' + coluna.replace('"', '""') + '"'
+
+def _texto(valor):
+    return "'" + str(valor).replace("'", "''") + "'"
+
+def distintos_por_chave(chave, os_codigo, n_os, mascara, n_chaves):
+    # Mesmo contrato do agregacoes._distintos_por_chave: OS distintas por chave (vetor de tamanho n_chaves),
+    # com o COUNT(DISTINCT) feito pelo DuckDB direto sobre os arrays, sem cópia
+    pares = pd.DataFrame({"chave": chave[mascara], "os": os_codigo[mascara]})
+    con = conexao()
+    con.register("pares", pares)
+    try:
+        resultado = con.execute("SELECT chave, COUNT(DISTINCT os) AS n FROM pares GROUP BY chave").fetchnumpy()
+    finally:
+        con.unregister("pares")
+    contagem = np.zeros(n_chaves, dtype=np.int64)
+    contagem[np.asarray(resultado["chave"], dtype=np.int64)] = np.asarray(resultado["n"], dtype=np.int64)
+    return contagem
+
+def consulta_unificacao(fontes, colunas):
+    # fontes: (caminho do Parquet, {coluna de origem: coluna unificada}, STATUS), na ordem do concat.
+    # Projeção, renomeação e UNION ALL numa única consulta; a ordem das linhas é a do concat do pandas.
+    partes = []
+    for ordem, (caminho, renomear, status) in enumerate(fontes):
+        origem = {destino: origem for origem, destino in renomear.items()}
+        selecao = [f"{_texto(status)} AS {_nome(coluna)}" if coluna == "STATUS"
+                   else f"{_nome(origem.get(coluna, coluna))} AS {_nome(coluna)}" for coluna in colunas]
+        partes.append(f"SELECT {', '.join(selecao)}, {ordem} AS _fonte, file_row_number AS _linha "
+                      f"FROM read_parquet({_texto(caminho)}, file_row_number = true)")
+    return (f"SELECT {', '.join(_nome(coluna) for coluna in colunas)}, _fonte FROM ({' UNION ALL '.join(partes)}) "
+            f"ORDER BY _fonte, _linha")
+
+def _tipos_fontes(fontes, colunas):
+    # Tipo Arrow de cada coluna unificada em cada arquivo (só o esquema do Parquet é lido)
+    import pyarrow.parquet as pq
+    tipos = []
+    for caminho, renomear, status in fontes:
+        esquema = pq.read_schema(caminho)
+        origem = {destino: origem for origem, destino in renomear.items()}
+        tipos.append({coluna: esquema.field(origem.get(coluna, coluna)).type for coluna in colunas
+                      if origem.get(coluna, coluna) in esquema.names})
+    return tipos
+
+def _restaurar_mistas(df, fontes_linhas, tipos):
+    # Coluna inteira num arquivo e texto no outro (ex.: OS 123 no emergencial e "SS-123" no comercial): o UNION ALL
+    # converte tudo para VARCHAR, enquanto o concat do pandas mantém os números de cada arquivo numa coluna object.
+    # As linhas das fontes inteiras voltam a ser números, como na leitura do pandas (int64 sem nulos, float64 com)
+    import pyarrow as pa
+    for coluna in df.columns:
+        inteiras = [fonte for fonte, tipo in enumerate(tipos) if coluna in tipo and pa.types.is_integer(tipo[coluna])]
+        textuais = [fonte for fonte, tipo in enumerate(tipos) if coluna in tipo and
+                    (pa.types.is_string(tipo[coluna]) or pa.types.is_large_string(tipo[coluna]) or
+                     pa.types.is_dictionary(tipo[coluna]))]
+        if not inteiras or not textuais:
+            continue
+        valores = df[coluna].astype(object)
+        for fonte in inteiras:
+            mascara = fontes_linhas == fonte
+            numeros = pd.to_numeric(valores[mascara])
+            numeros = numeros.astype("float64") if numeros.isna().any() else numeros.astype("int64")
+            valores[mascara] = pd.Series(numeros.tolist(), index=numeros.index, dtype=object)
+        df[coluna] = valores
+    return df
+
+def _tipos_pandas(df):
+    # Mesmos tipos da leitura do Parquet pelo pandas (armazenamento.restaurar_tipos + concat):
+    # inteiros sem nulos em int64, com nulos em float64, e datas em datetime64[ns]
+    for coluna in df.columns:
+        tipo = armazenamento.ESQUEMA.get(coluna)
+        if tipo == "inteiro" and (pd.api.types.is_integer_dtype(df[coluna]) or pd.api.types.is_float_dtype(df[coluna])):
+            df[coluna] = df[coluna].astype("float64") if df[coluna].isna().any() else df[coluna].astype("int64")
+        elif tipo == "data":
+            df[coluna] = df[coluna].astype("datetime64[ns]")
+    return df
+
+def unificar(fontes, colunas):
+    # Lê os arquivos tratados direto do disco; só o resultado final vira DataFrame
+    fontes = [(caminho, renomear, status) for caminho, renomear, status in fontes if os.path.exists(caminho)]
+    if not fontes:
+        return pd.DataFrame(columns=colunas)
+    df = conexao().execute(consulta_unificacao(fontes, colunas)).df()
+    fontes_linhas = df.pop("_fonte").to_numpy()
+    return _tipos_pandas(_restaurar_mistas(df, fontes_linhas, _tipos_fontes(fontes, colunas)))
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+import threading
+
+# Formatos testados na detecção, na ordem de preferência ("ISO8601" cobre o que o pandas grava no CSV,
+# com ou sem fração de segundo)
+FORMATOS_CANDIDATOS = ["ISO8601", "%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d"]
+TAMANHO_AMOSTRA = 500
+LIMITE_CACHE = 2_000_000  # Textos já convertidos guardados entre chamadas (somando todos os formatos)
+
+# Um cache por formato: o mesmo texto (ex.: 03/04/2024) vira datas diferentes conforme o formato do arquivo
+_caches = {}
+_trava_cache = threading.Lock()
+
+def _amostra(series):
+    valores = []
+    for serie in series:
+        texto = serie.dropna()
+        if len(texto):
+            valores.append(pd.Series(texto.unique()[:TAMANHO_AMOSTRA]).astype(str))
+    return pd.concat(valores, ignore_index=True) if valores else pd.Series([], dtype=object)
+
+def detectar_formato(series):
+    # Um único formato por arquivo, escolhido pela amostra conjunta de todas as colunas de data
+    amostra = _amostra(series)
+    if amostra.empty:
+        return None
+    melhor, acertos_melhor = None, 0
+    for formato in FORMATOS_CANDIDATOS:
+        try:
+            acertos = int(pd.to_datetime(amostra, format=formato, errors='coerce').notna().sum())
+        except (ValueError, TypeError):
+            continue  # Formato não suportado pela versão do pandas
+        if acertos == len(amostra):
+            return formato
+        if acertos > acertos_melhor:
+            melhor, acertos_melhor = formato, acertos
+    return melhor
+
+def _converter_textos(textos, formato):
+    try:
+        convertidos = pd.to_datetime(textos, format=formato, errors='coerce') if formato \
+            else pd.to_datetime(textos, errors='coerce')
+    except (ValueError, TypeError):
+        convertidos = pd.to_datetime(textos, errors='coerce')
+    convertidos = pd.Series(np.asarray(convertidos, dtype="datetime64[ns]"), index=textos)
+    # O que não casou com o formato do arquivo tem uma segunda chance, valor a valor
+    falhas = convertidos.isna().to_numpy()
+    if formato and falhas.any():
+        try:
+            convertidos[falhas] = np.asarray(pd.to_datetime(textos[falhas], format="mixed", errors='coerce'),
+                                             dtype="datetime64[ns]")
+        except (ValueError, TypeError):
+            pass
+    return convertidos
+
+def converter_serie(serie, formato=None):
+    # Converte só os textos distintos (reaproveitando o cache do formato) e espalha o resultado pelos códigos
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie  # Já convertida por uma etapa anterior ou lida do Parquet: nada a fazer
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        serie = serie.astype(object)
+    # Números (seriais), datetime do openpyxl e misturas seguem a conversão padrão do pandas
+    if not (pd.api.types.is_object_dtype(serie) or pd.api.types.is_string_dtype(serie)) \
+            or pd.api.types.infer_dtype(serie, skipna=True) not in ("string", "empty"):
+        return pd.to_datetime(serie, errors='coerce')
+
+    codigos, unicos = pd.factorize(serie)
+    textos = pd.Index(pd.Series(unicos, dtype=object).astype(str))
+    with _trava_cache:
+        cache = _caches.get(formato, pd.Series([], dtype="datetime64[ns]"))
+        conhecidos = cache.reindex(textos)
+        novos = textos[conhecidos.isna().to_numpy() & ~textos.isin(cache.index)]
+    if len(novos):
+        convertidos = _converter_textos(novos, formato)
+        with _trava_cache:
+            cache = _caches.get(formato, pd.Series([], dtype="datetime64[ns]"))
+            if sum(len(outro) for outro in _caches.values()) + len(convertidos) > LIMITE_CACHE:
+                _caches.clear()
+                cache = cache.iloc[0:0]
+            cache = pd.concat([cache, convertidos[~convertidos.index.isin(cache.index)]])
+            _caches[formato] = cache
+            conhecidos = cache.reindex(textos)
+
+    valores = conhecidos.to_numpy(dtype="datetime64[ns]")
+    resultado = np.full(len(serie), np.datetime64("NaT"), dtype="datetime64[ns]")
+    validos = codigos >= 0
+    resultado[validos] = valores[codigos[validos]]
+    return pd.Series(resultado, index=serie.index, name=serie.name)
+
+def normalizar_datas(df, colunas, nome=None):
+    # Converte as colunas de data do DataFrame uma única vez (colunas já em datetime64 são mantidas)
+    # e informa quantos valores preenchidos não puderam ser convertidos
+    colunas = [coluna for coluna in colunas if coluna in df.columns]
+    pendentes = [coluna for coluna in colunas if not pd.api.types.is_datetime64_any_dtype(df[coluna])]
+    if not pendentes:
+        return df
+    formato = detectar_formato([df[coluna] for coluna in pendentes
+                                if not pd.api.types.is_numeric_dtype(df[coluna])])
+    falhas = {}
+    for coluna in pendentes:
+        preenchidos = df[coluna].notna()
+        df[coluna] = converter_serie(df[coluna], formato)
+        quantidade = int((preenchidos & df[coluna].isna()).sum())
+        if quantidade:
+            falhas[coluna] = quantidade
+    if falhas:
+        print(f"Datas não convertidas{' em ' + nome if nome else ''} (formato {formato}): {falhas}")
+    return df
+
+def limpar_cache():
+    with _trava_cache:
+        _caches.clear()
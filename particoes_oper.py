@@ -0,0 +1,210 @@
+import os
+import json
+import shutil
+import pandas as pd
+from datetime import datetime
+from dotenv import load_dotenv
+import armazenamento
+
+load_dotenv('credenciais_arquivos.env')
+
+# PARTICIONAR_OPER=1: o in4 também grava o dataframe_OPER particionado por STATUS e ano-mês da DATA SOLICITACAO
+# (dataframe_OPER_particoes/STATUS=<status>/ANO_MES=<aaaa-mm>/dados.<csv|parquet>) com um índice das partições,
+# e o ML1 lê só as partições que podem ter linhas usadas no treino
+PARTICIONAR_OPER = os.getenv("PARTICIONAR_OPER", "0") == "1"
+DIRETORIO_PARTICOES = "dataframe_OPER_particoes"
+ARQUIVO_INDICE = "indice.json"
+COLUNA_PARTICAO = "DATA SOLICITACAO"
+SEM_DATA = "sem_data"
+
+# Colunas com mínimo e máximo guardados no índice (usados na poda por predicado)
+COLUNAS_ESTATISTICAS = ['DATA SOLICITACAO', 'DATA INICIO DESLOCAMENTO', 'DATA FIM DESLOCAMENTO', 'DATA INICIO EXECUCAO',
+                        'DATA FIM EXECUCAO', 'TEMPO_RESPOSTA']
+
+def diretorio_base():
+    return armazenamento.DIRETORIO_SAIDA / DIRETORIO_PARTICOES
+
+def chave_particao(status, ano_mes):
+    return f"{status}/{ano_mes}"
+
+def diretorio_particao(status, ano_mes):
+    return diretorio_base() / f"STATUS={status}" / f"ANO_MES={ano_mes}"
+
+def carregar_indice():
+    caminho = diretorio_base() / ARQUIVO_INDICE
+    if not caminho.exists():
+        return None
+    with open(caminho, encoding="utf-8") as f:
+        return json.load(f)
+
+def existe():
+    return carregar_indice() is not None
+
+def salvar_indice(indice):
+    diretorio = diretorio_base()
+    diretorio.mkdir(parents=True, exist_ok=True)
+    caminho = diretorio / ARQUIVO_INDICE
+    with open(caminho.with_suffix(".tmp"), "w", encoding="utf-8") as f:
+        json.dump(indice, f, ensure_ascii=False, indent=2)
+    os.replace(caminho.with_suffix(".tmp"), caminho)
+
+def _valor_json(valor):
+    if pd.isna(valor):
+        return None
+    if isinstance(valor, pd.Timestamp):
+        return valor.isoformat()
+    return float(valor)
+
+def _meses(df):
+    datas = pd.to_datetime(df[COLUNA_PARTICAO], errors='coerce')
+    return datas.dt.strftime("%Y-%m").fillna(SEM_DATA)
+
+class GravadorParticoes:
+    # Grava o dataframe_OPER por partição (STATUS, ano-mês), recebendo o DataFrame inteiro ou em blocos.
+    # Cada partição é escrita num arquivo temporário e trocada no fechar, junto com o índice.
+    # meses=None substitui o conjunto todo (partições que não receberam linhas são removidas);
+    # com uma lista de meses só as partições desses meses são refeitas e as demais ficam intactas.
+
+    def __init__(self, meses=None):
+        self.meses = None if meses is None else set(meses)
+        self.formato = armazenamento.FORMATO_INTERMEDIARIO
+        self._gravadores = {}
+        self._estatisticas = {}
+
+    def __enter__(self):
+        return self
+
+    def escrever(self, df):
+        if df.empty:
+            return
+        grupos = pd.DataFrame({"status": df["STATUS"].astype(str).to_numpy(), "ano_mes": _meses(df).to_numpy()}) \
+            .groupby(["status", "ano_mes"], sort=False).indices
+        for (status_particao, ano_mes), posicoes in grupos.items():
+            if self.meses is not None and ano_mes not in self.meses:
+                continue
+            parte = df.iloc[posicoes]
+            chave = chave_particao(status_particao, ano_mes)
+            if chave not in self._gravadores:
+                diretorio = diretorio_particao(status_particao, ano_mes)
+                diretorio.mkdir(parents=True, exist_ok=True)
+                self._gravadores[chave] = armazenamento.GravadorIntermediario("dados_tmp", diretorio, self.formato)
+                self._estatisticas[chave] = {"status": status_particao, "ano_mes": ano_mes, "linhas": 0,
+                                             "minimo": {}, "maximo": {}}
+            self._gravadores[chave].escrever(parte)
+            self._atualizar_estatisticas(self._estatisticas[chave], parte)
+
+    def _atualizar_estatisticas(self, estatisticas, parte):
+        estatisticas["linhas"] += len(parte)
+        for coluna in COLUNAS_ESTATISTICAS:
+            if coluna not in parte.columns:
+                continue
+            valores = parte[coluna]
+            for nome, valor, escolher in (("minimo", valores.min(), min), ("maximo", valores.max(), max)):
+                valor = _valor_json(valor)
+                atual = estatisticas[nome].get(coluna)
+                if valor is not None:
+                    estatisticas[nome][coluna] = valor if atual is None else escolher(atual, valor)
+
+    def fechar(self):
+        indice = carregar_indice() or {}
+        particoes = indice.get("particoes", {}) if indice.get("formato") == self.formato else {}
+        for chave, gravador in self._gravadores.items():
+            gravador.fechar()
+            destino = armazenamento.caminho_intermediario("dados", gravador.caminho.parent, self.formato)
+            os.replace(gravador.caminho, destino)
+            particoes[chave] = self._estatisticas[chave]
+
+        # Partições do escopo reescrito que não receberam linhas deixam de existir
+        for chave, dados in list(particoes.items()):
+            if chave not in self._gravadores and (self.meses is None or dados["ano_mes"] in self.meses):
+                shutil.rmtree(diretorio_particao(dados["status"], dados["ano_mes"]), ignore_errors=True)
+                del particoes[chave]
+        if self.meses is None:
+            gravados = {diretorio_particao(dados["status"], dados["ano_mes"]) for dados in particoes.values()}
+            for diretorio in diretorio_base().glob("STATUS=*/ANO_MES=*"):
+                if diretorio not in gravados:
+                    shutil.rmtree(diretorio, ignore_errors=True)
+
+        salvar_indice({"formato": self.formato, "coluna_particao": COLUNA_PARTICAO,
+                       "atualizado_em": datetime.now().isoformat(timespec="seconds"),
+                       "particoes": dict(sorted(particoes.items()))})
+        self._gravadores = {}
+        return particoes
+
+    def __exit__(self, tipo, valor, traceback):
+        if tipo is None:
+            self.fechar()
+        else:
+            # Falha no meio: os temporários das partições são descartados e os "dados" anteriores ficam
+            for gravador in self._gravadores.values():
+                gravador.descartar()
+            self._gravadores = {}
+        return False
+
+def gravar(df, meses=None):
+    # Grava o DataFrame inteiro nas partições; "meses" (ex.: ["2024-05"]) reescreve só esses meses
+    with GravadorParticoes(meses) as gravador:
+        gravador.escrever(df)
+    return gravador
+
+def _descartar(dados, coluna, operador, valor):
+    # A partição pode ser pulada quando nenhuma linha dela satisfaz o predicado (pelo mínimo/máximo do índice)
+    minimo, maximo = dados["minimo"].get(coluna), dados["maximo"].get(coluna)
+    if minimo is None or maximo is None:
+        return False
+    if isinstance(valor, (pd.Timestamp, datetime)):
+        minimo, maximo, valor = pd.Timestamp(minimo), pd.Timestamp(maximo), pd.Timestamp(valor)
+    if operador == "<=":
+        return minimo > valor
+    if operador == "<":
+        return minimo >= valor
+    if operador == ">=":
+        return maximo < valor
+    if operador == ">":
+        return maximo <= valor
+    if operador == "==":
+        return valor < minimo or valor > maximo
+    raise ValueError(f"Operador não suportado: {operador}")
+
+def selecionar(status=None, inicio=None, fim=None, filtros=None):
+    # Partições que podem ter linhas com STATUS em "status", ano-mês entre "inicio" e "fim" (aaaa-mm)
+    # e que não são descartadas por nenhum filtro (coluna, operador, valor)
+    indice = carregar_indice()
+    if indice is None:
+        return []
+    selecionadas = []
+    for chave, dados in indice["particoes"].items():
+        if status is not None and dados["status"] not in status:
+            continue
+        if (inicio is not None or fim is not None) and dados["ano_mes"] == SEM_DATA:
+            continue
+        if inicio is not None and dados["ano_mes"] < inicio:
+            continue
+        if fim is not None and dados["ano_mes"] > fim:
+            continue
+        if any(_descartar(dados, *filtro) for filtro in filtros or []):
+            continue
+        selecionadas.append(dados)
+    return selecionadas
+
+def carregar(status=None, inicio=None, fim=None, filtros=None, colunas=None):
+    # Lê só as partições selecionadas (na ordem de "status" e dos meses) e informa a fração lida
+    indice = carregar_indice()
+    if indice is None:
+        return None
+    selecionadas = selecionar(status, inicio, fim, filtros)
+    if status is not None:
+        selecionadas.sort(key=lambda dados: list(status).index(dados["status"]))
+    total = sum(dados["linhas"] for dados in indice["particoes"].values())
+    lidas = sum(dados["linhas"] for dados in selecionadas)
+    print(f"Partições lidas: {len(selecionadas)} de {len(indice['particoes'])} ({lidas} de {total} linhas)")
+
+    partes = [armazenamento.carregar_intermediario("dados", colunas=colunas,
+                                                   diretorio=diretorio_particao(dados["status"], dados["ano_mes"]),
+                                                   formato=indice["formato"], manter_categorias=True)
+              for dados in selecionadas]
+    partes = [parte for parte in partes if parte is not None]
+    if not partes:
+        return None
+    # Categorias diferentes entre partições: o concat volta para texto e quem lê categoriza de novo
+    return pd.concat(partes, ignore_index=True)
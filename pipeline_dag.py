@@ -0,0 +1,190 @@
+import time
+import logging
+import importlib
+import threading
+from pathlib import Path
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import armazenamento
+
+@dataclass
+class Etapa:
+    # "funcao" é o nome da função dentro do módulo do script (ex.: "realizar_juncao").
+    # Os nomes em "entradas" são passados como argumentos nomeados da função, e o retorno
+    # (DataFrame ou dict) é publicado com os nomes de "saidas".
+    # "artefatos" são outros arquivos gerados (modelos, CSV final), "codigo" os módulos auxiliares
+    # e "parametros" as variáveis de ambiente que entram na impressão digital da etapa.
+    nome: str
+    script: str
+    funcao: str
+    entradas: list = field(default_factory=list)
+    saidas: list = field(default_factory=list)
+    artefatos: list = field(default_factory=list)
+    codigo: list = field(default_factory=lambda: ["armazenamento.py"])
+    parametros: list = field(default_factory=list)
+    sempre_executar: bool = False
+    timeout: int = None
+
+    @property
+    def modulo(self):
+        return self.script[:-3] if self.script.endswith(".py") else self.script
+
+    def arquivos_entrada(self, diretorio=None):
+        return [armazenamento.caminho_intermediario(entrada, diretorio) for entrada in self.entradas]
+
+    def arquivos_saida(self, diretorio=None):
+        diretorio = armazenamento.DIRETORIO_SAIDA if diretorio is None else Path(diretorio)
+        return [armazenamento.caminho_intermediario(saida, diretorio) for saida in self.saidas] + \
+               [diretorio / artefato for artefato in self.artefatos]
+
+def validar_etapas(etapas):
+    # Cada saída tem um único produtor e toda entrada produzida no pipeline vem de uma etapa anterior
+    produtores = {}
+    for etapa in etapas:
+        for saida in etapa.saidas:
+            if saida in produtores:
+                raise ValueError(f"Saída '{saida}' declarada por {produtores[saida]} e {etapa.nome}")
+            produtores[saida] = etapa.nome
+
+    dependencias = {etapa.nome: {produtores[e] for e in etapa.entradas if e in produtores} for etapa in etapas}
+    visitadas, em_visita = set(), set()
+
+    def visitar(nome):
+        if nome in em_visita:
+            raise ValueError(f"Ciclo de dependências envolvendo {nome}")
+        if nome not in visitadas:
+            em_visita.add(nome)
+            for dependencia in dependencias[nome]:
+                visitar(dependencia)
+            em_visita.discard(nome)
+            visitadas.add(nome)
+
+    for etapa in etapas:
+        visitar(etapa.nome)
+    return dependencias
+
+class ExecutorPipeline:
+    # Executa as etapas como funções no mesmo processo, passando os DataFrames em memória.
+    # Etapas sem dependência entre si (ex.: in2 e in3) rodam ao mesmo tempo em threads.
+    # Entradas em "sob_demanda" não são carregadas do disco pelo executor: a etapa as lê sozinha
+    # (em blocos ou por partição) quando não estão em memória.
+
+    def __init__(self, etapas, max_paralelo=2, controle=None, metricas=None, sob_demanda=()):
+        self.etapas = {etapa.nome: etapa for etapa in etapas}
+        self.sob_demanda = set(sob_demanda)
+        self.controle = controle
+        self.metricas = metricas
+        self.dependencias = validar_etapas(etapas)
+        self.max_paralelo = max(1, max_paralelo)
+        self.dados = {}
+        self._trava_dados = threading.Lock()
+        self._consumidores = {}
+        self._marcadores = {}
+        for etapa in etapas:
+            for entrada in etapa.entradas:
+                self._consumidores[entrada] = self._consumidores.get(entrada, 0) + 1
+
+    def obter_entrada(self, nome):
+        # Entradas que não estão em memória (ex.: gravadas pelo in1) são lidas do disco uma única vez
+        with self._trava_dados:
+            if nome not in self.dados:
+                df = armazenamento.carregar_intermediario(nome)
+                if df is None:
+                    raise FileNotFoundError(f"Entrada não encontrada: {nome}")
+                self.dados[nome] = df
+            df = self.dados[nome]
+        # Dados compartilhados por mais de uma etapa são entregues em cópia para evitar alterações cruzadas
+        return df.copy() if self._consumidores.get(nome, 0) > 1 else df
+
+    def executar_etapa(self, etapa):
+        logging.info(f"Iniciando etapa {etapa.nome}")
+        marcador = self.metricas.iniciar(etapa) if self.metricas is not None else None
+        self._marcadores[etapa.nome] = marcador
+        try:
+            funcao = getattr(importlib.import_module(etapa.modulo), etapa.funcao)
+            argumentos = {entrada: self.obter_entrada(entrada) for entrada in etapa.entradas
+                          if entrada not in self.sob_demanda or entrada in self.dados}
+            resultado = funcao(**argumentos)
+
+            if isinstance(resultado, dict):
+                saidas = resultado
+            elif resultado is not None and len(etapa.saidas) == 1:
+                saidas = {etapa.saidas[0]: resultado}
+            else:
+                saidas = {}
+
+            for saida in etapa.saidas:
+                if saida in saidas and saidas[saida] is not None:
+                    with self._trava_dados:
+                        self.dados[saida] = saidas[saida]
+                elif not armazenamento.existe_intermediario(saida):
+                    raise RuntimeError(f"Etapa {etapa.nome} não gerou a saída '{saida}'")
+        except Exception as e:
+            if marcador is not None:
+                self.metricas.finalizar(etapa, marcador, "erro", e)
+            raise
+
+        if marcador is not None:
+            registro = self.metricas.finalizar(etapa, marcador, "sucesso")
+            logging.info(f"Etapa {etapa.nome}: {registro['tempo_parede_s']}s, CPU {registro['tempo_cpu_s']}s, "
+                         f"{registro['linhas_saida']} linhas gravadas")
+        if self.controle is not None:
+            self.controle.registrar(etapa)
+        logging.info(f"Etapa {etapa.nome} concluída")
+        return etapa.nome
+
+    def _limite(self, etapa):
+        return self.metricas.timeout(etapa) if self.metricas is not None else None
+
+    def executar(self):
+        concluidas, em_execucao, prazos = set(), {}, {}
+        pool = ThreadPoolExecutor(max_workers=self.max_paralelo)
+        try:
+            while len(concluidas) < len(self.etapas):
+                for nome, etapa in self.etapas.items():
+                    prontas = self.dependencias[nome] <= concluidas
+                    if prontas and nome not in concluidas and nome not in em_execucao.values():
+                        # Etapa com a mesma impressão digital da última execução: as saídas em disco são reaproveitadas
+                        if self.controle is not None and not self.controle.deve_executar(etapa):
+                            logging.info(f"Etapa {nome} inalterada, execução pulada")
+                            if self.metricas is not None:
+                                self.metricas.registrar_pulada(etapa)
+                            concluidas.add(nome)
+                            continue
+                        futuro = pool.submit(self.executar_etapa, etapa)
+                        em_execucao[futuro] = nome
+                        limite = self._limite(etapa)
+                        prazos[futuro] = time.monotonic() + limite if limite else None
+
+                if not em_execucao:
+                    continue
+
+                restantes = [prazo - time.monotonic() for prazo in prazos.values() if prazo is not None]
+                espera = max(0, min(restantes)) if restantes else None
+                finalizadas, _ = wait(list(em_execucao), timeout=espera, return_when=FIRST_COMPLETED)
+
+                if not finalizadas:
+                    # Threads não podem ser interrompidas: a etapa é registrada com status "timeout" e o pipeline
+                    # para, mas a thread dela continua rodando. Quem chama encerra o processo (chamada_pai faz
+                    # os._exit); para isolamento completo use o modo subprocesso.
+                    atrasadas = [em_execucao[f] for f, prazo in prazos.items() if prazo is not None and prazo <= time.monotonic()]
+                    if atrasadas:
+                        for nome in atrasadas:
+                            if self._marcadores.get(nome) is not None:
+                                self.metricas.finalizar(self.etapas[nome], self._marcadores[nome], "timeout")
+                        raise TimeoutError(f"Timeout nas etapas: {atrasadas}")
+                    continue
+
+                for futuro in finalizadas:
+                    nome = em_execucao.pop(futuro)
+                    prazos.pop(futuro, None)
+                    # Uma falha interrompe o pipeline; etapas ainda não iniciadas são canceladas
+                    try:
+                        futuro.result()
+                    except Exception:
+                        logging.error(f"Falha na etapa {nome}")
+                        raise
+                    concluidas.add(nome)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        return self.dados
@@ -0,0 +1,38 @@
+import os
+import json
+import hashlib
+from datetime import datetime
+import armazenamento
+
+# Marca de publicação gravada no fim do ML1, depois de todos os artefatos de leitura: quem lê as saídas
+# (API local, camadas do mapa) recarrega quando o "id" muda e nunca vê uma execução pela metade
+ARQUIVO_PUBLICACAO = "publicacao.json"
+ARTEFATOS_PUBLICADOS = ["ML_dataframe_OPER.csv", "cubo_kpi.parquet", "cubo_kpi.json"]
+
+def caminho_publicacao(diretorio=None):
+    diretorio = armazenamento.DIRETORIO_SAIDA if diretorio is None else diretorio
+    return diretorio / ARQUIVO_PUBLICACAO
+
+def publicar(diretorio=None, artefatos=None):
+    diretorio = armazenamento.DIRETORIO_SAIDA if diretorio is None else diretorio
+    descricao = {}
+    for nome in artefatos or ARTEFATOS_PUBLICADOS:
+        caminho = diretorio / nome
+        if caminho.exists():
+            estado = caminho.stat()
+            descricao[nome] = {"tamanho": estado.st_size, "modificado_em": estado.st_mtime_ns}
+    identificador = hashlib.sha256(json.dumps(descricao, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    conteudo = {"id": identificador, "publicado_em": datetime.now().isoformat(timespec="seconds"), "artefatos": descricao}
+    caminho = caminho_publicacao(diretorio)
+    with open(caminho.with_suffix(".tmp"), "w", encoding="utf-8") as f:
+        json.dump(conteudo, f, ensure_ascii=False, indent=2)
+    os.replace(caminho.with_suffix(".tmp"), caminho)
+    print(f"Execução publicada: {identificador}")
+    return conteudo
+
+def ler_publicacao(diretorio=None):
+    caminho = caminho_publicacao(diretorio)
+    if not caminho.exists():
+        return None
+    with open(caminho, encoding="utf-8") as f:
+        return json.load(f)
@@ -0,0 +1,53 @@
+import os
+import time
+import numpy as np
+from dotenv import load_dotenv
+from sklearn.pipeline import Pipeline
+from sklearn.impute import SimpleImputer
+from sklearn.preprocessing import StandardScaler
+from sklearn.ensemble import (GradientBoostingRegressor, HistGradientBoostingRegressor)
+from sklearn.metrics import (mean_squared_error, r2_score)
+
+load_dotenv('credenciais_arquivos.env')
+
+# Regressor dos modelos de duração e de tempo de resposta do ML1, escolhido por REGRESSOR_ML:
+# "gbr" (padrão): GradientBoostingRegressor com imputação e StandardScaler, o pipeline de antes (uma thread só)
+# "histgb": HistGradientBoostingRegressor, árvores sobre histogramas (256 faixas por atributo), multithread
+#           pelo OpenMP e com suporte nativo a nulos, sem imputação nem padronização na frente. Muda as previsões:
+#           além das faixas, acima de 10 mil linhas ativa sozinho a parada antecipada (early_stopping="auto",
+#           10% do treino separados para validação). Fica opcional até o benchmark_pipeline justificar a troca
+REGRESSOR_ML = os.getenv("REGRESSOR_ML", "gbr")
+REGRESSORES = ("histgb", "gbr")
+# Peso do regressor no orçamento de núcleos do agendador (0 = uma thread só)
+PESOS_REGRESSOR = {"histgb": 1, "gbr": 0}
+
+def pipeline(regressor=REGRESSOR_ML, imputar=True):
+    # imputar=False reproduz o pipeline da resposta, que não tinha o SimpleImputer
+    if regressor not in REGRESSORES:
+        raise ValueError(f"REGRESSOR_ML inválido: {regressor} (opções: {', '.join(REGRESSORES)})")
+    if regressor == "histgb":
+        # As threads seguem o limite do threadpoolctl aplicado pelo agendador a cada treino
+        return Pipeline([('regressor', HistGradientBoostingRegressor(random_state=42))])
+    etapas = [('imputer', SimpleImputer(strategy='mean'))] if imputar else []
+    return Pipeline(etapas + [
+        ('scaler', StandardScaler()),
+        ('regressor', GradientBoostingRegressor(random_state=42))
+    ])
+
+def comparar(X_train, X_test, y_train, y_test, imputar=True, regressores=REGRESSORES):
+    # Mesmo treino/teste para cada regressor: tempo de ajuste, tempo de previsão, RMSE e R²
+    resultados = []
+    for regressor in regressores:
+        modelo = pipeline(regressor, imputar)
+        inicio = time.perf_counter()
+        modelo.fit(X_train, y_train)
+        ajuste = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        previsto = modelo.predict(X_test)
+        previsao = time.perf_counter() - inicio
+        resultados.append({"regressor": regressor, "tempo_ajuste_s": round(ajuste, 3), "tempo_previsao_s": round(previsao, 3),
+                           "rmse": float(np.sqrt(mean_squared_error(y_test, previsto))),
+                           "r2": float(r2_score(y_test, previsto))})
+        print(f"  {regressor}: ajuste {ajuste:.2f}s | previsão {previsao:.2f}s | "
+              f"RMSE {resultados[-1]['rmse']:.2f} | R² {resultados[-1]['r2']:.3f}")
+    return resultados
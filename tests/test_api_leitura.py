@@ -0,0 +1,56 @@
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DIRETORIO_SAIDA", str(Path(__file__).resolve().parent))
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+
+import armazenamento
+import cubo_kpi
+import api_leitura
+
+MUNICIPIOS = ["GOIANIA", "ANAPOLIS", "RIO VERDE - GO", "CATALAO - GO"]
+
+@pytest.fixture
+def servico(tmp_path, monkeypatch):
+    # Cubo de 400 OS sintéticas publicado no diretório temporário
+    monkeypatch.setattr(armazenamento, "DIRETORIO_SAIDA", tmp_path)
+    linhas = 400
+    df = pd.DataFrame({
+        "MUNICIPIO": [MUNICIPIOS[i % len(MUNICIPIOS)] for i in range(linhas)],
+        "PREFIXO": [f"CDN{i % 5:03d}" for i in range(linhas)],
+        "STATUS": ["COMERCIAL" if i % 3 else "EMERGENCIAL" for i in range(linhas)],
+        "DATA SOLICITACAO": pd.date_range("2024-01-01", periods=linhas, freq="6h"),
+        "EFETIVIDADE": ["NÃO EFETIVA" if i % 4 == 0 else "EFETIVA" for i in range(linhas)],
+        "TEMPO_RESPOSTA": [float(10 + i % 50) for i in range(linhas)],
+    })
+    cubo_kpi.construir(df, tmp_path)
+    return api_leitura.ServicoLeitura(tmp_path)
+
+@pytest.mark.parametrize("parametros", [{}, {"metrica": "TAXA_EFETIVIDADE", "status": "COMERCIAL"}])
+def test_camada_do_mapa(servico, parametros):
+    corpo, _ = servico.responder("/mapa/camada", parametros)
+    camada = json.loads(corpo)
+    metrica = parametros.get("metrica", "QTD_OS")
+    propriedades = [geometria["properties"] for geometria in camada["objects"]["municipios"]["geometries"]]
+    com_dados = {p["MUNICIPIO_OPER"]: p for p in propriedades if p["MUNICIPIO_OPER"] is not None}
+    assert set(com_dados) == set(MUNICIPIOS)
+    assert all(metrica in p for p in com_dados.values())
+    if "status" not in parametros:
+        assert all(p["QTD_OS"] == 100 for p in com_dados.values())
+
+def test_kpi_com_contagens_inteiras(servico):
+    corpo, _ = servico.responder("/kpi", {"status": "COMERCIAL"})
+    kpi = json.loads(corpo)["kpi"]
+    assert kpi["STATUS"] == "COMERCIAL" and kpi["MUNICIPIO"] == cubo_kpi.TODOS
+    assert type(kpi["QTD_OS"]) is int and type(kpi["QTD_EFETIVA"]) is int
+    assert isinstance(kpi["TAXA_EFETIVIDADE"], float)
+    fatia = json.loads(servico.responder("/kpi/fatia", {"por": "STATUS"})[0])["linhas"]
+    assert kpi["QTD_OS"] == next(linha["QTD_OS"] for linha in fatia if linha["STATUS"] == "COMERCIAL")
+    assert json.loads(servico.responder("/kpi", {"municipio": "INEXISTENTE"})[0])["kpi"] == {}
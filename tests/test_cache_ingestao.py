@@ -0,0 +1,28 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DIRETORIO_SAIDA", str(Path(__file__).resolve().parent))
+
+pytest.importorskip("pandas")
+
+import armazenamento
+import cache_ingestao
+
+def test_cache_dentro_do_diretorio_de_saida(tmp_path, monkeypatch):
+    monkeypatch.setattr(armazenamento, "DIRETORIO_SAIDA", tmp_path)
+    monkeypatch.chdir(tmp_path.parent)
+    saida = tmp_path / "oper_comercial.csv"
+    saida.write_text("OS\n1\n", encoding="utf-8")
+
+    manifesto = cache_ingestao.carregar_manifesto()
+    cache_ingestao.registrar(manifesto, "oper_comercial", {"ETag": "1"}, "abc", saida)
+    cache_ingestao.salvar_manifesto(manifesto)
+
+    assert (tmp_path / cache_ingestao.DIRETORIO_CACHE / cache_ingestao.ARQUIVO_MANIFESTO).exists()
+    assert (tmp_path / cache_ingestao.DIRETORIO_CACHE / "oper_comercial.csv").exists()
+    assert not (tmp_path.parent / cache_ingestao.DIRETORIO_CACHE).exists()
+    assert cache_ingestao.esta_inalterado(cache_ingestao.carregar_manifesto(), "oper_comercial", {"ETag": "1"})
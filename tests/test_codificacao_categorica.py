@@ -0,0 +1,47 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DIRETORIO_SAIDA", str(Path(__file__).resolve().parent))
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("scipy")
+
+import codificacao_categorica
+
+COLUNAS = ["TIPO OS", "MUNICIPIO"]
+
+def _atributos(tipos, municipios):
+    return pd.DataFrame({"TIPO OS": pd.Categorical(tipos), "MUNICIPIO": pd.Categorical(municipios),
+                         "MES": range(1, len(tipos) + 1)})
+
+@pytest.fixture
+def salvo(tmp_path):
+    # Vocabulário do treino gravado ao lado do modelo e lido de volta, como na previsão
+    treino = _atributos(["A", "B", "C"], ["Recife", "Olinda", "Recife"])
+    vocabulario = codificacao_categorica.vocabulario(treino, COLUNAS)
+    caminho_modelo = tmp_path / "modelo_tempo_ideal_xgb.pkl"
+    codificacao_categorica.salvar_vocabulario(vocabulario, "nativa", treino.columns, caminho_modelo)
+    assert codificacao_categorica.caminho_vocabulario(caminho_modelo).exists()
+    return codificacao_categorica.carregar_vocabulario(caminho_modelo)
+
+def test_vocabulario_ida_e_volta(salvo):
+    assert salvo["codificacao"] == "nativa"
+    assert salvo["colunas"] == ["TIPO OS", "MUNICIPIO", "MES"]
+    assert salvo["categorias"] == {"TIPO OS": ["A", "B", "C"], "MUNICIPIO": ["Olinda", "Recife"]}
+
+def test_nativa_categoria_nova_vira_nulo(salvo):
+    novas = _atributos(["B", "Z"], ["Recife", "Paulista"])
+    X = codificacao_categorica.codificar(novas, salvo["categorias"], salvo["codificacao"], salvo["colunas"])
+    assert X["TIPO OS"].cat.categories.tolist() == ["A", "B", "C"]
+    assert X["TIPO OS"].cat.codes.tolist() == [1, -1]
+    assert X["MUNICIPIO"].cat.codes.tolist() == [1, -1]
+
+def test_esparsa_categoria_nova_vira_zeros(salvo):
+    novas = _atributos(["C", "Z"], ["Recife", "Paulista"])
+    X = codificacao_categorica.codificar(novas, salvo["categorias"], "esparsa").toarray()
+    # MES, TIPO OS (B, C) e MUNICIPIO (Recife): a linha com categorias novas só tem o MES
+    assert X.tolist() == [[1, 0, 1, 1], [2, 0, 0, 0]]
@@ -0,0 +1,105 @@
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DIRETORIO_SAIDA", str(Path(__file__).resolve().parent))
+
+pytest.importorskip("pandas")
+pytest.importorskip("openpyxl")
+
+import in1_conexao_banco_planilhas as in1
+
+class RespostaFalsa:
+    def __init__(self, content):
+        self.content = content
+
+class ArquivoFalso:
+    def __init__(self, contexto, caminho):
+        self.contexto = contexto
+        self.caminho = caminho
+
+    def open_binary(self, ctxOD, caminho):
+        return self.contexto.baixar(caminho)
+
+class WebFalsa:
+    def __init__(self, contexto):
+        self.contexto = contexto
+
+    def get_file_by_server_relative_path(self, caminho):
+        return ArquivoFalso(self.contexto, caminho)
+
+class ClientContextFalso:
+    # Mesma interface usada pelo in1; acusa quando duas threads usam o mesmo contexto ao mesmo tempo
+    criados = []
+
+    def __init__(self, falhas=0):
+        self.web = WebFalsa(self)
+        self.falhas = falhas
+        self.em_uso = threading.Lock()
+        self.uso_simultaneo = False
+        self.downloads = []
+        ClientContextFalso.criados.append(self)
+
+    def load(self, objeto, campos=None):
+        pass
+
+    def execute_query(self):
+        pass
+
+    def baixar(self, caminho):
+        if not self.em_uso.acquire(blocking=False):
+            self.uso_simultaneo = True
+            raise RuntimeError("ClientContext usado por duas threads ao mesmo tempo")
+        try:
+            time.sleep(0.05)
+            if self.falhas:
+                self.falhas -= 1
+                raise ConnectionError("conexão interrompida")
+            self.downloads.append(caminho)
+            return RespostaFalsa(caminho.encode())
+        finally:
+            self.em_uso.release()
+
+@pytest.fixture
+def contextos(monkeypatch):
+    ClientContextFalso.criados = []
+    # Só o download é testado aqui: a leitura do Excel devolve o tamanho do conteúdo baixado
+    monkeypatch.setattr(in1, "processar_planilha", lambda conteudo, nome: len(conteudo))
+    return ClientContextFalso.criados
+
+ARQUIVOS = {nome: {"server_relative_url_OD": f"/arquivos/{nome}.xlsx"} for nome in ("a", "b", "c", "d")}
+
+def test_conectar_com_contexto_injetado(contextos):
+    ctxOD = in1.conectar_onedrive(ClientContextFalso)
+    assert isinstance(ctxOD, ClientContextFalso)
+    assert in1.baixar_bytes_onedrive(ctxOD, "/arquivos/a.xlsx") == b"/arquivos/a.xlsx"
+
+def test_downloads_simultaneos_com_um_contexto_por_thread(contextos):
+    ctxOD = in1.conectar_onedrive(ClientContextFalso)
+    resultados = in1.baixar_arquivos_concorrente(ctxOD, ARQUIVOS, max_downloads=3, usar_processos=False,
+                                                 conectar=lambda: in1.conectar_onedrive(ClientContextFalso))
+    assert resultados == {nome: len(config["server_relative_url_OD"]) for nome, config in ARQUIVOS.items()}
+    assert not any(contexto.uso_simultaneo for contexto in contextos)
+    assert contextos[0] is ctxOD
+    assert 1 < len(contextos) <= 3
+    assert sorted(caminho for contexto in contextos for caminho in contexto.downloads) == \
+        sorted(config["server_relative_url_OD"] for config in ARQUIVOS.values())
+
+def test_nova_tentativa_no_mesmo_contexto(contextos):
+    ctxOD = ClientContextFalso(falhas=1)
+    resultados = in1.baixar_arquivos_concorrente(ctxOD, {"a": ARQUIVOS["a"]}, max_downloads=1, usar_processos=False,
+                                                 espera_base=0, conectar=ClientContextFalso)
+    assert resultados == {"a": len("/arquivos/a.xlsx")}
+    assert contextos == [ctxOD]
+
+def test_falha_ao_conectar_so_afeta_o_proprio_arquivo(contextos):
+    ctxOD = ClientContextFalso()
+    resultados = in1.baixar_arquivos_concorrente(ctxOD, ARQUIVOS, max_downloads=4, usar_processos=False,
+                                                 conectar=lambda: None)
+    assert sum(resultado is not None for resultado in resultados.values()) >= 1
+    assert not ctxOD.uso_simultaneo
@@ -0,0 +1,88 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DIRETORIO_SAIDA", str(Path(__file__).resolve().parent))
+
+pd = pytest.importorskip("pandas")
+np = pytest.importorskip("numpy")
+
+import agregacoes
+import armazenamento
+import dimensoes
+import etl_blocos
+import particoes_oper
+import in4_DF_oper as in4
+
+def _comercial(linhas, semente=42):
+    aleatorio = np.random.default_rng(semente)
+    datas = pd.Series(pd.Timestamp("2024-01-01") + pd.to_timedelta(aleatorio.integers(0, 90 * 24, linhas), unit="h"))
+    datas[aleatorio.random(linhas) < 0.05] = pd.NaT
+    prefixos = pd.Series(aleatorio.choice(["P1", "P2", "P3", None], linhas), dtype=object)
+    return pd.DataFrame({
+        "SS_NUMERO": aleatorio.integers(0, linhas // 3, linhas),
+        "PREFIXO": prefixos,
+        "MUNICIPIO": aleatorio.choice(["GOIANIA", "ANAPOLIS", "RIO VERDE"], linhas),
+        "EFETIVIDADE_VISITA": aleatorio.choice([agregacoes.NAO_EFETIVA, "EFETIVA"], linhas),
+        "INICIO_DESLOCAMENTO": datas,
+    })
+
+def test_contadores_em_blocos_iguais_ao_completo(tmp_path):
+    df = _comercial(3000)
+    completo = agregacoes.calcular_contadores(df.copy(), "comercial")
+
+    contadores = etl_blocos.novos_contadores(tmp_path / "contadores")
+    blocos = [df.iloc[inicio:inicio + 700].copy() for inicio in range(0, len(df), 700)]
+    for bloco in blocos:
+        etl_blocos.acumular_contadores(bloco, "comercial", contadores)
+    contagens = {chave: contador.contagens() for chave, contador in contadores.items()}
+    em_blocos = [etl_blocos.aplicar_contadores(bloco, "comercial", contagens) for bloco in blocos]
+
+    for granularidade in agregacoes.GRANULARIDADES_PADRAO:
+        prefixo, cidade = agregacoes.coluna_prefixo(granularidade), agregacoes.coluna_cidade(granularidade)
+        # Mesmo tipo em todos os blocos, com ou sem balde inválido
+        assert {str(bloco[prefixo].dtype) for bloco in em_blocos} == {"Int64"}
+        assert {str(bloco[cidade].dtype) for bloco in em_blocos} == {"int64"}
+        resultado = pd.concat(em_blocos)
+        np.testing.assert_array_equal(resultado[prefixo].astype("float64").to_numpy(), completo[prefixo].to_numpy(dtype="float64"))
+        np.testing.assert_array_equal(resultado[cidade].to_numpy(), completo[cidade].to_numpy())
+    # Os pares vão para o disco e são apagados depois da contagem
+    assert not any((tmp_path / "contadores").glob("*/*.pkl"))
+
+def _tratado(colunas, linhas, valores):
+    # Arquivo tratado mínimo do in2/in3: datas, inteiros e rótulos de texto nas colunas usadas pelo in4
+    df = pd.DataFrame(index=range(linhas))
+    for coluna in colunas:
+        if coluna in valores:
+            df[coluna] = valores[coluna]
+        elif armazenamento.ESQUEMA.get(coluna) == "data":
+            df[coluna] = pd.date_range("2024-01-01 08:00", periods=linhas, freq="h")
+        elif armazenamento.ESQUEMA.get(coluna) == "inteiro":
+            df[coluna] = range(1, linhas + 1)
+        else:
+            df[coluna] = [f"{coluna} {i % 2}" for i in range(linhas)]
+    return df
+
+def test_dataframe_oper_em_blocos_igual_ao_completo(tmp_path, monkeypatch):
+    monkeypatch.setattr(armazenamento, "DIRETORIO_SAIDA", tmp_path)
+    monkeypatch.setattr(armazenamento, "FORMATO_INTERMEDIARIO", "csv")
+    monkeypatch.setattr(particoes_oper, "PARTICIONAR_OPER", False)
+    monkeypatch.setattr(etl_blocos, "TAMANHO_BLOCO", 3)
+    # ID CAUSA com nulos (left join sem correspondência): no concat o ID TIPO OS inteiro virava float64
+    emergencial = _tratado(in4.COLUNAS_EMERGENCIAL, 7, {"ID CAUSA": [1, None, 2, None, 1, 2, None]})
+    comercial = _tratado(in4.COLUNAS_COMERCIAL, 8, {"SS_NUMERO": range(100, 108)})
+    armazenamento.salvar_intermediario(emergencial, "oper_emergencial_tratado")
+    armazenamento.salvar_intermediario(comercial, "oper_comercial_tratado")
+    registro = dimensoes.RegistroDimensoes()
+    caminho = armazenamento.caminho_intermediario("dataframe_OPER")
+
+    in4.unificar_em_blocos(registro)
+    em_blocos = caminho.read_text(encoding="utf-8-sig")
+    in4.salvar_unificado(in4.juntar(registro=registro, sql=False))
+    completo = caminho.read_text(encoding="utf-8-sig")
+
+    assert em_blocos == completo
+    assert ".0;" not in completo
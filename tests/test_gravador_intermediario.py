@@ -0,0 +1,48 @@
+import importlib.util
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DIRETORIO_SAIDA", str(Path(__file__).resolve().parent))
+
+pd = pytest.importorskip("pandas")
+
+import armazenamento
+
+FORMATOS = ["csv", pytest.param("parquet", marks=pytest.mark.skipif(importlib.util.find_spec("pyarrow") is None,
+                                                                    reason="pyarrow não instalado"))]
+
+def _bloco(inicio, linhas):
+    return pd.DataFrame({"OS": range(inicio, inicio + linhas), "PREFIXO": [f"P{i % 3}" for i in range(linhas)]})
+
+@pytest.mark.parametrize("formato", FORMATOS)
+def test_blocos_publicados_so_no_fechar(tmp_path, formato):
+    with armazenamento.GravadorIntermediario("saida", tmp_path, formato) as gravador:
+        gravador.escrever(_bloco(1, 3))
+        gravador.escrever(_bloco(4, 2))
+        assert not gravador.caminho.exists()
+        gravador.fechar()
+    df = armazenamento.carregar_intermediario("saida", diretorio=tmp_path, formato=formato)
+    assert df["OS"].tolist() == [1, 2, 3, 4, 5]
+    assert [p.name for p in tmp_path.iterdir()] == [gravador.caminho.name]
+
+@pytest.mark.parametrize("formato", FORMATOS)
+def test_falha_no_meio_mantem_arquivo_anterior(tmp_path, formato):
+    armazenamento.salvar_intermediario(_bloco(1, 4), "saida", tmp_path, formato)
+    with pytest.raises(RuntimeError):
+        with armazenamento.GravadorIntermediario("saida", tmp_path, formato) as gravador:
+            gravador.escrever(_bloco(100, 2))
+            raise RuntimeError("planilha corrompida no meio da leitura")
+    df = armazenamento.carregar_intermediario("saida", diretorio=tmp_path, formato=formato)
+    assert df["OS"].tolist() == [1, 2, 3, 4]
+    assert [p.name for p in tmp_path.iterdir()] == [gravador.caminho.name]
+
+@pytest.mark.parametrize("formato", FORMATOS)
+def test_sem_blocos_grava_so_o_cabecalho(tmp_path, formato):
+    with armazenamento.GravadorIntermediario("saida", tmp_path, formato) as gravador:
+        gravador.fechar(colunas_vazio=["OS", "PREFIXO"])
+    df = armazenamento.carregar_intermediario("saida", diretorio=tmp_path, formato=formato)
+    assert list(df.columns) == ["OS", "PREFIXO"] and df.empty
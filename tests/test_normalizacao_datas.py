@@ -0,0 +1,22 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+pd = pytest.importorskip("pandas")
+
+import normalizacao_datas
+
+def test_mesmo_texto_em_formatos_diferentes():
+    # 03/04/2024 é 3 de abril num arquivo dia/mês e 4 de março na conversão padrão (mês primeiro)
+    normalizacao_datas.limpar_cache()
+    serie = pd.Series(["03/04/2024", "15/04/2024"])
+    dia_mes = normalizacao_datas.converter_serie(serie, "%d/%m/%Y")
+    padrao = normalizacao_datas.converter_serie(pd.Series(["03/04/2024"]), None)
+    de_novo = normalizacao_datas.converter_serie(serie, "%d/%m/%Y")
+
+    assert dia_mes[0] == pd.Timestamp("2024-04-03")
+    assert padrao[0] == pd.Timestamp("2024-03-04")
+    assert de_novo.tolist() == dia_mes.tolist()
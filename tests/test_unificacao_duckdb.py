@@ -0,0 +1,59 @@
+import os
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DIRETORIO_SAIDA", str(Path(__file__).resolve().parent))
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+pytest.importorskip("duckdb")
+
+import armazenamento
+import dimensoes
+import motor_sql
+import in4_DF_oper as in4
+
+def _fonte(colunas, linhas, valores):
+    # Arquivo tratado mínimo: datas, inteiros e rótulos de texto em todas as colunas usadas pelo in4
+    df = pd.DataFrame(index=range(linhas))
+    for coluna in colunas:
+        if coluna in valores:
+            df[coluna] = valores[coluna]
+        elif armazenamento.ESQUEMA.get(coluna) == "data":
+            df[coluna] = pd.date_range("2024-01-01 08:00", periods=linhas, freq="h")
+        elif armazenamento.ESQUEMA.get(coluna) == "inteiro":
+            df[coluna] = range(1, linhas + 1)
+        else:
+            df[coluna] = [f"{coluna} {i % 2}" for i in range(linhas)]
+    return df
+
+@pytest.fixture
+def diretorio(tmp_path, monkeypatch):
+    monkeypatch.setattr(armazenamento, "DIRETORIO_SAIDA", tmp_path)
+    monkeypatch.setattr(armazenamento, "FORMATO_INTERMEDIARIO", "parquet")
+    monkeypatch.setattr(motor_sql, "ATIVO", True)
+    monkeypatch.setattr(motor_sql, "_local", threading.local())
+    return tmp_path
+
+@pytest.mark.parametrize("os_comercial", [["SS-123", "SS-124", "SS-125"], [201, 202, 203]])
+def test_duckdb_igual_ao_pandas(diretorio, os_comercial):
+    emergencial = _fonte(in4.COLUNAS_EMERGENCIAL, 4, {"OS": [101, 102, 103, 104], "TEMPO_RESPOSTA": [10, None, 30, 40]})
+    comercial = _fonte(in4.COLUNAS_COMERCIAL, 3, {"SS_NUMERO": os_comercial})
+    armazenamento.salvar_intermediario(emergencial, "oper_emergencial_tratado")
+    armazenamento.salvar_intermediario(comercial, "oper_comercial_tratado")
+    registro = dimensoes.RegistroDimensoes()
+
+    df_pandas = in4.juntar(registro=registro, sql=False)
+    df_sql = in4.juntar(registro=registro, sql=True)
+
+    pd.testing.assert_frame_equal(df_sql, df_pandas)
+    assert df_sql["OS"].tolist() == [101, 102, 103, 104] + os_comercial
+
+def test_unificacao_em_sql_le_do_disco(diretorio):
+    # Com o DuckDB ativo, o in4 recebe os tratados sob demanda (lidos do Parquet), não em memória
+    import chamada_pai
+    assert {"oper_comercial_tratado", "oper_emergencial_tratado"} <= chamada_pai.entradas_sob_demanda()